@@ -35,9 +35,11 @@ make_neutrino_full () {
 # make_neutrino eng_muon_nu_fhc_files.root 14 1;
 # make_neutrino eng_muon_nu_rhc_files.root 14 rhc;
 
-# make the full neutrino files
-make_neutrino_full simple_electron_nu_fhc_files.root 12 1;
-make_neutrino_full simple_electron_nu_rhc_files.root 12 rhc;
+# make the full neutrino files, each step in its own directory so the chains
+# run concurrently, and skipping steps whose inputs have not changed
+python3 ./scripts/neutPipeline.py --full --prefix simple --flavours electron "$@";
+# make_neutrino_full simple_electron_nu_fhc_files.root 12 1;
+# make_neutrino_full simple_electron_nu_rhc_files.root 12 rhc;
 
 # make_neutrino_full eng_aelectron_nu_fhc_files.root -12 1;
 # make_neutrino_full eng_aelectron_nu_rhc_files.root -12 rhc;
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import re
+import sys
+
+## Catalog of the neutrino data files. The data directories are scanned once,
+## the metadata in each file name is parsed, and the result is kept in a json
+## catalog so later runs only rescan directories whose mtime changed. Files are
+## indexed by (kind, FHC, nHC, x, y, z, seed, zaxis), where kind is one of:
+##   src  - FHC_1.root
+##   sort - FHC_1_x-100_y-200_z-300_seed-1_zaxis-1_sorted.root
+##   rtd  - FHC_1_x-100_y-200_z-300_seed-1_zaxis-1_sorted_rtd.root
+##
+## Build or refresh a catalog with:
+##   python neutCatalog.py catalog.json ../data_radiogen/neutrinos/sorted ../data_radiogen/neutrinos/rtd
+
+KEY_FIELDS = ["FHC", "nHC", "xpos", "ypos", "zpos", "seed", "atZ"]
+
+SRC_NAME = re.compile(r"^(FHC|RHC)_(\d+)\.root$")
+SORT_NAME = re.compile(r"^(FHC|RHC)_(\d+)_x-(-?\d+)_y-(-?\d+)_z-(-?\d+)_seed-(-?\d+)_zaxis-(\d+)(.*)\.root$")
+
+def baseName(fileName):
+    """
+    file name without its directory, for both windows and posix paths
+    """
+    return re.split(r"[\\/]", fileName)[-1]
+
+def parseName(fileName):
+    """
+    parse the metadata of a neutrino data file name
+
+    returns dictionary of kind and the KEY_FIELDS, with the fields a src file
+    does not have set to None, or None if the name is not a neutrino file
+    """
+    name = baseName(fileName)
+    m = SRC_NAME.match(name)
+    if m is not None:
+        return {"kind": "src", "FHC": m.group(1) == "FHC", "nHC": int(m.group(2)),
+                "xpos": None, "ypos": None, "zpos": None, "seed": None, "atZ": None}
+    m = SORT_NAME.match(name)
+    if m is None:
+        return None
+    return {"kind": "rtd" if m.group(8).endswith("_rtd") else "sort",
+            "FHC": m.group(1) == "FHC", "nHC": int(m.group(2)),
+            "xpos": int(m.group(3)), "ypos": int(m.group(4)), "zpos": int(m.group(5)),
+            "seed": int(m.group(6)), "atZ": int(m.group(7)) == 1}
+
+def catalogKey(kind, FHC, nHC, xpos=None, ypos=None, zpos=None, seed=None, atZ=None):
+    return (kind, bool(FHC), int(nHC), xpos, ypos, zpos, seed, None if atZ is None else bool(atZ))
+
+class FileCatalog():
+    """
+    Indexed catalog of the neutrino files within dirs, see module notes.
+
+    ARGS:
+        catalogFile - json file the catalog is kept in, None to keep it in memory
+        dirs        - data directories to scan
+    """
+    def __init__(self, catalogFile=None, dirs=()):
+        self.catalogFile = catalogFile
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self._catalog = {"dirs": {}, "files": {}}
+        if catalogFile is not None and os.path.isfile(catalogFile):
+            with open(catalogFile, "r") as f:
+                self._catalog = json.load(f)
+        self._index = None
+
+    @property
+    def files(self):
+        return self._catalog["files"]
+
+    def Refresh(self):
+        """
+        rescan the directories whose mtime changed since the last refresh, and
+        drop the entries of directories which no longer exist
+
+        returns the number of directories rescanned
+        """
+        rescanned = 0
+        for d in self.dirs:
+            if not os.path.isdir(d):
+                print("WARNING: did not find data directory: ", d)
+                continue
+            mtime = os.stat(d).st_mtime
+            if self._catalog["dirs"].get(d) == mtime:
+                continue
+
+            old = {path: entry for path, entry in self.files.items() if os.path.dirname(path) == d}
+            for path in old:
+                del self.files[path]
+            for entry in os.scandir(d):
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                prev = old.get(entry.path)
+                if prev is not None and prev["mtime"] == st.st_mtime and prev["size"] == st.st_size:
+                    self.files[entry.path] = prev
+                    continue
+                meta = parseName(entry.name)
+                if meta is not None:
+                    self.files[entry.path] = dict(meta, mtime=st.st_mtime, size=st.st_size)
+            self._catalog["dirs"][d] = mtime
+            rescanned += 1
+
+        for d in list(self._catalog["dirs"]):
+            if not os.path.isdir(d):
+                del self._catalog["dirs"][d]
+                for path in [p for p in self.files if os.path.dirname(p) == d]:
+                    del self.files[path]
+
+        self._index = None
+        return rescanned
+
+    def Index(self):
+        """
+        dictionary of catalogKey -> file path, built once per refresh
+        """
+        if self._index is None:
+            self._index = {catalogKey(e["kind"], *[e[k] for k in KEY_FIELDS]): path for path, e in self.files.items()}
+        return self._index
+
+    def Lookup(self, kind, FHC, nHC, xpos=None, ypos=None, zpos=None, seed=None, atZ=None):
+        """
+        path of the file of kind with the given metadata, None if not cataloged
+        """
+        return self.Index().get(catalogKey(kind, FHC, nHC, xpos, ypos, zpos, seed, atZ))
+
+    def Match(self, kind, fileName):
+        """
+        path of the file of kind with the same metadata as fileName, ie the rtd
+        file of a sort file, None if not cataloged
+        """
+        meta = self.Meta(fileName)
+        if meta is None:
+            return None
+        return self.Lookup(kind, *[meta[key] for key in KEY_FIELDS])
+
+    def Meta(self, fileName):
+        """
+        metadata of a file, from the catalog if present, else parsed from its name
+        """
+        entry = self.files.get(os.path.abspath(fileName))
+        return entry if entry is not None else parseName(fileName)
+
+    def Files(self, kind=None):
+        """
+        sorted list of the cataloged files, optionally only of one kind
+        """
+        return sorted(path for path, e in self.files.items() if kind is None or e["kind"] == kind)
+
+    def Save(self):
+        """
+        write the catalog, replaced atomically
+        """
+        if self.catalogFile is None:
+            return
+        with open(self.catalogFile + ".tmp", "w") as f:
+            json.dump(self._catalog, f, indent=1)
+        os.replace(self.catalogFile + ".tmp", self.catalogFile)
+
+def openCatalog(catalogFile, dirs):
+    """
+    load, refresh and save the catalog of dirs
+    """
+    catalog = FileCatalog(catalogFile, dirs)
+    catalog.Refresh()
+    catalog.Save()
+    return catalog
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build or refresh the catalog of neutrino data files")
+    parser.add_argument("catalog", help="json catalog file")
+    parser.add_argument("dirs", nargs="+", help="data directories to scan")
+    args = parser.parse_args(argv)
+
+    catalog = FileCatalog(args.catalog, args.dirs)
+    rescanned = catalog.Refresh()
+    catalog.Save()
+    counts = {}
+    for entry in catalog.files.values():
+        counts[entry["kind"]] = counts.get(entry["kind"], 0) + 1
+    print(f"rescanned {rescanned}/{len(args.dirs)} directories, cataloged:",
+          ", ".join(f"{n} {kind}" for kind, n in sorted(counts.items())))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,9 +4,17 @@ ROOT.gROOT.SetBatch(True)
 ROOT.gROOT.SetStyle("Pub")
 
 import os
+import shutil
+import multiprocessing as mp
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulation-software"))
+from QpixSummary import SweepSummary, ExactQuantile, TransactionAverage
 
 # build the table headers here, the respective function calls in main fill and add
 from texttable import Texttable
@@ -42,6 +50,9 @@ pd.options.mode.chained_assignment = None
 
 # neutrino globals
 OUTPUT_FILE = "anaGraphs.root"
+# objects of an input file kept read at once, and processes rendering the graphs
+OBJ_CACHE_SIZE = 64
+NPROC = min(8, os.cpu_count() or 1)
 theta_dirs = [f"Theta{i}_const" for i in range(1, 6)]
 theta_v = [0, 2, -2, 90, -90]
 zpos_dirs = [f"zpos{i}" for i in range(1, 6)]
@@ -89,14 +100,27 @@ def saveTable(tab, fi):
 
 class canvas_counter:
     """
-    Manage creation of output graphs for neutAna into output_file
+    Manage creation of output graphs for neutAna into output_file, which is
+    only opened once something is written to it
     """
-    def __init__(self):
+    def __init__(self, output_file=OUTPUT_FILE):
         self.cnt = 0
         self._obj = []
-        self.tf = ROOT.TFile(OUTPUT_FILE, "RECREATE")
+        self.output_file = output_file
+        self._tf = None
         self._canvas = ROOT.TCanvas(f"c", f"c", 1000, 1000)
 
+    @property
+    def tf(self):
+        if self._tf is None:
+            self._tf = ROOT.TFile(self.output_file, "RECREATE")
+        return self._tf
+
+    def Close(self):
+        if self._tf is not None:
+            self._tf.Close()
+            self._tf = None
+
     def Add(self, obj, output_dir, x_axis_title=None, y_axis_title=None, saveGraphs=None, legend_pos=None):
         """
         Add an object to the canvas, do some things with it, and save it to the
@@ -136,6 +160,76 @@ class canvas_counter:
 root_canvas = canvas_counter()
 
 
+class ObjectCache:
+    """
+    Least recently used cache of the objects read from a root file, holding at
+    most maxObjects. Histograms belong to their file as usual in ROOT until they
+    are evicted, when they are detached from it and handed to python, so that
+    like any other evicted object they are freed once unused.
+    """
+    def __init__(self, maxObjects=OBJ_CACHE_SIZE):
+        self.maxObjects = maxObjects
+        self._objs = OrderedDict()
+
+    def Get(self, tdir, key, name):
+        if key in self._objs:
+            self._objs.move_to_end(key)
+            return self._objs[key]
+        obj = tdir.Get(name)
+        if not obj:
+            raise KeyError(name)
+        if not isinstance(obj, ROOT.TH1):
+            ROOT.SetOwnership(obj, True)
+        self._objs[key] = obj
+        while len(self._objs) > self.maxObjects:
+            _, old = self._objs.popitem(last=False)
+            if isinstance(old, ROOT.TH1):
+                old.SetDirectory(ROOT.nullptr)
+                ROOT.SetOwnership(old, True)
+        return obj
+
+
+class LazyRootDir:
+    """
+    Dictionary like view of one directory of a root file, the key names are
+    listed up front but an object is only read when it is asked for
+    """
+    def __init__(self, tdir, cache, path):
+        self._dir = tdir
+        self._cache = cache
+        self._path = path
+        self._keys = None
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = [k.GetName() for k in self._dir.GetListOfKeys()]
+        return self._keys
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __getitem__(self, name):
+        return self._cache.Get(self._dir, (*self._path, name), name)
+
+
+class LazyRootData:
+    """
+    Replaces the tf_dict of every object in the output of neutAna.cpp, indexed
+    the same way as tf_dict[theta_dir][zpos_dir][name]
+    """
+    def __init__(self, tf, maxObjects=OBJ_CACHE_SIZE):
+        self._tf = tf
+        self._cache = ObjectCache(maxObjects)
+        self._dirs = {}
+
+    def __getitem__(self, theta_dir):
+        if theta_dir not in self._dirs:
+            tdir = getattr(self._tf, theta_dir)
+            self._dirs[theta_dir] = {zdir: LazyRootDir(getattr(tdir, zdir), self._cache, (theta_dir, zdir))
+                                     for zdir in zpos_dirs}
+        return self._dirs[theta_dir]
+
+
 def make_stack_hist(hist_list, output_name, x_axis_title=None, y_axis_title=None, title=None):
     """
     receive a list of histograms, stack them into a TStack
@@ -245,6 +339,23 @@ def make_integral_hist(hists, output_name, tdirs, zdirs, lepPdg, isFHC, x_axis_t
     return makeMultiGraph(graphs, output_name, x_axis_title, y_axis_title, title)
 
 
+def binned_stats(x, y, x_bins):
+    """
+    group the points by the lower edge of their x_bin, x below the first edge
+    is grouped at 0 and x beyond the last edge at the last edge
+
+    returns tuple of (bin, mean, std, count) arrays of the occupied bins, in bin order
+    """
+    x_bins = np.asarray(x_bins, dtype=np.double)
+    ind = np.digitize(x, x_bins)
+    edges = np.where(ind == 0, 0, x_bins[np.maximum(ind - 1, 0)])
+
+    unique_ind, inverse = np.unique(edges, return_inverse=True)
+    count = np.bincount(inverse)
+    mean = np.bincount(inverse, weights=y) / count
+    var = np.bincount(inverse, weights=(y - mean[inverse])**2) / count
+    return unique_ind, mean, np.sqrt(var), count
+
 def make_average_tmg(graphs, output_name, x_bins, title=None):
     """
     each graph represents an ASIC in this cut with the corresponding x, y value
@@ -256,34 +367,24 @@ def make_average_tmg(graphs, output_name, x_bins, title=None):
     nGraphs = len(graphs)
     assert nGraphs > 0, "did not receive any graphs at make_average_tmg"
 
-    def bin(x):
-        prev_bin = 0
-        for i, x_bin in enumerate(x_bins):
-            if x < x_bin:
-                return prev_bin
-            else:
-                prev_bin = x_bin
-        return x_bin
-
-
     newGraphs = []
     for graph in graphs:
         nPoints = graph.GetN()
+        if nPoints == 0:
+            print(f"warning {graph.GetName()} has no points at make_average_tmg")
+            continue
 
-        data = [ graph.GetPointY(i) for i in range(nPoints) ]
-        graph_bin = sorted([ bin(graph.GetPointX(i)) for i in range(nPoints) ])
-
-        graph_ind, data = zip(*sorted(zip(graph_bin, data)))
-        unique_ind = np.array(np.unique(graph_ind), dtype=np.double)
-        data_ind = [[d for ind, d in zip(graph_ind, data) if ind == uid] for uid in unique_ind]
-        mean_data = np.array([ np.mean(data) for data in data_ind], dtype=np.double)
+        # read the points straight from the graph's buffers
+        x = np.frombuffer(graph.GetX(), dtype=np.double, count=nPoints)
+        y = np.frombuffer(graph.GetY(), dtype=np.double, count=nPoints)
+        unique_ind, mean_data, std_data, _ = binned_stats(x, y, x_bins)
 
         # errors
-        ex = np.array([0]*len(unique_ind), dtype=np.double)
-        # std_data = np.array([np.std(d) for d in data], dtype=np.double)
+        ex = np.zeros(len(unique_ind), dtype=np.double)
 
-        new_graph = ROOT.TGraphErrors(len(unique_ind), unique_ind, mean_data, ex, 0)
-        new_graph.Fit("pol1", "Q")
+        new_graph = ROOT.TGraphErrors(len(unique_ind), unique_ind, mean_data, ex, std_data)
+        # the error bars only show the spread, the fit is unweighted as before
+        new_graph.Fit("pol1", "QW")
         new_graph.SetLineColor(graph.GetLineColor())
         fit_line = new_graph.GetListOfFunctions().FindObject("pol1")
         fit_line.SetLineWidth(1)
@@ -335,48 +436,149 @@ def makeGraphs(tf_dict, tdirs, zdirs, output_dir, graph_name, output_name, x_axi
         root_canvas.Add(tmg, output_dir, x_axis_title, y_axis_title, saveGraphs=sg, legend_pos="tl")
 
 
-def readRootDataFile(infile, file_dir="test", lepPdg=None, isFHC=None, saveGraphs=False):
-    """
-    how to parse the output data graph of neutAna.cpp
-    """
+# (graph name, output name, x title, y title, saved pdf name, tabulated for constant theta)
+NEUT_GRAPHS = [
+    ("hTile", "tile", "Tile Resets", "Counts", "Tile", False),
+    ("hAsic", "asic", "FIFO Depth", "Counts", "ASIC", True),
+    ("hAsicWeight", "asic_weight", "FIFO Depth", "Counts", "weightASIC", True),
+    ("tgLepKEAsic", "LepKE_AsicResets", "Lepton KE (MeV)", "Max FIFO Depth", "ASIC_lepKE", False),
+    ("tgLepKETile", "LepKE_TileResets", "Lepton KE (MeV)", "Max APA Resets", "Tile_lepKE", False),
+    ("tgEnergyDepAsic", "EnergyDep_AsicResets", "Energy Deposit (MeV)", "Max FIFO Depth", "ASIC_EnergyDep", False),
+    ("tgEnergyDepTile", "EnergyDep_TileResets", "Energy Deposit (MeV)", "Max APA Resets", "Tile_EnergyDep", False),
+]
+
 
+def openRootDataFile(infile):
     tf = ROOT.TFile(infile, "read")
     if tf.IsZombie():
         print("unable to find root file")
         sys.exit(-1)
+    return tf
 
-    tf_dict = {
-        theta_dir: {zdir: {f.GetName(): f.ReadObj() for f in getattr(getattr(tf, theta_dir), zdir).GetListOfKeys()} for
-                    zdir in zpos_dirs} for theta_dir in theta_dirs}
 
-    # top level dir
+def makeDirGraphs(tf_dict, kind, i, output_dir, lepPdg=None, isFHC=None, saveGraphs=False):
+    """
+    make the graphs of one output directory, at constant theta_dirs[i] when kind
+    is "theta" or at constant zpos_dirs[i] when kind is "zpos"
+    """
+    sg = saveGraphs
+    for graph_name, output_name, x_axis_title, y_axis_title, save_name, tabulate in NEUT_GRAPHS:
+        if kind == "theta":
+            makeGraphs(tf_dict, theta_dirs[i], zpos_dirs, output_dir, graph_name, f"{output_name}_cZpos", x_axis_title, y_axis_title,
+                       lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_{save_name}" if sg else None, add_to_table=tabulate)
+        else:
+            makeGraphs(tf_dict, theta_dirs, zpos_dirs[i], output_dir, graph_name, f"{output_name}_cTheta", x_axis_title, y_axis_title,
+                       lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_{save_name}" if sg else None)
+
+
+def graphJobs(infile, file_dir="test", lepPdg=None, isFHC=None, saveGraphs=False):
+    """
+    the independent output directories of one input file, as the order they were written in
+    """
+    return [(infile, file_dir, lepPdg, isFHC, saveGraphs, kind, i)
+            for kind, dirs in (("theta", theta_dirs), ("zpos", zpos_dirs)) for i in range(len(dirs))]
+
+
+def outputDirs(file_dir):
+    """
+    the top level directory of an input file within the output file, with its
+    zpos and theta directories
+    """
     fdir = root_canvas.tf.mkdir(file_dir)
     zdir = [fdir.mkdir(zp) for zp in zpos_dirs]
     tdir = [fdir.mkdir(tp) for tp in theta_dirs]
+    return {"zpos": zdir, "theta": tdir}
 
-    # control for theta graphs
-    for i, (theta_dir, td) in enumerate(zip(theta_dirs, tdir)):
-        sg = saveGraphs
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "hTile",  "tile_cZpos", "Tile Resets", "Counts", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_Tile" if sg else None)
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "hAsic",  "asic_cZpos", "FIFO Depth", "Counts", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_ASIC" if sg else None, add_to_table=True)
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "hAsicWeight",  "asic_weight_cZpos", "FIFO Depth", "Counts", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_weightASIC" if sg else None, add_to_table=True)
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "tgLepKEAsic", "LepKE_AsicResets_cZpos",  "Lepton KE (MeV)", "Max FIFO Depth", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_ASIC_lepKE" if sg else None)
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "tgLepKETile", "LepKE_TileResets_cZpos",  "Lepton KE (MeV)", "Max APA Resets", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_Tile_lepKE" if sg else None)
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "tgEnergyDepAsic", "EnergyDep_AsicResets_cZpos",  "Energy Deposit (MeV)", "Max FIFO Depth", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_ASIC_EnergyDep" if sg else None)
-        makeGraphs(tf_dict, theta_dir, zpos_dirs, td, "tgEnergyDepTile", "EnergyDep_TileResets_cZpos",  "Energy Deposit (MeV)", "Max APA Resets", lepPdg, isFHC, saveGraphs=f"Const_Theta{theta_values[theta_dirs[i]]}_Tile_EnergyDep" if sg else None)
-
-    # control for zpos graphs
-    for i, (zpos_dir, zd) in enumerate(zip(zpos_dirs, zdir)):
-        sg = saveGraphs
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, zd, "hTile",  "tile_cTheta", "Tile Resets", "Counts", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_Tile" if sg else None)
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, zd, "hAsic",  "asic_cTheta", "FIFO Depth", "Counts", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_ASIC" if sg else None)
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, zd, "hAsicWeight",  "asic_weight_cTheta", "FIFO Depth", "Counts", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_weightASIC" if sg else None)
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, zd, "tgLepKEAsic", "LepKE_AsicResets_cTheta",  "Lepton KE (MeV)", "Max FIFO Depth", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_ASIC_lepKE" if sg else None)
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, zd, "tgLepKETile", "LepKE_TileResets_cTheta",  "Lepton KE (MeV)", "Max APA Resets", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_Tile_lepKE" if sg else None)
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, td, "tgEnergyDepAsic", "EnergyDep_AsicResets_cTheta",  "Energy Deposit (MeV)", "Max FIFO Depth", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_ASIC_EnergyDep" if sg else None)
-        makeGraphs(tf_dict, theta_dirs, zpos_dir, td, "tgEnergyDepTile", "EnergyDep_TileResets_cTheta",  "Energy Deposit (MeV)", "Max APA Resets", lepPdg, isFHC, saveGraphs=f"Const_Z{zpos_values[zpos_dirs[i]]}_Tile_EnergyDep" if sg else None)
 
+def renderPart(job):
+    """
+    worker of readRootDataFiles, render one output directory into its own part
+    file and return the rows it added to the tables
+    """
+    global root_canvas
+    infile, file_dir, lepPdg, isFHC, saveGraphs, kind, i, part = job
+    root_canvas = canvas_counter(part)
+    nRows, nRowsW = len(table_neut_buf_data), len(table_neut_buf_w_data)
+
+    tf = openRootDataFile(infile)
+    dirs = theta_dirs if kind == "theta" else zpos_dirs
+    output_dir = root_canvas.tf.mkdir(file_dir).mkdir(dirs[i])
+    makeDirGraphs(LazyRootData(tf), kind, i, output_dir, lepPdg, isFHC, saveGraphs)
     tf.Close()
+    root_canvas.Close()
+    return table_neut_buf_data[nRows:], table_neut_buf_w_data[nRowsW:]
+
+
+def mergePart(src, dst):
+    """
+    copy every object of the src directory tree into dst. The cycles of a name
+    are listed newest first, so they are copied oldest first to keep their order.
+    """
+    cycles = OrderedDict()
+    for key in src.GetListOfKeys():
+        cycles.setdefault(key.GetName(), []).append(key)
+    for name, keys in cycles.items():
+        if keys[0].IsFolder() and keys[0].GetClassName().startswith("TDirectory"):
+            sub = dst.GetDirectory(name)
+            if not sub:
+                sub = dst.mkdir(name)
+            mergePart(src.GetDirectory(name), sub)
+            continue
+        for key in sorted(keys, key=lambda k: k.GetCycle()):
+            obj = key.ReadObj()
+            dst.cd()
+            obj.Write(name)
+
+
+def readRootDataFiles(runs, nproc=1):
+    """
+    read several outputs of neutAna.cpp, where runs is a list of dictionaries of
+    the readRootDataFile arguments.
+
+    With nproc > 1 every output directory is rendered by a worker process into a
+    part file next to OUTPUT_FILE. The parts are merged into it in the same order
+    the directories are made sequentially, and the tables are filled with the
+    rows the workers return, also in order.
+    """
+    jobs = [job for run in runs for job in graphJobs(**run)]
+    outDirs = {}
+    for run in runs:
+        file_dir = run.get("file_dir", "test")
+        if file_dir not in outDirs:
+            outDirs[file_dir] = outputDirs(file_dir)
+
+    if nproc <= 1:
+        for run in runs:
+            tf = openRootDataFile(run["infile"])
+            tf_dict = LazyRootData(tf)
+            for infile, file_dir, lepPdg, isFHC, saveGraphs, kind, i in graphJobs(**run):
+                makeDirGraphs(tf_dict, kind, i, outDirs[file_dir][kind][i], lepPdg, isFHC, saveGraphs)
+            tf.Close()
+        return
+
+    part_dir = root_canvas.output_file + ".parts"
+    os.makedirs(part_dir, exist_ok=True)
+    parts = [os.path.join(part_dir, f"part-{n}.root") for n in range(len(jobs))]
+
+    # fresh workers, so that none inherit the open output file, and each exits
+    # after its directory to release whatever it read
+    with mp.get_context("spawn").Pool(min(nproc, len(jobs)), maxtasksperchild=1) as pool:
+        rows = pool.map(renderPart, [job + (part,) for job, part in zip(jobs, parts)])
+
+    for job, part, (buf_rows, buf_w_rows) in zip(jobs, parts, rows):
+        table_neut_buf_data.extend(buf_rows)
+        table_neut_buf_w_data.extend(buf_w_rows)
+        ptf = openRootDataFile(part)
+        mergePart(ptf, root_canvas.tf)
+        ptf.Close()
+    shutil.rmtree(part_dir)
+
+
+def readRootDataFile(infile, file_dir="test", lepPdg=None, isFHC=None, saveGraphs=False, nproc=1):
+    """
+    how to parse the output data graph of neutAna.cpp
+    """
+    readRootDataFiles([dict(infile=infile, file_dir=file_dir, lepPdg=lepPdg, isFHC=isFHC, saveGraphs=saveGraphs)], nproc)
 
 
 ###############################################################################
@@ -385,11 +587,11 @@ def readRootDataFile(infile, file_dir="test", lepPdg=None, isFHC=None, saveGraph
 
 
 def makePullGraphs(df, size, output_name, input_file):
-    df['size'] = df['AsicX'].map(len)
-    sizes = pd.unique(df['size'])
+    if 'size' not in df:
+        df['size'] = df['AsicX'].map(len)
     df = df[df['size'] == size]
     routes = ["left", "snake", "trunk"]
-    df["Remote Transaction Average"] = df['Remote Transactions'].map(np.mean)
+    df["Remote Transaction Average"] = TransactionAverage(df)
 
     remote_trans_avg = [0 for i in range(len(routes)+1)]
     conf95_intervals = [0 for i in range(len(routes)+1)]
@@ -408,21 +610,11 @@ def makePullGraphs(df, size, output_name, input_file):
         if counts == 0:
             continue
 
-        # find the 90% and 99% intervals here
-        remote_data = sorted(route_df["Max Remote"])
-        len_1p = int(0.01 * (len(remote_data)))
-        len_10p = int(0.10 * (len(remote_data)))
-        len_5p = int(0.05 * (len(remote_data)))
-        maxSize = len(remote_data) if len(remote_data) > maxSize else maxSize
-        conf99_intervals[i] = remote_data[-len_1p+1]
-        conf95_intervals[i] = remote_data[-len_5p+1]
-
-        local_data = sorted(route_df["Max Local"])
-        len_1p = int(0.01 * (len(local_data)))
-        len_10p = int(0.10 * (len(local_data)))
-        len_5p = int(0.05 * (len(local_data)))
-        maxSize = len(local_data) if len(local_data) > maxSize else maxSize
-        conf99_intervals[-1] = local_data[-len_1p+1]
+        # find the 95% and 99% intervals here, as the sweep summaries define them
+        maxSize = counts if counts > maxSize else maxSize
+        conf99_intervals[i] = ExactQuantile(route_df["Max Remote"], 0.99)
+        conf95_intervals[i] = ExactQuantile(route_df["Max Remote"], 0.95)
+        conf99_intervals[-1] = ExactQuantile(route_df["Max Local"], 0.99)
         
         remote_trans_avg[i] = np.mean(route_df["Remote Transaction Average"])
         remote_trans_avg[-1] = np.mean(route_df["Injected Size"])
@@ -492,11 +684,11 @@ def makePushGraphs(df, size, output_name, input_file):
 
     which is currently only the snake graph of the pull version
     """
-    df['size'] = df['AsicX'].map(len)
-    sizes = pd.unique(df['size'])
+    if 'size' not in df:
+        df['size'] = df['AsicX'].map(len)
     df = df[df['size'] == size]
     routes = ["snake"]
-    df["Remote Transaction Average"] = df['Remote Transactions'].map(np.mean)
+    df["Remote Transaction Average"] = TransactionAverage(df)
 
     remote_trans_avg = [0 for i in range(len(routes)+1)]
     conf95_intervals = [0 for i in range(len(routes)+1)]
@@ -518,21 +710,11 @@ def makePushGraphs(df, size, output_name, input_file):
         if counts == 0:
             continue
 
-        # find the 90% and 99% intervals here
-        remote_data = sorted(route_df["Max Remote"])
-        len_1p = int(0.01 * (len(remote_data)))
-        len_10p = int(0.10 * (len(remote_data)))
-        len_5p = int(0.05 * (len(remote_data)))
-        maxSize = len(remote_data) if len(remote_data) > maxSize else maxSize
-        conf99_intervals[i] = remote_data[-len_1p+1]
-        conf95_intervals[i] = remote_data[-len_5p+1]
-
-        local_data = sorted(route_df["Max Local"])
-        len_1p = int(0.01 * (len(local_data)))
-        len_10p = int(0.10 * (len(local_data)))
-        len_5p = int(0.05 * (len(local_data)))
-        maxSize = len(local_data) if len(local_data) > maxSize else maxSize
-        conf99_intervals[-1] = local_data[-len_1p+1]
+        # find the 95% and 99% intervals here, as the sweep summaries define them
+        maxSize = counts if counts > maxSize else maxSize
+        conf99_intervals[i] = ExactQuantile(route_df["Max Remote"], 0.99)
+        conf95_intervals[i] = ExactQuantile(route_df["Max Remote"], 0.95)
+        conf99_intervals[-1] = ExactQuantile(route_df["Max Local"], 0.99)
         
         remote_trans_avg[i] = np.mean(route_df["Remote Transaction Average"])
         remote_trans_avg[-1] = np.mean(route_df["Injected Size"])
@@ -587,34 +769,131 @@ def makePushGraphs(df, size, output_name, input_file):
     fig.savefig(OUTPUT_IMAGE_DIR+f"/{output_name}_push_remote_transactions.png")
     plt.close(fig)
 
+# columns of the sweep results used by the digital graphs, with the average
+# Remote Transactions, or the per ASIC ones of results without it
+SWEEP_COLUMNS = ["Architecture", "Route", "Max Local", "Max Remote", "Injected Size"]
+
+def loadSweep(input_file, sizes=None):
+    """
+    Load the sweep results once, reading only SWEEP_COLUMNS and size. The
+    Route, Architecture and size filters are pushed down into the read, so only
+    the matching rows of a partitioned dataset or feather file are loaded.
+
+    Results written before the size column existed have it computed from the
+    length of the AsicX lists, and the Remote Transaction Average of results
+    without it is made from their Remote Transactions.
+    """
+    if os.path.isdir(input_file):
+        dataset = ds.dataset(input_file, format="parquet", partitioning="hive")
+    else:
+        dataset = ds.dataset(input_file, format="feather")
+
+    names = set(dataset.schema.names)
+    if "size" in names:
+        size = pc.field("size")
+    else:
+        size = pc.list_value_length(pc.field("AsicX"))
+    columns = {col: pc.field(col) for col in SWEEP_COLUMNS}
+    columns["size"] = size
+    trans = "Remote Transaction Average" if "Remote Transaction Average" in names else "Remote Transactions"
+    columns[trans] = pc.field(trans)
+
+    filt = (pc.field("Route") != "None") & pc.field("Architecture").isin(["Push", "Pull"])
+    if sizes is not None:
+        filt = filt & size.isin(list(sizes))
+    return dataset.to_table(columns=columns, filter=filt).to_pandas()
+
+def readSweepDataFiles(runs):
+    """
+    read each sweep results file once, and create the output PDFs and texttable
+    rows of each (output_name, input_file, size) in runs, in the order of runs
+    """
+    sizes = {}
+    for _, input_file, size in runs:
+        sizes.setdefault(input_file, []).append(size)
+
+    bySize = {}
+    for input_file, file_sizes in sizes.items():
+        df = loadSweep(input_file, sizes=file_sizes)
+        for size, size_df in df.groupby("size"):
+            bySize[(input_file, size)] = size_df
+        bySize.setdefault(None, df.iloc[:0])
+
+    for output_name, input_file, size in runs:
+        size_df = bySize.get((input_file, size), bySize[None])
+        pull_df = size_df[size_df["Architecture"] == "Push"]
+        makePullGraphs(pull_df, size, output_name, input_file)
+
+        if size > 64:
+            continue
+        push_df = size_df[size_df["Architecture"] == "Pull"]
+        makePushGraphs(push_df, size, output_name, input_file)
+
+def frqLabel(frq):
+    return f"{frq*100:g}\\%"
+
+def summaryTables(summary, size, frq):
+    """
+    Fill the digital tables of makePullGraphs from a SweepSummary alone, for the
+    tiles of one size and frq. Only the tables are made, the graphs need the
+    tiles themselves.
+    """
+    routes = ["left", "snake", "trunk"]
+    remote_trans_avg = [0 for i in range(len(routes)+1)]
+    conf95_intervals = [0 for i in range(len(routes)+1)]
+    conf99_intervals = [0 for i in range(len(routes)+1)]
+    fits = [0 for i in range(len(routes)+1)]
+    for i, route in enumerate(routes):
+        # the pull tiles are labelled Push, see ArchLabel
+        group = summary.Get("Push", route, size, frq)
+        print(f'{route} has counts: {0 if group is None else group.n}')
+        if group is None or group.n == 0:
+            continue
+        conf99_intervals[i] = group.Quantile("Max Remote", 0.99)
+        conf95_intervals[i] = group.Quantile("Max Remote", 0.95)
+        conf99_intervals[-1] = group.Quantile("Max Local", 0.99)
+        remote_trans_avg[i] = group.Mean("Remote Transaction Average")
+        remote_trans_avg[-1] = group.Mean("Injected Size")
+        fits[i] = group.FitSlope()
+
+    frq = frqLabel(frq)
+    buf_data = [frq, f"{size}", conf99_intervals[-1], conf95_intervals[0], conf99_intervals[0], conf95_intervals[1], conf99_intervals[1], conf95_intervals[2], conf99_intervals[2]]
+    trans_data = [frq, f"{size}", remote_trans_avg[-1], remote_trans_avg[0], remote_trans_avg[0]/10, remote_trans_avg[1], remote_trans_avg[1]/10, remote_trans_avg[2], remote_trans_avg[2]/10]
+    fit_data = [frq, f"{size}", fits[0], fits[1], fits[2], fits[3]]
+
+    table_digi_trans_data.append(trans_data)
+    table_digi_buf_data.append(buf_data)
+    table_fit_trans_data.append(fit_data)
+
+def readSweepSummary(summary_file, runs):
+    """
+    fill the digital tables from a summary written by QpixMPAnalysis or
+    QpixSummary.py, where runs is a list of (size, frq)
+    """
+    summary = SweepSummary.Load(summary_file)
+    for size, frq in runs:
+        summaryTables(summary, size, frq)
+
 def readFeatherDataFile(output_name, input_file="./scripts/neutMP60k.feather", size=16):
     """
     read the input feather file, create output PDFs, and fill the texttables to print
     to LaTex
     """
-    
-    df = pd.read_feather(input_file)
-    architectures = pd.unique(df["Architecture"])
-
-    pull_df = df[(df["Route"] != "None") & (df["Architecture"] == "Push")]
-    makePullGraphs(pull_df, size, output_name, input_file)
-
-    if size > 64:
-        return
-    push_df = df[(df["Route"] != "None") & (df["Architecture"] == "Pull")]
-    makePushGraphs(push_df, size, output_name, input_file)
+    readSweepDataFiles([(output_name, input_file, size)])
 
 
 def main():
 
     # # full tile analysis
-    readRootDataFile(infile="./pdfs/ana_electron_fhc_graphs.root", file_dir="fhc_pdg12", lepPdg=12, isFHC=True, saveGraphs=True)
-    readRootDataFile(infile="./pdfs/ana_aelectron_fhc_graphs.root", file_dir="fhc_pdg-12", lepPdg=-12, isFHC=True)
-    readRootDataFile(infile="./pdfs/ana_aelectron_rhc_graphs.root", file_dir="rhc_pdg-12", lepPdg=-12, isFHC=False)
-    readRootDataFile(infile="./pdfs/ana_muon_fhc_graphs.root", file_dir="fhc_pdg14", lepPdg=14, isFHC=True)
-    readRootDataFile(infile="./pdfs/ana_muon_rhc_graphs.root", file_dir="rhc_pdg14", lepPdg=14, isFHC=False)
-    readRootDataFile(infile="./pdfs/ana_amuon_fhc_graphs.root", file_dir="fhc_pdg-14", lepPdg=-14, isFHC=True)
-    readRootDataFile(infile="./pdfs/ana_amuon_rhc_graphs.root", file_dir="rhc_pdg-14", lepPdg=-14, isFHC=False)
+    readRootDataFiles([
+        dict(infile="./pdfs/ana_electron_fhc_graphs.root", file_dir="fhc_pdg12", lepPdg=12, isFHC=True, saveGraphs=True),
+        dict(infile="./pdfs/ana_aelectron_fhc_graphs.root", file_dir="fhc_pdg-12", lepPdg=-12, isFHC=True),
+        dict(infile="./pdfs/ana_aelectron_rhc_graphs.root", file_dir="rhc_pdg-12", lepPdg=-12, isFHC=False),
+        dict(infile="./pdfs/ana_muon_fhc_graphs.root", file_dir="fhc_pdg14", lepPdg=14, isFHC=True),
+        dict(infile="./pdfs/ana_muon_rhc_graphs.root", file_dir="rhc_pdg14", lepPdg=14, isFHC=False),
+        dict(infile="./pdfs/ana_amuon_fhc_graphs.root", file_dir="fhc_pdg-14", lepPdg=-14, isFHC=True),
+        dict(infile="./pdfs/ana_amuon_rhc_graphs.root", file_dir="rhc_pdg-14", lepPdg=-14, isFHC=False),
+    ], nproc=NPROC)
     # readRootDataFile(infile="./pdfs/ana_electron_rhc_graphs.root", file_dir="rhc_pdg12", lepPdg=12, isFHC=False)
     neut_buff_tab = latextable.draw_latex(table_neut_buf_data, caption="APA Integral Data", label="tab:apa_sum")
     saveTable(neut_buff_tab, table_neut_buf_file)
@@ -636,18 +915,23 @@ def main():
     # readRootDataFile(infile=".\\pdfs\\muon_nu_rhc_graphs.root", file_dir="rhc_pdg14")
     # readRootDataFile(infile=".\\pdfs\\amuon_nu_rhc_graphs.root", file_dir="rhc_pdg-14")
 
-    # readFeatherDataFile("mpPush_16_slow", input_file="./scripts/neutMPpush_lowFrq.feather", size=16)
-    # readFeatherDataFile("mpPush_64_slow", input_file="./scripts/neutMPpush_lowFrq.feather", size=64)
-    # readFeatherDataFile("mpPush_140_slow", input_file="./scripts/neutMPpush_lowFrq.feather", size=140)
-    # readFeatherDataFile("mpPush_256_slow", input_file="./scripts/neutMPpush_lowFrq.feather", size=256)
-    # readFeatherDataFile("mp60_16_fast", input_file="./scripts/neutMP60k.feather", size=16)
-    # readFeatherDataFile("mp60_16_slow", input_file="./scripts/neutMP60k_lowFrq.feather", size=16)
-    # readFeatherDataFile("mp60_64_fast", input_file="./scripts/neutMP60k.feather", size=64)
-    # readFeatherDataFile("mp60_64_slow", input_file="./scripts/neutMP60k_lowFrq.feather", size=64)
-    # readFeatherDataFile("mp60_140_fast", input_file="./scripts/neutMP60k.feather", size=140)
-    # readFeatherDataFile("mp60_140_slow", input_file="./scripts/neutMP60k_lowFrq.feather", size=140)
-    # readFeatherDataFile("mp60_256_fast", input_file="./scripts/neutMP60k.feather", size=256)
-    # readFeatherDataFile("mp60_256_slow", input_file="./scripts/neutMP60k_lowFrq.feather", size=256)
+    # each sweep file is read once, for all of its tile sizes
+    # readSweepDataFiles([
+    #     ("mpPush_16_slow", "./scripts/neutMPpush_lowFrq.feather", 16),
+    #     ("mpPush_64_slow", "./scripts/neutMPpush_lowFrq.feather", 64),
+    #     ("mpPush_140_slow", "./scripts/neutMPpush_lowFrq.feather", 140),
+    #     ("mpPush_256_slow", "./scripts/neutMPpush_lowFrq.feather", 256),
+    #     ("mp60_16_fast", "./scripts/neutMP60k.feather", 16),
+    #     ("mp60_16_slow", "./scripts/neutMP60k_lowFrq.feather", 16),
+    #     ("mp60_64_fast", "./scripts/neutMP60k.feather", 64),
+    #     ("mp60_64_slow", "./scripts/neutMP60k_lowFrq.feather", 64),
+    #     ("mp60_140_fast", "./scripts/neutMP60k.feather", 140),
+    #     ("mp60_140_slow", "./scripts/neutMP60k_lowFrq.feather", 140),
+    #     ("mp60_256_fast", "./scripts/neutMP60k.feather", 256),
+    #     ("mp60_256_slow", "./scripts/neutMP60k_lowFrq.feather", 256),
+    # ])
+    # or only the tables, from the summary of a sweep
+    # readSweepSummary("./simulation-software/neutMP_summary.json", [(size, frq) for frq in [0.05, 0.005] for size in [16, 64, 140, 256]])
     # table_digi_trans.add_rows(table_digi_trans_data)
     # table_digi_buf.add_rows(table_digi_buf_data)
     # table_fit_trans.add_rows(table_fit_trans_data)
@@ -2,63 +2,76 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-import ROOT
 from array import array
 
+# binary tile format lives with the simulation
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulation-software"))
+from QpixDataFormat import HIT_ASIC_DTYPE
+from QpixTile import QpixTile, SaveTile, TILE_EXT
+
 channelXdim = 4
 channelYdim = 4
 xMAX = 575
 yMAX = 1500
 
-def findMax(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim):
+# bump when a change to the tile extraction changes its output, which
+# invalidates the tiles cached by QpixMPAnalysis
+# 2 - ASICs without hits are no longer written to the tile
+EXTRACT_VERSION = 2
+
+def pixelSAT(pixel_x, pixel_y):
     """
-    find the range of pixels within Xdim and Ydim that give the most resets
-    and create the
+    Build the summed-area table of a 2D histogram of pixel counts, spanning
+    [min, max] of the pixels in x and y. sat[i, j] is the number of pixels with
+    x < min_x + i and y < min_y + j.
+
+    returns min_x, max_x, min_y, max_y, sat
     """
-    if len(pixel_x) == 0:
-        pixel_x = [-1]
-        pixel_y = [-1]
-        pixel_reset = [-1]
+    min_x, max_x = int(np.min(pixel_x)), int(np.max(pixel_x))
+    min_y, max_y = int(np.min(pixel_y)), int(np.max(pixel_y))
+    nx, ny = max_x - min_x + 1, max_y - min_y + 1
+
+    ix = pixel_x.astype(np.int64) - min_x
+    iy = pixel_y.astype(np.int64) - min_y
+    sat = np.zeros((nx + 1, ny + 1), dtype=np.int64)
+    sat[1:, 1:] = np.bincount(ix * ny + iy, minlength=nx * ny).reshape(nx, ny)
+    sat.cumsum(axis=0, out=sat)
+    sat.cumsum(axis=1, out=sat)
+    return min_x, max_x, min_y, max_y, sat
+
+def findBestWindow(min_x, max_x, min_y, max_y, sat, xPixRange, yPixRange):
+    """
+    find the xPixRange x yPixRange window with the most pixels from a pixelSAT.
 
-    pixel_x = np.asarray(pixel_x)
-    pixel_y = np.asarray(pixel_y)
-    pixel_reset = np.asarray(pixel_reset)
-
-    xPixRange = channelXdim * arrayXdim
-    yPixRange = channelYdim * arrayYdim
-
-    min_x = np.min(pixel_x)
-    min_y = np.min(pixel_y)
-    max_x = np.max(pixel_x)
-    max_y = np.max(pixel_y)
-
-    # print(f"found asic hit range, x:{min_x}-{max_x} - y: {min_y}-{max_y}")
-
-    def getBestSlice(x, pix_x, y, pix_y):
-        x_hits = np.logical_and(pix_x >= x, pix_x < x + xPixRange)
-        y_hits = np.logical_and(pix_y >= y, pix_y < y + yPixRange)
-        asic_hits = np.logical_and(x_hits, y_hits)
-        return asic_hits
-
-    # use steps of 1, which slides across every pixel to find the pixel-based max
-    x_itr = range(min_x, max_x-xPixRange+1)
-    y_itr = range(min_y, max_y-yPixRange+1)
-    xBest, yBest, maxCount = 0, 0, 0 
-    for x in x_itr:
-        for y in y_itr:
-            asic_hits = getBestSlice(x, pixel_x, y, pixel_y)
-            counts = asic_hits.sum()
-            if counts > maxCount:
-                maxCount = counts
-                xBest = x
-                yBest = y
-
-    asic_hits = getBestSlice(xBest, pixel_x, yBest, pixel_y)
+    Window origins step over range(min_x, max_x-xPixRange+1) and likewise in y,
+    the first window in x-major order with the largest non-zero count wins, and
+    (0, 0) is returned if there are no windows or they are all empty.
+    """
+    nWx = max_x - xPixRange + 1 - min_x
+    nWy = max_y - yPixRange + 1 - min_y
+    if nWx <= 0 or nWy <= 0:
+        return 0, 0
+
+    counts = (sat[xPixRange:xPixRange+nWx, yPixRange:yPixRange+nWy]
+              - sat[:nWx, yPixRange:yPixRange+nWy]
+              - sat[xPixRange:xPixRange+nWx, :nWy]
+              + sat[:nWx, :nWy])
+    best = int(np.argmax(counts))
+    if counts.flat[best] <= 0:
+        return 0, 0
+    bx, by = divmod(best, nWy)
+    return min_x + bx, min_y + by
+
+def sliceWindow(pixel_x, pixel_y, pixel_reset, x, y, xPixRange, yPixRange):
+    """
+    select the pixels within a window, and re-order the pixels to 1
+    """
+    asic_hits = np.logical_and(np.logical_and(pixel_x >= x, pixel_x < x + xPixRange),
+                               np.logical_and(pixel_y >= y, pixel_y < y + yPixRange))
     pixel_x = pixel_x[asic_hits]
     pixel_y = pixel_y[asic_hits]
     pixel_reset = pixel_reset[asic_hits]
 
-    # print("found max hits:", asic_hits.sum())
     assert len(pixel_x) == len(pixel_y), f"uneven pixel lengths: {len(pixel_x)} != {len(pixel_y)}"
     assert len(pixel_x) == len(pixel_reset), f"uneven data lengths: {len(pixel_x)} != {len(pixel_reset)}"
 
@@ -69,13 +82,45 @@ def findMax(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim):
 
     return pixel_x, pixel_y, pixel_reset
 
-def makeDF(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim):
-    from math import ceil
+def _pixelArrays(pixel_x, pixel_y, pixel_reset):
+    if len(pixel_x) == 0:
+        pixel_x = [-1]
+        pixel_y = [-1]
+        pixel_reset = [-1]
+    return np.asarray(pixel_x), np.asarray(pixel_y), np.asarray(pixel_reset)
 
-    xDIM = arrayXdim * channelXdim
-    yDIM = arrayYdim * channelYdim
+def findMax(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim):
+    """
+    find the range of pixels within Xdim and Ydim that give the most resets
+    and create the
+    """
+    return findMaxes(pixel_x, pixel_y, pixel_reset, [(arrayXdim, arrayYdim)])[(arrayXdim, arrayYdim)]
 
-    pixel_x, pixel_y, pixel_reset = findMax(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim)
+def findMaxes(pixel_x, pixel_y, pixel_reset, dims):
+    """
+    findMax for each (arrayXdim, arrayYdim) in dims, sharing one summed-area
+    table of the event's pixels between all of them.
+
+    returns dictionary of (arrayXdim, arrayYdim) -> (pixel_x, pixel_y, pixel_reset)
+    """
+    pixel_x, pixel_y, pixel_reset = _pixelArrays(pixel_x, pixel_y, pixel_reset)
+    sat = pixelSAT(pixel_x, pixel_y)
+
+    windows = {}
+    for arrayXdim, arrayYdim in dims:
+        xPixRange = channelXdim * arrayXdim
+        yPixRange = channelYdim * arrayYdim
+        xBest, yBest = findBestWindow(*sat, xPixRange, yPixRange)
+        windows[(arrayXdim, arrayYdim)] = sliceWindow(pixel_x, pixel_y, pixel_reset, xBest, yBest, xPixRange, yPixRange)
+    return windows
+
+def makeDF(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim, window=None):
+    """
+    window - the findMax pixels of this event and dims, if already known
+    """
+    if window is None:
+        window = findMax(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim)
+    pixel_x, pixel_y, pixel_reset = window
 
     pd_data = {}
     pd_data["pX"] = pixel_x
@@ -85,23 +130,44 @@ def makeDF(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim):
     df = pd.DataFrame(pd_data)
     # count these as done in Simulation "Top Left" Asic is (0,0) : (row, col)
     # create X, Y asic associations
-    df["AsicX"] = ((df["pX"] - 1) / channelXdim).map(int)
-    df["AsicY"] = ((df["pY"] - 1) / channelYdim).map(int)
+    df["AsicX"] = ((df["pX"] - 1) / channelXdim).astype(int)
+    df["AsicY"] = ((df["pY"] - 1) / channelYdim).astype(int)
 
     # for each asic, it should only number a nPix within it's dimensions channelXdim *channelYdim
     # we chose X-dim as the "row" and Y-dim as the "column", to be consistent with the 
     # coordinates for the tile / simulation dimensions
-    npx = ((df["pX"]) - channelXdim*df["AsicX"] - 1).map(int)
-    npy = ((df["pY"]) - channelYdim*df["AsicY"] - 1).map(int)
+    npx = ((df["pX"]) - channelXdim*df["AsicX"] - 1).astype(int)
+    npy = ((df["pY"]) - channelYdim*df["AsicY"] - 1).astype(int)
     df["nPix"] = npx + channelYdim*npy
 
     return df
 
-def makeJson(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim, evt_e, lep_recon, axis_x, axis_z, zpos, outf):
+def asicGroups(fdf):
+    """
+    split the hits of a makeDF frame by ASIC in a single sort, only occupied
+    ASICs are returned. ASICs are ordered by the first appearance of their
+    AsicX and then AsicY, and the hits keep their order within each ASIC.
+
+    returns list of (AsicX, AsicY, [[Reset, nPix], ...])
+    """
+    if len(fdf) == 0:
+        return []
+    codeX, asicX = pd.factorize(fdf["AsicX"])
+    codeY, asicY = pd.factorize(fdf["AsicY"])
+    order = np.lexsort((codeY, codeX))
+    codeX, codeY = codeX[order], codeY[order]
+    data = fdf[["Reset", "nPix"]].values[order]
+
+    # start of each run of equal (AsicX, AsicY)
+    starts = np.flatnonzero(np.r_[True, (codeX[1:] != codeX[:-1]) | (codeY[1:] != codeY[:-1])])
+    groups = np.split(data, starts[1:])
+    return [(int(asicX[codeX[i]]), int(asicY[codeY[i]]), group.tolist()) for i, group in zip(starts, groups)]
+
+def makeJson(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim, evt_e, lep_recon, axis_x, axis_z, zpos, outf, window=None):
     """
     args: filtered_pd_df - filtered RDataFrame
     """
-    fdf = makeDF(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim)
+    fdf = makeDF(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim, window)
     
     # create the tile's dataframe to send into the QPixAsicArray
     tiledf = {}
@@ -115,31 +181,27 @@ def makeJson(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim, evt_e, lep_rec
 
     tiledf["hits"] = []
 
-    # normalize asic numbers: this is for the simulation input which "0 numbers" the asic's within it's rows / cols
-    hitX = fdf["AsicX"].unique()
-    hitY = fdf["AsicY"].unique()
-
     # build the hits tuple for each asic within the tile
     nHits = 0
-    for x in hitX:
-        for y in hitY:
-            asicResets = fdf[ (fdf["AsicX"] == x) & (fdf["AsicY"] == y) ][["Reset","nPix"]].values.tolist()
-            arrayX = int(x)
-            arrayY = int(y)
-            tiledf["hits"].append([arrayX, arrayY, asicResets])
-            nHits += len(asicResets)
+    for arrayX, arrayY, asicResets in asicGroups(fdf):
+        tiledf["hits"].append([arrayX, arrayY, asicResets])
+        nHits += len(asicResets)
 
     tiledf["size"] = nHits
 
     print(f"stored a total of {nHits} hits")
-    # store the values within a json file
-    import json
-    with open(outf, "w") as outputFile:
-        json.dump(tiledf, outputFile, indent=4)
+    # store the values within a binary tile, or a json file
+    if outf.endswith(TILE_EXT):
+        SaveTile(outf, tiledf)
+    else:
+        import json
+        with open(outf, "w") as outputFile:
+            json.dump(tiledf, outputFile, indent=4)
 
     return nHits
 
 def setup_tree(input_file, event_number):
+    import ROOT
     pix_x = ROOT.std.vector('Int_t')()
     pix_y = ROOT.std.vector('Int_t')()
     pix_r = ROOT.std.vector('Double_t')()
@@ -183,12 +245,227 @@ def setup_tree(input_file, event_number):
 
     return pix_x, pix_y, pix_r, evt_e[0], lep_recon, axis_x[0], axis_z[0], zpos[0]
 
+class RootEventReader():
+    """
+    Reads the events of a neutrino ROOT file in a single pass over its event_tree,
+    instead of re-opening the file per event as setup_tree does.
+    """
+    def __init__(self, input_file):
+        self.input_file = input_file
+
+    def Events(self, events):
+        """
+        yield (event_number, event) in increasing event_number, where event is the
+        setup_tree tuple with the pixel vectors copied into numpy arrays
+        """
+        import ROOT
+        pix_x = ROOT.std.vector('Int_t')()
+        pix_y = ROOT.std.vector('Int_t')()
+        pix_r = ROOT.std.vector('Double_t')()
+        values = {name: array('f', [ 0. ]) for name in
+                  ["energy_deposit", "lepKE", "hadTot", "hadOther", "zpos", "axis_x", "axis_z"]}
+
+        tf = ROOT.TFile(self.input_file, "READ")
+        if tf.IsZombie() or not hasattr(tf, "event_tree"):
+            raise OSError(f"unable to read an event_tree from: {self.input_file}")
+
+        t = tf.event_tree
+        t.SetBranchStatus("*", 0)
+        for name, vec in [("pixel_x", pix_x), ("pixel_y", pix_y), ("pixel_reset", pix_r)]:
+            t.SetBranchStatus(name, 1)
+            t.SetBranchAddress(name, vec)
+        for name, value in values.items():
+            t.SetBranchStatus(name, 1)
+            t.SetBranchAddress(name, value)
+
+        nEntries = t.GetEntries()
+        for event_number in sorted(events):
+            if event_number >= nEntries:
+                print("warning, not enough entries in tree:", event_number, " >= ", nEntries)
+                continue
+            t.GetEntry(event_number)
+
+            assert pix_x.size() == pix_y.size(), f"uneven pixel lengths: {pix_x.size()} != {pix_y.size()}"
+            assert pix_x.size() == pix_r.size(), f"uneven data lengths: {pix_x.size()} != {pix_r.size()}"
+
+            # the vectors are refilled by the next GetEntry, so copy them out
+            n = pix_x.size()
+            pixel_x = np.frombuffer(pix_x.data(), dtype=np.int32, count=n).copy() if n else np.zeros(0, np.int32)
+            pixel_y = np.frombuffer(pix_y.data(), dtype=np.int32, count=n).copy() if n else np.zeros(0, np.int32)
+            pixel_reset = np.frombuffer(pix_r.data(), dtype=np.float64, count=n).copy() if n else np.zeros(0)
+
+            lep_recon = values["lepKE"][0] + values["hadTot"][0] + values["hadOther"][0]
+            yield event_number, (pixel_x, pixel_y, pixel_reset, values["energy_deposit"][0], lep_recon,
+                                 values["axis_x"][0], values["axis_z"][0], values["zpos"][0])
+        tf.Close()
+
+class NpzEventReader():
+    """
+    Stand-in for RootEventReader which reads events from an npz file, so the tile
+    extraction can run without ROOT. The pixels of every event are concatenated,
+    and event i owns [offsets[i], offsets[i+1]), see saveNpzEvents.
+    """
+    def __init__(self, input_file):
+        self.input_file = input_file
+
+    def Events(self, events):
+        with np.load(self.input_file) as f:
+            data = {key: f[key] for key in f.files}
+        offsets = data["offsets"]
+        nEntries = len(offsets) - 1
+        for event_number in sorted(events):
+            if event_number >= nEntries:
+                print("warning, not enough entries in file:", event_number, " >= ", nEntries)
+                continue
+            lo, hi = offsets[event_number], offsets[event_number+1]
+            lep_recon = data["lepKE"][event_number] + data["hadTot"][event_number] + data["hadOther"][event_number]
+            yield event_number, (data["pixel_x"][lo:hi], data["pixel_y"][lo:hi], data["pixel_reset"][lo:hi],
+                                 data["energy_deposit"][event_number], lep_recon, data["axis_x"][event_number],
+                                 data["axis_z"][event_number], data["zpos"][event_number])
+
+def saveNpzEvents(outf, pixel_x, pixel_y, pixel_reset, **values):
+    """
+    write events for NpzEventReader, pixel_* are lists with one array per event, and
+    values holds one value per event for each of energy_deposit, lepKE, hadTot,
+    hadOther, zpos, axis_x and axis_z
+    """
+    offsets = np.zeros(len(pixel_x) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(px) for px in pixel_x])
+    np.savez(outf, offsets=offsets,
+             pixel_x=np.concatenate(pixel_x).astype(np.int32) if len(pixel_x) else np.zeros(0, np.int32),
+             pixel_y=np.concatenate(pixel_y).astype(np.int32) if len(pixel_y) else np.zeros(0, np.int32),
+             pixel_reset=np.concatenate(pixel_reset).astype(np.float64) if len(pixel_reset) else np.zeros(0),
+             **{key: np.asarray(val, dtype=np.float64) for key, val in values.items()})
+
+def eventReader(input_file):
+    """
+    reader of the events in input_file, npz files are read without ROOT
+    """
+    if input_file.endswith(".npz"):
+        return NpzEventReader(input_file)
+    return RootEventReader(input_file)
+
+def makeTiles(input_file, requests, reader=None):
+    """
+    Build many tiles from one pass over input_file. The window search of each
+    event is shared by all of its requested dims, see findMaxes.
+
+    ARGS:
+        input_file - root file of neutrino data, or an npz stand-in
+        requests - list of (event_number, arrayXdim, arrayYdim, output_file)
+        reader - event reader to use, by default eventReader(input_file)
+
+    returns dictionary of (event_number, arrayXdim, arrayYdim) -> hits stored
+    """
+    if reader is None:
+        reader = eventReader(input_file)
+
+    byEvent = {}
+    for event_number, arrayXdim, arrayYdim, output_file in requests:
+        byEvent.setdefault(event_number, []).append((arrayXdim, arrayYdim, output_file))
+
+    hits = {}
+    for event_number, event in reader.Events(byEvent):
+        pixel_x, pixel_y, pixel_reset = event[:3]
+        windows = findMaxes(pixel_x, pixel_y, pixel_reset, [(x, y) for x, y, _ in byEvent[event_number]])
+        for arrayXdim, arrayYdim, output_file in byEvent[event_number]:
+            hits[(event_number, arrayXdim, arrayYdim)] = makeJson(
+                pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim, *event[3:], output_file,
+                window=windows[(arrayXdim, arrayYdim)])
+    return hits
+
+def apaTileName(outDir, event_number, arrayXdim, arrayYdim, tileX, tileY):
+    """
+    file of one tile of the APA, keeps the x-{}_y-{} dims tag used by the sweep
+    """
+    return os.path.join(outDir, f"evt-{event_number}_x-{arrayXdim}_y-{arrayYdim}_tx-{tileX}_ty-{tileY}{TILE_EXT}")
+
+def apaTiles(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim):
+    """
+    Partition the pixels of an event into every arrayXdim x arrayYdim tile of
+    the APA. Pixels are 1 counted, as in makeDF, and the tile, ASIC and channel
+    of each hit are found with integer arithmetic. Pixels outside of the
+    xMAX x yMAX APA are dropped.
+
+    returns dictionary of (tileX, tileY) -> (asics, times, channels), in the
+    QpixTile CSR form, for every tile with at least one hit
+    """
+    pX = np.asarray(pixel_x, dtype=np.int64) - 1
+    pY = np.asarray(pixel_y, dtype=np.int64) - 1
+    reset = np.asarray(pixel_reset, dtype=np.float64)
+    onAPA = (pX >= 0) & (pX < xMAX) & (pY >= 0) & (pY < yMAX)
+    pX, pY, reset = pX[onAPA], pY[onAPA], reset[onAPA]
+    if len(pX) == 0:
+        return {}
+
+    xDIM = arrayXdim * channelXdim
+    yDIM = arrayYdim * channelYdim
+    tileX, tileY = pX // xDIM, pY // yDIM
+    asicX, asicY = (pX % xDIM) // channelXdim, (pY % yDIM) // channelYdim
+    nPix = pX % channelXdim + channelYdim * (pY % channelYdim)
+
+    # one sort orders the hits by tile, then ASIC, then time
+    tileN = tileX * (yMAX // yDIM + 1) + tileY
+    order = np.lexsort((reset, asicY, asicX, tileN))
+    tileN, tileX, tileY = tileN[order], tileX[order], tileY[order]
+    asicX, asicY, reset, nPix = asicX[order], asicY[order], reset[order], nPix[order]
+
+    newTile = np.r_[True, tileN[1:] != tileN[:-1]]
+    newAsic = newTile | np.r_[True, (asicX[1:] != asicX[:-1]) | (asicY[1:] != asicY[:-1])]
+    tileStarts = np.flatnonzero(newTile)
+    asicStarts = np.flatnonzero(newAsic)
+    tileEnds = np.r_[tileStarts[1:], len(tileN)]
+    asicEnds = np.r_[asicStarts[1:], len(tileN)]
+
+    tiles = {}
+    for start, stop in zip(tileStarts, tileEnds):
+        lo, hi = np.searchsorted(asicStarts, [start, stop])
+        asics = np.empty(hi - lo, dtype=HIT_ASIC_DTYPE)
+        asics["Row"] = asicX[asicStarts[lo:hi]]
+        asics["Col"] = asicY[asicStarts[lo:hi]]
+        asics["Start"] = asicStarts[lo:hi] - start
+        asics["Stop"] = asicEnds[lo:hi] - start
+        tiles[(int(tileX[start]), int(tileY[start]))] = (asics, reset[start:stop], nPix[start:stop])
+    return tiles
+
+def makeAPATiles(input_file, events, dims, outDir, reader=None):
+    """
+    Write every non-empty tile of the APA for each event and dims, with one read
+    of each event.
+
+    ARGS:
+        input_file - root file of neutrino data, or an npz stand-in
+        events - event numbers to extract
+        dims - list of (arrayXdim, arrayYdim)
+        outDir - directory of the tiles, named by apaTileName
+        reader - event reader to use, by default eventReader(input_file)
+
+    returns dictionary of (event_number, arrayXdim, arrayYdim) -> list of tile files
+    """
+    if reader is None:
+        reader = eventReader(input_file)
+    os.makedirs(outDir, exist_ok=True)
+
+    files = {}
+    for event_number, event in reader.Events(events):
+        pixel_x, pixel_y, pixel_reset, evt_e, lep_recon, axis_x, axis_z, zpos = event
+        for arrayXdim, arrayYdim in dims:
+            tiles = apaTiles(pixel_x, pixel_y, pixel_reset, arrayXdim, arrayYdim)
+            files[(event_number, arrayXdim, arrayYdim)] = []
+            for (tileX, tileY), (asics, times, channels) in tiles.items():
+                tile = QpixTile(arrayXdim, arrayYdim, asics, times, channels, energy_deposit=evt_e,
+                                lep_recon=lep_recon, axis_x=axis_x, axis_z=axis_z, zpos=zpos)
+                outf = apaTileName(outDir, event_number, arrayXdim, arrayYdim, tileX, tileY)
+                tile.Save(outf)
+                files[(event_number, arrayXdim, arrayYdim)].append(outf)
+    return files
+
 def main(input_file, event_number, output_file, arrayXdim, arrayYdim):
     """
     ARGS:
         input_file - root file of neutrino data
         event_number - number in the event to get from the tree
-        output_file - output json name
+        output_file - output json name, or binary tile if it ends with .qtile
         arrayXdim - number of ASICs in the x-dim
         arrayYdim - number of ASICs in the y-dim
     """
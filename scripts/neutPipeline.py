@@ -0,0 +1,240 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+## Dependency tracked replacement of runNeutDir.sh. Each flavour / horn current
+## chain of filtNeutrino -> combNeutrinoRam -> anaNeutrino is a set of Steps.
+## The programs write fixed file names (out.root, out_comb.root, saveRdf.root)
+## into their working directory, so every step runs in its own scratch
+## directory and its outputs are moved to unique paths, which lets the chains
+## run concurrently under a core budget.
+##
+## A step is skipped when its outputs exist and the fingerprint of its command,
+## program and inputs (path, size, mtime) matches the last successful run, kept
+## in <workDir>/pipeline.json, so rebuilding a program reruns its steps.
+## filtNeutrino and combNeutrinoRam run on one core, anaNeutrino is given
+## --ana-threads implicit MT threads and holds that many cores of the budget.
+## Run from the top of the repo, as runNeutDir.sh:
+##   python scripts/neutPipeline.py --cores 8
+##   python scripts/neutPipeline.py --full --prefix simple --flavours electron
+
+BUILD_DIR = "./build/source"
+WORK_DIR = "./pipeline_work"
+STATE = "pipeline.json"
+ANA_THREADS = 4
+
+# (flavour, lepton pdg) and (horn current, program argument)
+FLAVOURS = [("aelectron", -12), ("amuon", -14), ("electron", 12), ("muon", 14)]
+CURRENTS = [("fhc", "1"), ("rhc", "rhc")]
+
+class Step():
+    """
+    A single program run of the pipeline.
+
+    ARGS:
+        name    - unique name, also the name of its scratch directory
+        cmd     - argument list, paths should be absolute
+        inputs  - files read by the step
+        outputs - files the step produces
+        moves   - dictionary of file written into the scratch directory -> output path
+        deps    - names of the steps which must finish first
+        cores   - cores the step is expected to use, counted against the budget
+    """
+    def __init__(self, name, cmd, inputs=(), outputs=(), moves=None, deps=(), cores=1):
+        self.name = name
+        self.cmd = [str(c) for c in cmd]
+        self.inputs = [os.path.abspath(f) for f in inputs]
+        self.outputs = [os.path.abspath(f) for f in outputs]
+        self.moves = {k: os.path.abspath(v) for k, v in (moves or {}).items()}
+        self.deps = list(deps)
+        self.cores = cores
+
+    def Fingerprint(self):
+        """
+        hash of the command and the path, size and mtime of its program and
+        every input
+        """
+        desc = [self.cmd]
+        program = shutil.which(self.cmd[0]) or self.cmd[0]
+        for f in [program, *self.inputs]:
+            st = os.stat(f) if os.path.isfile(f) else None
+            desc.append([f, st.st_size if st else None, st.st_mtime_ns if st else None])
+        return hashlib.sha256(json.dumps(desc).encode()).hexdigest()
+
+class Pipeline():
+    """
+    DAG of Steps run on a thread pool, each thread waiting on its own process.
+
+    ARGS:
+        workDir - scratch directories and the fingerprint state
+        cores   - budget of cores shared by the running steps
+    """
+    def __init__(self, workDir=WORK_DIR, cores=None):
+        self.workDir = os.path.abspath(workDir)
+        self.cores = cores or os.cpu_count() or 1
+        self.steps = {}
+        os.makedirs(self.workDir, exist_ok=True)
+        self._state = {}
+        stateFile = os.path.join(self.workDir, STATE)
+        if os.path.isfile(stateFile):
+            with open(stateFile, "r") as f:
+                self._state = json.load(f)
+
+    def Add(self, step):
+        if step.name in self.steps:
+            raise ValueError(f"duplicate pipeline step: {step.name}")
+        self.steps[step.name] = step
+        return step
+
+    def UpToDate(self, step):
+        return (all(os.path.isfile(f) for f in step.outputs) and
+                self._state.get(step.name) == step.Fingerprint())
+
+    def _Save(self):
+        stateFile = os.path.join(self.workDir, STATE)
+        with open(stateFile + ".tmp", "w") as f:
+            json.dump(self._state, f, indent=1)
+        os.replace(stateFile + ".tmp", stateFile)
+
+    def _RunStep(self, step):
+        cwd = os.path.join(self.workDir, step.name)
+        os.makedirs(cwd, exist_ok=True)
+        for f in step.outputs:
+            os.makedirs(os.path.dirname(f), exist_ok=True)
+
+        start = time.monotonic()
+        with open(os.path.join(cwd, "log.txt"), "w") as log:
+            ret = subprocess.run(step.cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT).returncode
+        if ret == 0:
+            for src, dst in step.moves.items():
+                shutil.move(os.path.join(cwd, src), dst)
+        return ret, time.monotonic() - start
+
+    def Run(self, force=False):
+        """
+        Run every step once its deps have succeeded, skipping the up to date
+        ones. Steps of a failed step are not run.
+
+        returns dictionary of step name -> status, one of ran, skipped, failed
+        or blocked
+        """
+        for step in self.steps.values():
+            for dep in step.deps:
+                if dep not in self.steps:
+                    raise ValueError(f"step {step.name} depends on unknown step {dep}")
+
+        status = {}
+        pending = dict(self.steps)
+        running = {}
+        used = 0
+        with ThreadPoolExecutor(max_workers=self.cores) as pool:
+            while pending or running:
+                # block the steps downstream of a failure
+                for name, step in list(pending.items()):
+                    if any(status.get(dep) in ("failed", "blocked") for dep in step.deps):
+                        status[name] = "blocked"
+                        del pending[name]
+                        print(f"{name}: blocked")
+
+                ready = [s for s in pending.values() if all(status.get(d) in ("ran", "skipped") for d in s.deps)]
+                for step in ready:
+                    if not force and self.UpToDate(step):
+                        status[step.name] = "skipped"
+                        del pending[step.name]
+                        print(f"{step.name}: up to date")
+                        continue
+                    # an oversized step may still run alone
+                    if used + step.cores > self.cores and running:
+                        continue
+                    print(f"{step.name}: running {' '.join(step.cmd)}")
+                    running[pool.submit(self._RunStep, step)] = step
+                    used += step.cores
+                    del pending[step.name]
+
+                if not running:
+                    # steps which became up to date can unblock others without waiting
+                    if pending and not ready:
+                        raise ValueError(f"pipeline has a dependency cycle within: {', '.join(pending)}")
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    used -= step.cores
+                    ret, wall = future.result()
+                    if ret == 0:
+                        status[step.name] = "ran"
+                        self._state[step.name] = step.Fingerprint()
+                    else:
+                        status[step.name] = "failed"
+                        self._state.pop(step.name, None)
+                    self._Save()
+                    print(f"{step.name}: {status[step.name]} in {wall:.1f} s (returned {ret})")
+        return status
+
+def addChain(pipe, fileName, pdg, current, full=False, buildDir=BUILD_DIR, anaThreads=ANA_THREADS):
+    """
+    add the filtNeutrino -> combNeutrinoRam -> anaNeutrino steps of one input
+    file, mirroring make_neutrino (or make_neutrino_full) of runNeutDir.sh.
+    The filter and combine are single threaded, anaNeutrino runs anaThreads
+    implicit MT threads.
+    """
+    prog = lambda name: os.path.abspath(os.path.join(buildDir, name))
+    tag = f"pdg{pdg}_fhc-{current}"
+    prefix = "full_" if full else ""
+
+    filt = pipe.Add(Step(f"{prefix}filt_{tag}",
+                         [prog("filtNeutrino"), os.path.abspath(f"./comb_rtd/{fileName}"), pdg, current],
+                         inputs=[f"./comb_rtd/{fileName}"], outputs=[f"./filt_rtd/{fileName}"],
+                         moves={"out.root": f"./filt_rtd/{fileName}"}))
+
+    # the full chain combines the unfiltered file, so only the partial chain waits on the filter
+    combIn = f"./comb_rtd/{fileName}" if full else f"./filt_rtd/{fileName}"
+    combOut = f"./data_rtd/total_{fileName}" if full else f"./data_rtd/{fileName}"
+    comb = pipe.Add(Step(f"{prefix}comb_{tag}",
+                         [prog("combNeutrinoRam"), os.path.abspath(combIn), pdg, current],
+                         inputs=[combIn], outputs=[combOut], moves={"out_comb.root": combOut},
+                         deps=[] if full else [filt.name]))
+
+    graphs = f"./pdfs/{prefix}graphs_{tag}.root"
+    th2 = f"./pdfs/{prefix}th2_{tag}.root"
+    pipe.Add(Step(f"{prefix}ana_{tag}",
+                  [prog("anaNeutrino"), os.path.abspath(combOut), os.path.abspath(graphs), anaThreads],
+                  inputs=[combOut], outputs=[graphs, th2], moves={"saveRdf.root": th2},
+                  deps=[comb.name], cores=anaThreads))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run the neutrino filter, combine and analysis chains")
+    parser.add_argument("--cores", type=int, help="core budget, default every core")
+    parser.add_argument("--ana-threads", type=int, default=ANA_THREADS, help="implicit MT threads of each anaNeutrino")
+    parser.add_argument("--prefix", default="eng", help="input files are <prefix>_<flavour>_nu_<fhc|rhc>_files.root")
+    parser.add_argument("--flavours", nargs="+", default=[f for f, _ in FLAVOURS], choices=[f for f, _ in FLAVOURS])
+    parser.add_argument("--full", action="store_true", help="make the full, unfiltered data files")
+    parser.add_argument("--build-dir", default=BUILD_DIR)
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--force", action="store_true", help="rerun steps which are up to date")
+    args = parser.parse_args(argv)
+
+    pipe = Pipeline(args.work_dir, args.cores)
+    for flavour, pdg in FLAVOURS:
+        if flavour not in args.flavours:
+            continue
+        for current, arg in CURRENTS:
+            addChain(pipe, f"{args.prefix}_{flavour}_nu_{current}_files.root", pdg, arg,
+                     args.full, args.build_dir, args.ana_threads)
+
+    status = pipe.Run(args.force)
+    counts = {}
+    for s in status.values():
+        counts[s] = counts.get(s, 0) + 1
+    print("pipeline finished:", ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+    return 0 if all(s in ("ran", "skipped") for s in status.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
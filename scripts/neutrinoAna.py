@@ -6,80 +6,106 @@ import sys
 import os
 import multiprocessing as mp
 import pandas as pd
+from neutCatalog import FileCatalog, openCatalog, KEY_FIELDS
 
-ROOT.EnableImplicitMT()
+# worker processes of main, each of which runs its RDataFrames with IMTThreads
+NCPU = 20
+
+def IMTThreads(nproc=NCPU):
+    """
+    implicit MT threads for each of nproc worker processes, so that the workers
+    together use the machine's cores without oversubscribing them
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, nproc))
 
 def getFiles(dir):
     return [os.path.join(os.path.abspath(dir), f) for f in os.listdir(dir)]
 
-# sort_dir = "../data_radiogen/neutrinos/sorted"
-# rtd_dir = "../data_radiogen/neutrinos/rtd"
-# rtdf_files = getFiles(rtd_dir)
-rtdf_files = []
+sort_dir = "../data_radiogen/neutrinos/sorted"
+rtd_dir = "../data_radiogen/neutrinos/rtd"
+catalog_file = "../data_radiogen/neutrinos/catalog.json"
+
+# catalog of the sort and rtd files, opened by main, see neutCatalog.py. Child
+# processes are handed the catalog in their args, as a spawned child would only
+# see this empty one.
+catalog = FileCatalog()
 
-def makeSortType(sort_file):
+def makeSortType(sort_file, fileCatalog=None):
     """
     extract meta data from the file name of the sort file
     """
-    # check to see if running windows os..
-    if os.name == 'nt':
-        f = sort_file.split('\\')[-1].split('_')
-    else:
-        f = sort_file.split('/')[-1].split('_')
-    isFHC = f[0] == 'FHC'
-    nHC = int(f[1])
-    xpos = int(f[2].split('-')[-1])
-    ypos = int(f[3].split('-')[-1])
-    zpos = int(f[4].split('-')[-1])
-    seed = int(f[5].split('-')[-1])
-    isAtZ = int(f[6].split('-')[-1]) == 1
-    return [isFHC, nHC, xpos, ypos, zpos, seed, isAtZ]
-
-def getRTDType(sort_file):
+    meta = (catalog if fileCatalog is None else fileCatalog).Meta(sort_file)
+    return [meta[key] for key in KEY_FIELDS]
+
+def getRTDType(sort_file, fileCatalog=None):
     """
     get the corresponding RTD file for this sort file
     """
-    [isFHC, nHC, xpos, ypos, zpos, seed, isAtZ] = makeSortType(sort_file)
-    typ = "FHC" if isFHC else "RHC"
-    f = f"{typ}_{nHC}_x-{xpos}_y-{ypos}_z-{zpos}_seed-{seed}_zaxis-{isAtZ:d}_sorted_rtd.root"
-    for rtdf in rtdf_files:
-        if f in rtdf:
-            return rtdf
-    print("did not find: ", f)
-    return None
+    rtdf = (catalog if fileCatalog is None else fileCatalog).Match("rtd", sort_file)
+    if rtdf is None:
+        print("did not find rtd file of: ", sort_file)
+    return rtdf
 
-def RDFAna(rdf_file, xpos, ypos):
+def BookRDFAna(rdf_file, xpos, ypos):
     """
-    return values of interest for the makePandasDF function call here
+    book the lazy actions of the rtd file, nothing runs until a value is read
+    or the booked results are run together with RunGraphs
+
+    returns dictionary of name -> RResultPtr
     """
     rdf = ROOT.RDataFrame('event_tree', rdf_file)
 
     # make sure reasonable timescale for the neutrino events
-    rdf = rdf.Filter("pixel_reset < 1e-1") 
-    total_resets = rdf.Count().GetValue()
-    rdf = rdf.Filter(f"pixel_x < {int(xpos/0.4)} + 40 && pixel_x > {int(xpos/0.4)} - 40")\
-             .Filter(f"pixel_y < {int(ypos/0.4)} + 40 && pixel_y > {int(ypos/0.4)} - 40")
-    tile_resets = rdf.Count().GetValue()
-                     
-    return total_resets, tile_resets
+    rdf = rdf.Filter("pixel_reset < 1e-1")
+    tile = rdf.Filter(f"pixel_x < {int(xpos/0.4)} + 40 && pixel_x > {int(xpos/0.4)} - 40")\
+              .Filter(f"pixel_y < {int(ypos/0.4)} + 40 && pixel_y > {int(ypos/0.4)} - 40")
+
+    return {"total_resets": rdf.Count(),
+            "tile_resets": tile.Count(),
+            "tile_first_reset": tile.Min("pixel_reset"),
+            "tile_last_reset": tile.Max("pixel_reset")}
+
+def BookSortAna(sort_file):
+    """
+    book the lazy actions of the sort file
+    """
+    rdf = ROOT.RDataFrame('event_tree', sort_file)
+    rdf = rdf.Filter('hit_start_t < 1e-1') # only look for hits within reasonable time
+    return {"energy_deposit": rdf.Sum('hit_energy_deposit'),
+            "n_hits": rdf.Count()}
+
+def RDFAna(rdf_file, xpos, ypos):
+    """
+    return values of interest for the makePandasDF function call here
+    """
+    results = BookRDFAna(rdf_file, xpos, ypos)
+    ROOT.RDF.RunGraphs(list(results.values()))
+    return results["total_resets"].GetValue(), results["tile_resets"].GetValue()
 
-def GetRDFData(f, q):
+# values appended to the makeSortType list by GetRDFData
+RDF_COLUMNS = ["total_resets", "tile_resets", "tile_first_reset", "tile_last_reset", "energy_deposit", "n_hits"]
+
+def GetRDFData(f, q, nThreads=1, fileCatalog=None):
     """
-    helper for mp to get data more quickly
+    helper for mp to get data more quickly. All of the actions of the rtd and
+    sort files are booked first and run with RunGraphs, so each file is read
+    in a single event loop. fileCatalog is the catalog to find the rtd file
+    in, the module's catalog if None.
     """
-    a = makeSortType(f)
-    rtd_f = getRTDType(f)
+    if nThreads > 1:
+        ROOT.EnableImplicitMT(nThreads)
+
+    a = makeSortType(f, fileCatalog)
+    rtd_f = getRTDType(f, fileCatalog)
     a.append(f)
     a.append(rtd_f)
     if rtd_f is not None:
-        total_resets, tile_resets = RDFAna(rtd_f, a[2], a[3])
-        a.append(total_resets)
-        a.append(tile_resets)
-        rdf = ROOT.RDataFrame('event_tree', f)
-        rdf = rdf.Filter('hit_start_t < 1e-1') # only look for hits within reasonable time
-        a.append(rdf.Sum('hit_energy_deposit').GetValue())
+        results = BookRDFAna(rtd_f, a[2], a[3])
+        results.update(BookSortAna(f))
+        ROOT.RDF.RunGraphs(list(results.values()))
+        a.extend([results[col].GetValue() for col in RDF_COLUMNS])
     else:
-        a.extend([0, 0, 0])
+        a.extend([0] * len(RDF_COLUMNS))
 
     q.put(a)
 
@@ -88,15 +114,18 @@ def main():
     create the output DF for analysis
     """
 
-    sort_files = getFiles(sort_dir)
-    print(f"found {len(rtdf_files)} rtd files and {len(sort_files)} sort files")
+    global catalog
+    catalog = openCatalog(catalog_file, [sort_dir, rtd_dir])
+    sort_files = catalog.Files("sort")
+    print(f"found {len(catalog.Files('rtd'))} rtd files and {len(sort_files)} sort files")
 
     # place holder for the completed tiles
     q = mp.Queue()
-    ncpu = 20
+    ncpu = NCPU
+    nThreads = IMTThreads(ncpu)
 
     # pull architecture procs
-    procs = [mp.Process(target=GetRDFData, args=(sort, q)) for sort in sort_files[:2000]]
+    procs = [mp.Process(target=GetRDFData, args=(sort, q, nThreads, catalog)) for sort in sort_files[:2000]]
 
     nProcs = len(procs)
     print(f"begginning processing of {nProcs} tiles.")
@@ -122,22 +151,8 @@ def main():
             completeProcs = len(qdata)
             print(f"Completed procs {completeProcs}, {completeProcs/nProcs*100:0.2f}%..")
 
-    d = {'FHC':[], 'nHC':[], 'xpos':[], 'ypos':[], 'zpos':[], 'seed':[], 'atZ':[],
-         'sortFile':[], 'rtdFile':[],
-         'total_resets':[], 'tile_resets':[], 'energy_deposit':[]}
-    for data in qdata:
-        d['FHC'].append(data[0])
-        d['nHC'].append(data[1])
-        d['xpos'].append(data[2])
-        d['ypos'].append(data[3])
-        d['zpos'].append(data[4])
-        d['seed'].append(data[5])
-        d['atZ'].append(data[6])
-        d['sortFile'].append(data[7])
-        d['rtdFile'].append(data[8])
-        d['total_resets'].append(data[9])
-        d['tile_resets'].append(data[10])
-        d['energy_deposit'].append(data[11])
+    columns = ['FHC', 'nHC', 'xpos', 'ypos', 'zpos', 'seed', 'atZ', 'sortFile', 'rtdFile'] + RDF_COLUMNS
+    d = {col: [data[i] for data in qdata] for i, col in enumerate(columns)}
 
     df = pd.DataFrame(data=d)
     print(df)
@@ -145,9 +160,42 @@ def main():
     print("completed creating of neutrino df")
 
 
-def UpdateSrc(df, src_dest):
+# truth meta data of the first event of each src file, in UpdateSrc column order
+SRC_BRANCHES = ["ifileNo", "ievt", "lepPdg", "lepKE", "muonReco", "muGArLen", "hadTot", "hadP", "hadN",
+                "hadPip", "hadPim", "hadPi0", "hadOther", "hadCollar", "p3lep", "vtx", "lepDeath",
+                "muonExitPt", "muonExitMom", "nFS", "fsPdg", "fsPx", "fsPy", "fsPz", "fsE", "fsTrkLen"]
+SRC_ARRAYS = {"p3lep", "vtx", "lepDeath", "muonExitPt", "muonExitMom", "fsPdg", "fsPx", "fsPy", "fsPz", "fsE", "fsTrkLen"}
+
+def ReadSrcMeta(src_file):
+    """
+    read the truth meta data of the first event of a src file
+
+    returns a record dictionary keyed by FHC, nHC, src_file and SRC_BRANCHES,
+    None if the file has no tree
+    """
+    name = os.path.basename(src_file)
+    record = {"FHC": name.split("_")[0] == "FHC", "nHC": int(name.split("_")[1][:-5]), "src_file": src_file}
+
+    tf = ROOT.TFile(src_file, "READ")
+    try:
+        if not hasattr(tf, "tree"):
+            print("WARNING: no tree in file: ", src_file)
+            return None
+        tt = tf.tree
+        if tt.GetEntries() == 0:
+            return record
+        tt.GetEntry(0)
+        for branch in SRC_BRANCHES:
+            value = getattr(tt, branch)
+            record[branch] = np.array(value) if branch in SRC_ARRAYS else value
+        return record
+    finally:
+        tf.Close()
+
+def UpdateSrc(df, src_dest, nproc=1):
     """
-    get the raw file for the input sort file
+    get the raw file for the input sort file, and join the truth meta data of
+    its first event onto df by (FHC, nHC). Files are read on nproc processes.
     """
 
     nEntries = len(df)
@@ -172,78 +220,22 @@ def UpdateSrc(df, src_dest):
     if nEntries != nSrcs:
         return -1
 
-    # initialize
-    df["src_file"] = np.nan
-    df["ifileNo"] = np.nan
-    df["ievt"] = np.nan
-    df["lepPdg"] = np.nan
-    df["lepKE"] = np.nan
-    df["muonReco"] = np.nan
-    df["muGArLen"] = np.nan
-    df["hadTot"] = np.nan
-    df["hadP"] = np.nan
-    df["hadN"] = np.nan
-    df["hadPip"] = np.nan
-    df["hadPim"] = np.nan
-    df["hadPi0"] = np.nan
-    df["hadOther"] = np.nan
-    df["hadCollar"] = np.nan
-    df["p3lep"] = pd.Series(np.array)
-    df["vtx"] = pd.Series(np.array)
-    df["lepDeath"] = pd.Series(np.array)
-    df["muonExitPt"] = pd.Series(np.array)
-    df["muonExitMom"] = pd.Series(np.array)
-    df["nFS"] = pd.Series(np.array)
-    df["fsPdg"] = pd.Series(np.array)
-    df["fsPx"] = pd.Series(np.array)
-    df["fsPy"] = pd.Series(np.array)
-    df["fsPz"] = pd.Series(np.array)
-    df["fsE"] = pd.Series(np.array)
-    df["fsTrkLen"] = pd.Series(np.array)
-
-    for i, src_file in enumerate(src_files):
-
-        typ = src_file.split("/")[-1].split("_")[0] == "FHC"
-        nHC = int(src_file.split("/")[-1].split("_")[1][:-5])
-
-        if i%500 == 0:
-            print("adding entry:", i)
-
-        tf = ROOT.TFile(src_file, "READ")
-        if not hasattr(tf, "tree"):
-            return df
-        tt = tf.tree
-        for evt in tt:
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "src_file"] = src_file
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "ifileNo"] = evt.ifileNo
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "ievt"] = evt.ievt
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "lepPdg"] = evt.lepPdg
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "lepKE"] = evt.lepKE
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "muonReco"] = evt.muonReco
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "muGArLen"] = evt.muGArLen
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadTot"] = evt.hadTot
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadP"] = evt.hadP
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadN"] = evt.hadN
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadPip"] = evt.hadPip
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadPim"] = evt.hadPim
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadPi0"] = evt.hadPi0
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadOther"] = evt.hadOther
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "hadCollar"] = evt.hadCollar
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "p3lep"] = pd.Series(evt.p3lep)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "vtx"] = pd.Series(evt.vtx)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "lepDeath"] = pd.Series(evt.lepDeath)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "muonExitPt"] = pd.Series(evt.muonExitPt)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "muonExitMom"] = pd.Series(evt.muonExitMom)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "nFS"] = evt.nFS
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "fsPdg"] = pd.Series(evt.fsPdg)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "fsPx"] = pd.Series(evt.fsPx)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "fsPy"] = pd.Series(evt.fsPy)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "fsPz"] = pd.Series(evt.fsPz)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "fsE"] = pd.Series(evt.fsE)
-            df.loc[(df['nHC']==nHC)&(df['FHC']==typ), "fsTrkLen"] = pd.Series(evt.fsTrkLen)
-            break
-
-    return df
+    # each src file is read once, no matter how many sort files share it
+    src_files = list(dict.fromkeys(src_files))
+    if nproc > 1:
+        with mp.Pool(nproc) as pool:
+            records = pool.map(ReadSrcMeta, src_files, chunksize=16)
+    else:
+        records = [ReadSrcMeta(f) for f in src_files]
+    records = [r for r in records if r is not None]
+    print(f"read meta data of {len(records)} src files.")
+
+    meta = pd.DataFrame.from_records(records, columns=["FHC", "nHC", "src_file"] + SRC_BRANCHES)
+    meta = meta.drop_duplicates(subset=["FHC", "nHC"]).set_index(["FHC", "nHC"])
+
+    # a single keyed join, rows without a src file are left as NaN
+    df = df.drop(columns=[col for col in meta.columns if col in df.columns])
+    return df.join(meta, on=["FHC", "nHC"])
 
 if __name__ == "__main__":
     main()
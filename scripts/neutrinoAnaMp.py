@@ -1,6 +1,14 @@
 import sys, os
-import multiprocessing as mp
+import argparse
+import csv
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+## Runs the c++ anaNeutrino program over every file in the rtd data directory.
+## Jobs run concurrently, an output newer than its input is not remade, and the
+## wall time and peak RSS of every job is written to a summary csv. Each job is
+## given --threads as its implicit MT width, so workers x threads fill the cores.
 
 def find_prog(path, prog):
     """
@@ -16,23 +24,101 @@ def find_prog(path, prog):
             break
     return f
 
-def runAna(input_file, output_file):
-    prog = find_prog("./", "anaNeutrino")
-    ret = subprocess.run([prog, str(input_file), str(output_file)])
+def nWorkers(imtThreads=1, ncpu=None):
+    """
+    number of concurrent jobs, so that jobs which each run imtThreads implicit
+    MT threads together fill, but do not oversubscribe, the cores
+    """
+    ncpu = ncpu or os.cpu_count() or 1
+    return max(1, ncpu // max(1, imtThreads))
+
+def isUpToDate(input_file, output_file):
+    """
+    true if the output exists and is newer than its input
+    """
+    return os.path.isfile(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file)
 
-def main():
+def runAna(prog, input_file, output_file, threads=1):
+    """
+    run a single anaNeutrino job, with threads implicit MT threads
+
+    returns dictionary of the job's summary, peak RSS is in MB, or None where
+    os.wait4 is not available
+    """
+    start = time.monotonic()
+    proc = subprocess.Popen([prog, str(input_file), str(output_file), str(threads)])
+    peak = None
+    if hasattr(os, "wait4"):
+        # wait4 reports the resource usage of this child only
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # linux reports kB, macOS bytes
+        peak = round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    else:
+        proc.wait()
+    return {"input": input_file, "output": output_file, "status": "ran",
+            "returncode": proc.returncode, "wall_s": round(time.monotonic() - start, 3),
+            "peak_rss_mb": peak}
+
+def runAll(prog, jobs, workers, force=False, threads=1):
+    """
+    run the (input_file, output_file) jobs on workers threads, each of which
+    waits on its own anaNeutrino process of threads implicit MT threads
+
+    returns list of job summaries, in order of jobs
+    """
+    summary = [None] * len(jobs)
+    todo = []
+    for i, (input_file, output_file) in enumerate(jobs):
+        if not force and isUpToDate(input_file, output_file):
+            summary[i] = {"input": input_file, "output": output_file, "status": "skipped",
+                          "returncode": 0, "wall_s": 0.0, "peak_rss_mb": None}
+        else:
+            todo.append(i)
+    print(f"running {len(todo)} of {len(jobs)} jobs on {workers} workers, {len(jobs)-len(todo)} are up to date.")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(runAna, prog, *jobs[i], threads): i for i in todo}
+        for n, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            summary[i] = future.result()
+            if summary[i]["returncode"] != 0:
+                print(f"WARNING: anaNeutrino failed on {summary[i]['input']}, returned {summary[i]['returncode']}")
+            print(f"completed {n+1}/{len(todo)}: {summary[i]['input']} in {summary[i]['wall_s']} s")
+    return summary
+
+def writeSummary(summary, summary_file):
+    with open(summary_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["input", "output", "status", "returncode", "wall_s", "peak_rss_mb"])
+        writer.writeheader()
+        writer.writerows(summary)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run anaNeutrino over the rtd data files")
+    parser.add_argument("--input-dir", default="./data_rtd")
+    parser.add_argument("--output-dir", default="./pdfs/")
+    parser.add_argument("--threads", type=int, default=1, help="implicit MT threads used by each anaNeutrino job")
+    parser.add_argument("--workers", type=int, help="concurrent jobs, default fills the cores")
+    parser.add_argument("--force", action="store_true", help="remake outputs which are up to date")
+    parser.add_argument("--summary", default="anaNeutrino_summary.csv")
+    args = parser.parse_args(argv)
+
+    # find the program once, rather than once per job
+    prog = find_prog("./", "anaNeutrino")
+    if prog is None:
+        print("did not find anaNeutrino!")
+        return -1
 
-    input_files = os.listdir("./data_rtd")
-    output_files = [ os.path.join("./pdfs/", f[:-10] + "graphs.root") for f in input_files]
-    input_files = [os.path.join("./data_rtd", f) for f in input_files]
+    input_files = sorted(os.listdir(args.input_dir))
+    output_files = [os.path.join(args.output_dir, f[:-10] + "graphs.root") for f in input_files]
+    input_files = [os.path.join(args.input_dir, f) for f in input_files]
     print("found input_files:", input_files)
 
-    pool = mp.Pool(1)
-    pool.starmap(runAna, zip(input_files, output_files))
-    # print("creating output files.")
+    workers = args.workers or nWorkers(args.threads)
+    summary = runAll(prog, list(zip(input_files, output_files)), workers, args.force, args.threads)
+    writeSummary(summary, args.summary)
+    print(f"wrote job summary to {args.summary}")
+    return 0 if all(s["returncode"] == 0 for s in summary) else 1
 
 if __name__ == "__main__":
-    if len(sys.argv) != 1:
-        print("too many args")
-        sys.exit(-1)
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -340,6 +340,9 @@ class ProcQueue:
         self._entries = 0
         # keep track of how many items this has queue has processed
         self.processed = 0
+        # keep track of how many items have been added, and the deepest the queue got
+        self.pushed = 0
+        self.maxEntries = 0
 
     def AddQueueItem(self, asic, dir, QPByte, inTime, command=None):
         """
@@ -356,6 +359,9 @@ class ProcQueue:
         newItem = procItem
         curItem = self._curItem
         self._entries += 1
+        self.pushed += 1
+        if self._entries > self.maxEntries:
+            self.maxEntries = self._entries
 
         if curItem is None:
             self._curItem = newItem
@@ -473,6 +479,10 @@ class QPixAsic:
         self._hitReceptions = 0
         self._measuredTime = []
 
+        # counters: Process calls for each AsicState value, and repeated requests ignored
+        self._stateCalls = [0] * len(AsicState)
+        self._dupRequests = 0
+
         # useful members for InjectHits
         self._times = []
         self._channels = []
@@ -566,6 +576,7 @@ class QPixAsic:
 
         # ASIC has received this request already and should do nothing
         if inByte.wordType == AsicWord.REGREQ and self._reqID == inByte.ReqID:
+            self._dupRequests += 1
             return []
 
         # all data that is not a register request gets stored on remote fifos
@@ -760,7 +771,7 @@ class QPixAsic:
         # construct the channel byte here in one pass
         # else condition handles output of pyNotebooks
         if isinstance(channels[0], list):
-            self._channels = np.array([np.sum([0x1 << ch for ch in c]) for c in channels])
+            channels = [int(np.sum([0x1 << ch for ch in c])) for c in channels]
         else:
             channels = [0x1 << c for c in channels]
             # timestamps = [self.CalcTicks(t) for t in times]
@@ -851,6 +862,7 @@ class QPixAsic:
         # nothing to process if DAQ or if target time is in past
         if self.isDaqNode or self._absTimeNow >= targetTime:
             return []
+        self._stateCalls[self.state.value] += 1
 
         ## QPixRoute State machine ##
         if self.state == AsicState.Idle:
@@ -1339,6 +1351,10 @@ class DaqNode(QPixAsic):
             # easy access for calibration TODO refactor
             self.evtWords = []
 
+            # per-(row, col, wordType) index of the stored data, updated on
+            # every Write / Read
+            self._asicIndex = {}
+
         def Write(self, data:DaqData) -> int:
             if not isinstance(data, DaqData):
                 raise QPException(f"Can not add this data-type to the DaqNode local FIFO! {type(data)}")
@@ -1347,6 +1363,12 @@ class DaqNode(QPixAsic):
             self._curSize += 1
             self._totalWrites += 1
 
+            key = (data.row, data.col, data.wordType)
+            if key in self._asicIndex:
+                self._asicIndex[key].append(data)
+            else:
+                self._asicIndex[key] = [data]
+
             if data.wordType == AsicWord.DATA:
                 self._dataWords += 1
             elif data.wordType == AsicWord.EVTEND:
@@ -1368,6 +1390,29 @@ class DaqNode(QPixAsic):
         def Read(self) -> DaqData:
             if self._curSize > 0:
                 self._curSize -= 1
-                return self._data.pop(0)
+                data = self._data.pop(0)
+                # oldest word in the FIFO is also the oldest of its own key
+                self._asicIndex[(data.row, data.col, data.wordType)].pop(0)
+                return data
             else:
                 return None
+
+        def AsicData(self, row, col, wordType=AsicWord.DATA) -> tuple:
+            """
+            Return a tuple of the stored DaqData words received from ASIC
+            (row, col) of type wordType, in the order they were received.
+            """
+            return tuple(self._asicIndex.get((row, col, wordType), ()))
+
+        def CountMap(self, nrows, ncols, wordType=AsicWord.DATA) -> np.ndarray:
+            """
+            Return an (nrows, ncols) array of the number of currently stored words
+            of type wordType from each ASIC within the array.
+            """
+            counts = np.zeros((nrows, ncols), dtype=np.int64)
+            for (row, col, wType), words in self._asicIndex.items():
+                if wType != wordType or row is None or col is None:
+                    continue
+                if 0 <= row < nrows and 0 <= col < ncols:
+                    counts[row, col] = len(words)
+            return counts
@@ -1,5 +1,7 @@
 from QpixAsic import QPByte, QPixAsic, ProcQueue, DaqNode, AsicWord, AsicState, \
                      AsicConfig, AsicDirMask, QPException
+from QpixDataFormat import TRACE_DTYPE
+from QpixTile import QpixTile, LoadTile
 import matplotlib.pyplot as plt
 import random
 import math
@@ -351,13 +353,23 @@ def AnalyzeArray(qparray, silent=False):
         print(msg)
         return False
 
-    # check all of the ASICs
-    for asic in qparray:
-        data, end = AnalyzeASIC(qparray, asic.row, asic.col, silent=silent)
-        if len(data) != asic.totalInjected:
-            print(f"Analyze: Asic data failure at ({asic.row},{asic.col})", end=" ")
-            print(f"recv: {len(data)} expected {asic.totalInjected}")
-            return False
+    # check all of the ASICs at once against the DaqNode's per-ASIC counters
+    nrows, ncols = qparray._nrows, qparray._ncols
+    recvData = daqNode._localFifo.CountMap(nrows, ncols, AsicWord.DATA)
+    expected = np.asarray([[asic.totalInjected for asic in row] for row in qparray._asics])
+
+    if not silent:
+        recvEnd = daqNode._localFifo.CountMap(nrows, ncols, AsicWord.EVTEND)
+        for asic in qparray:
+            print(f"found {recvData[asic.row, asic.col]} hits for ASIC ({asic.row},{asic.col})")
+            print(f"found {recvEnd[asic.row, asic.col]} end words for ASIC ({asic.row},{asic.col})")
+
+    failures = np.argwhere(recvData != expected)
+    if len(failures) > 0:
+        row, col = failures[0]
+        print(f"Analyze: Asic data failure at ({row},{col})", end=" ")
+        print(f"recv: {recvData[row, col]} expected {expected[row, col]}")
+        return False
     return True
 
 
@@ -370,12 +382,11 @@ def AnalyzeASIC(qparray, row, col, silent=False):
 
     Return tuple of (asicData, asicEnd) within the daqNode on success.
     """
-    # get a list of all of the data within the DAQNode, and filter
-    # for the specific ASIC we want
-    daqNode = qparray._daqNode
-    fifoData = daqNode._localFifo._data
-    asicData = [d for d in fifoData if d.row==row and d.col == col and d.wordType==AsicWord.DATA]
-    asicEnd = [d for d in fifoData if d.row==row and d.col == col and d.wordType==AsicWord.EVTEND]
+    # the DAQNode keeps an index of its data for each ASIC, so there is no
+    # need to filter the full FIFO here
+    daqFifo = qparray._daqNode._localFifo
+    asicData = daqFifo.AsicData(row, col, AsicWord.DATA)
+    asicEnd = daqFifo.AsicData(row, col, AsicWord.EVTEND)
 
     if not silent:
         print(f"found {len(asicData)} hits for ASIC ({row},{col})")
@@ -398,7 +409,8 @@ class QpixAsicArray():
       deltaT      - stepping interval for the simulation
       timeEpsilon - stepping time interval for simulation (default 1e-6)
       debug       - debug level, values >= 0 produce text output (default 0)
-      tiledf      - tuple of asic hits to load into the array, tile dataframe is created from radiogenicNB
+      tiledf      - tuple of asic hits to load into the array, tile dataframe is created from radiogenicNB,
+                    or a QpixTile / path to a binary tile file
       RouteState  - string or None type member to define current routing method of Array
       push_state  - enable flag that is sent to ASICs within the array enabling push
       seed        - seed value to send to random module
@@ -407,6 +419,10 @@ class QpixAsicArray():
     def __init__(self, nrows, ncols, nPixs=16, fNominal=30e6, pctSpread=0.05, deltaT=1e-5, timeEpsilon=1e-6,
                  timeout=1.5e4, hitsPerSec = 20./1., debug=0.0, tiledf=None, seed=2, offset=None):
 
+        # binary tiles are injected straight from their arrays
+        if isinstance(tiledf, str):
+            tiledf = LoadTile(tiledf)
+
         # if we have a tiledf to construct an array, then the size is determined by the tile
         if tiledf is not None:
             self._nrows = tiledf["nrows"]
@@ -451,8 +467,19 @@ class QpixAsicArray():
         self.totalInjectedHits = 0
         self.totalTimes = 0
 
+        # simulation counters, see stats()
+        self._arrayPasses = 0
+        self._recvCalls = [0] * 16 # indexed by 4 bit word type
+        self._profile = False
+        self._handlerTime = {}
+
+        # ReceiveByte event trace, see EnableTrace()
+        self._trace = None
+
         # load in hits if we're creating an array based on tiledf data
-        if tiledf is not None:
+        if isinstance(tiledf, QpixTile):
+            self.InjectHitArrays(tiledf.asics, tiledf.times, tiledf.channels, offset=offset)
+        elif tiledf is not None:
             self._InjectHits(tiledf["hits"], offset=offset)
    
     def __iter__(self):
@@ -611,10 +638,15 @@ class QpixAsicArray():
         """
         processed = 0
         somethingToDo = True
+        profile = self._profile
         while somethingToDo:
             somethingToDo = False
+            self._arrayPasses += 1
             for asic in self:
-                newProcessItems = asic.Process(nextTime)
+                if profile:
+                    newProcessItems = self._ProfileProcess(asic, nextTime)
+                else:
+                    newProcessItems = asic.Process(nextTime)
                 if newProcessItems:
                     somethingToDo = True
                     for item in newProcessItems:
@@ -633,12 +665,17 @@ class QpixAsicArray():
         """
         steps = 0
         PROCITEM = 0
+        profile = self._profile
+        trace = self._trace
         self._procAsics = [asic for asic in self]
         while(self._timeNow < timeEnd):
 
             dT = self._timeNow - self._timeEpsilon
             for asic in self._procAsics:
-                newProcessItems = asic.Process(dT)
+                if profile:
+                    newProcessItems = self._ProfileProcess(asic, dT)
+                else:
+                    newProcessItems = asic.Process(dT)
                 if newProcessItems:
                     self._alert = 1 # this is not really a problem
                     for item in newProcessItems:
@@ -660,7 +697,13 @@ class QpixAsicArray():
 
                 p1 = self._ProcessArray(hitTime-self._timeEpsilon)
 
-                newProcessItems = asic.ReceiveByte(nextItem)
+                self._recvCalls[nextItem.QPByte.wordType.value] += 1
+                if trace is not None:
+                    trace.append(self._TraceRecord(nextItem))
+                if profile:
+                    newProcessItems = self._ProfileReceive(asic, nextItem)
+                else:
+                    newProcessItems = asic.ReceiveByte(nextItem)
                 if newProcessItems:
                     for item in newProcessItems:
                         self._queue.AddQueueItem(*item)
@@ -686,6 +729,112 @@ class QpixAsicArray():
 
         return
 
+    def _ProfileProcess(self, asic, targetTime):
+        """
+        timed wrapper of QPixAsic.Process, wall time is recorded to the state
+        the ASIC was in when called
+        """
+        key = f"Process:{asic.state.name}"
+        t0 = time.perf_counter()
+        newProcessItems = asic.Process(targetTime)
+        self._handlerTime[key] = self._handlerTime.get(key, 0) + time.perf_counter() - t0
+        return newProcessItems
+
+    def _ProfileReceive(self, asic, queueItem):
+        """
+        timed wrapper of ReceiveByte, wall time is recorded to the received word type
+        """
+        key = f"ReceiveByte:{queueItem.QPByte.wordType.name}"
+        t0 = time.perf_counter()
+        newProcessItems = asic.ReceiveByte(queueItem)
+        self._handlerTime[key] = self._handlerTime.get(key, 0) + time.perf_counter() - t0
+        return newProcessItems
+
+    def _TraceRecord(self, queueItem):
+        """
+        build the TRACE_DTYPE record of a ProcItem about to be received. The tag
+        is the ReqID of REGREQ / EVTEND words, the timestamp of data words, else -1.
+        DaqNode and DaqNode sourced positions are recorded as -1.
+        """
+        asic = queueItem.asic
+        inByte = queueItem.QPByte
+        wordType = inByte.wordType
+        if wordType == AsicWord.REGREQ or wordType == AsicWord.EVTEND:
+            tag = inByte.ReqID
+        elif inByte.timeStamp is not None:
+            tag = inByte.timeStamp
+        else:
+            tag = -1
+        inDir = queueItem.dir
+        if isinstance(inDir, AsicDirMask):
+            inDir = inDir.value
+        return (queueItem.inTime,
+                -1 if asic.row is None else asic.row,
+                -1 if asic.col is None else asic.col,
+                inDir, wordType.value,
+                -1 if inByte.originRow is None else inByte.originRow,
+                -1 if inByte.originCol is None else inByte.originCol,
+                tag)
+
+    def EnableTrace(self, enabled=True):
+        """
+        Record every ReceiveByte processed by the array, see Trace().
+        Enabling always starts a new, empty trace.
+        """
+        assert isinstance(enabled, bool), "must supply boolean state to enable tracing"
+        self._trace = [] if enabled else None
+
+    def Trace(self):
+        """
+        Return the recorded ReceiveByte events as a TRACE_DTYPE array, in the order
+        they were processed. Compare traces with QpixTrace.DiffTraces.
+        """
+        if self._trace is None:
+            raise QPException("tracing is not enabled on this array, call EnableTrace()")
+        return np.array(self._trace, dtype=TRACE_DTYPE)
+
+    def EnableProfiling(self, enabled=True):
+        """
+        Enable recording the wall time spent in each ASIC handler, reported by stats().
+        Counters are always recorded, the timers are only recorded when enabled.
+        """
+        assert isinstance(enabled, bool), "must supply boolean state to enable profiling"
+        self._profile = enabled
+
+    def stats(self):
+        """
+        Return a dictionary of simulation counters collected while processing the array:
+            queue         - ProcQueue pushes, pops, current and max length
+            receiveByte   - ReceiveByte calls for each AsicWord type
+            process       - QPixAsic.Process calls for each AsicState
+            arrayPasses   - number of passes over the array within _ProcessArray
+            dupRequests   - broadcast register requests received more than once by an ASIC
+            fifoHighWater - max depth of the local, remote, and DaqNode FIFOs
+            handlerTime   - wall time (s) in each handler, only if profiling is enabled
+        """
+        asics = [asic for asic in self]
+        process = {state.name: sum(asic._stateCalls[state.value] for asic in asics) for state in AsicState}
+        data = {
+            "queue": {
+                "pushed": self._queue.pushed,
+                "popped": self._queue.processed,
+                "pending": self._queue.Length(),
+                "maxLength": self._queue.maxEntries,
+            },
+            "receiveByte": {word.name: self._recvCalls[word.value] for word in AsicWord},
+            "process": process,
+            "arrayPasses": self._arrayPasses,
+            "dupRequests": sum(asic._dupRequests for asic in asics),
+            "fifoHighWater": {
+                "local": max(asic._localFifo._maxSize for asic in asics),
+                "remote": max(asic._remoteFifo._maxSize for asic in asics),
+                "daq": self._daqNode._localFifo._maxSize,
+            },
+        }
+        if self._profile:
+            data["handlerTime"] = dict(self._handlerTime)
+        return data
+
     def SetPushState(self, enabled=True, transact=False):
         """
         This function will send a ASIC configuration write to all ASICs
@@ -842,6 +991,35 @@ class QpixAsicArray():
             self.totalTimes += len(times)
         self.totalInjectedHits = len(self.InjectedHits)
 
+    def InjectHitArrays(self, asics, times, channels, offset=None):
+        """
+        Array based version of _InjectHits, for hits converted with
+        QpixDataFormat.HitsToArrays. The arrays may be read-only memory maps,
+        only each ASIC's slice is copied out when it is injected.
+
+        ARGS:
+            asics    - HIT_ASIC_DTYPE array of (Row, Col, Start, Stop)
+            times    - flat array of hit times
+            channels - flat array of hit channels
+            offset   - time, of when to set the earliest injected reset value to
+        """
+        self.InjectedHits = []
+        self.totalTimes = 0
+        for asicX, asicY, start, stop in asics.tolist():
+
+            if asicX >= self._nrows or asicY >= self._ncols:
+                continue
+
+            asicTimes = np.array(times[start:stop])
+            if offset is not None:
+                asicTimes = asicTimes + offset
+
+            self._asics[asicX][asicY].InjectHits(asicTimes, np.array(channels[start:stop], dtype=np.int64))
+
+            self.InjectedHits.extend(self._asics[asicX][asicY]._times)
+            self.totalTimes += stop - start
+        self.totalInjectedHits = len(self.InjectedHits)
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,306 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import multiprocessing as mp
+from datetime import datetime
+
+import numpy as np
+import QpixAsicArray as qparray
+from QpixAsic import AsicWord
+
+## Benchmark driver for the QpixAsicArray simulation. Each case builds a tile
+## from a synthetic or bundled input, runs the same interrogate loop used by
+## QpixMPAnalysis (pullTile / pushTile) and reports throughput numbers.
+##
+## Every case runs within its own spawned process so that the peak RSS belongs
+## to that case alone. Results can be saved as a baseline json and compared
+## against on later runs:
+##   python QpixBenchmark.py --suite quick --save benchmarks/quick.json
+##   python QpixBenchmark.py --suite quick --compare benchmarks/quick.json
+##
+## The baselines within benchmarks/ are committed:
+##   quick.json - the quick suite, --repeat 3
+##   sweep.json - synthetic 2x2 to 8x8 tiles of every route and architecture,
+##                --inputs synthetic --dims 2x2,4x4,8x8 --int-time 1 --repeat 3,
+##                which QpixMPAnalysis estimates the push job cost from
+
+JSON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jsons")
+
+# bundled inputs, synthetic inputs are generated per tile size
+INPUTS = {
+    "tiledf": "tiledf.json",
+    "tiledf05": "tiledf05_10x14.json",
+    "tiledf_long": "tiledf_long.json",
+    "tiledf_neut": "tiledf_neut.json",
+    "rtd": "1k_rtd_data_200-210.json",
+}
+
+SUITES = {
+    "quick": {
+        "inputs": ["synthetic", "tiledf05"],
+        "dims": [(2,2), (4,4)],
+        "routes": ["left", "snake", "trunk"],
+        "archs": ["pull", "push"],
+        "int_time": 1.0,
+    },
+    "full": {
+        "inputs": ["synthetic"] + list(INPUTS),
+        "dims": [(2,2), (4,4), (8,8), (10,14), (16,16)],
+        "routes": ["left", "snake", "trunk"],
+        "archs": ["pull", "push"],
+        "int_time": 10.0,
+    },
+}
+
+SEED = 420
+FRQ = 0.05
+INT_PRD = 0.5
+NHARDINT = 10
+SYNTH_RATE = 20. # hits per second per ASIC for synthetic tiles
+
+
+def MakeSyntheticTile(nrows, ncols, int_time, rate=SYNTH_RATE, nPixs=16, seed=SEED):
+    """
+    Build a tiledf of uniform random hits on every ASIC, in the same format as
+    the jsons created by radiogenicNB.
+    """
+    rng = np.random.default_rng(seed)
+    hits = []
+    for row in range(nrows):
+        for col in range(ncols):
+            n = rng.poisson(rate * int_time)
+            times = np.sort(rng.uniform(0, int_time, n))
+            channels = rng.integers(0, nPixs, n)
+            hits.append([row, col, [[float(t), float(c)] for t, c in zip(times, channels)]])
+    return {"nrows":nrows, "ncols":ncols, "hits":hits}
+
+
+def CropTile(tiledf, nrows, ncols, int_time, nPixs=16):
+    """
+    Fit a bundled tiledf onto an nrows x ncols tile. ASICs outside of the tile
+    are dropped along with hits past the integration time.
+
+    Channels are folded onto [0, nPixs), since some of the bundled files (1k_rtd)
+    store pixel IDs rather than ASIC channels.
+    """
+    hits = []
+    for row, col, resets in tiledf["hits"]:
+        if row >= nrows or col >= ncols:
+            continue
+        resets = [[t, float(int(ch) % nPixs)] for t, ch in resets if t < int_time]
+        hits.append([row, col, resets])
+    return {"nrows":nrows, "ncols":ncols, "hits":hits}
+
+
+def BuildInput(name, nrows, ncols, int_time):
+    """
+    return the tiledf for a benchmark case
+    """
+    if name == "synthetic":
+        return MakeSyntheticTile(nrows, ncols, int_time)
+    with open(os.path.join(JSON_DIR, INPUTS[name]), "r") as f:
+        tiledf = json.load(f)
+    return CropTile(tiledf, nrows, ncols, int_time)
+
+
+def CaseKey(case):
+    return f"{case['input']}:{case['nrows']}x{case['ncols']}:{case['route']}:{case['arch']}"
+
+
+def MakeCases(inputs, dims, routes, archs, int_time, repeat=1):
+    return [{"input":i, "nrows":r, "ncols":c, "route":route, "arch":arch,
+             "int_time":int_time, "repeat":repeat}
+            for i in inputs for r, c in dims for route in routes for arch in archs]
+
+
+def PeakRSS():
+    """
+    peak resident set size of this process in MB
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kB, mac reports bytes
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return rss / scale
+
+
+def RunTile(tiledf, route, arch, int_time):
+    """
+    Run one event the same way that QpixMPAnalysis.pullTile / pushTile do.
+
+    Returns the processed tile.
+    """
+    np.random.seed(SEED)
+    tile = qparray.QpixAsicArray(0, 0, tiledf=tiledf, deltaT=10e-6, debug=0, pctSpread=FRQ, seed=SEED)
+
+    tile.SetSendRemote(enabled=True, transact=False)
+    if route == "trunk":
+        # route near middle as pullTile does, kept within the columns the trunk can use
+        pos = max(0, min(int(tile._nrows/2), tile._ncols-2))
+        tile.Route(route, transact=False, pos=pos)
+    else:
+        tile.Route(route, transact=False)
+    if arch == "push":
+        tile.SetPushState(enabled=True, transact=False)
+
+    dT, nInt = 0, 0
+    while dT < int_time + INT_PRD:
+        dT += INT_PRD
+        tile.Interrogate(INT_PRD, hard=(nInt % NHARDINT == 0))
+        nInt += 1
+
+    return tile
+
+
+def RunCase(case):
+    """
+    Run a single benchmark case, meant to be called within a fresh process.
+
+    The wall time of an event includes the tile construction and hit injection,
+    since both are paid for every event within a sweep.
+    """
+    tiledf = BuildInput(case["input"], case["nrows"], case["ncols"], case["int_time"])
+
+    walls = []
+    for _ in range(case["repeat"]):
+        start = time.perf_counter()
+        tile = RunTile(tiledf, case["route"], case["arch"], case["int_time"])
+        walls.append(time.perf_counter() - start)
+
+    wall = float(np.median(walls))
+    delivered = int(tile._daqNode._localFifo.CountMap(tile._nrows, tile._ncols, AsicWord.DATA).sum())
+    stats = tile.stats()
+
+    return {
+        **case,
+        "wall_s": wall,
+        "events_per_s": 1.0 / wall if wall > 0 else float("inf"),
+        "injected_hits": int(tile.totalInjectedHits),
+        "delivered_hits": delivered,
+        "us_per_hit": wall / delivered * 1e6 if delivered > 0 else None,
+        "queue_pushed": stats["queue"]["pushed"],
+        "array_passes": stats["arrayPasses"],
+        "peak_rss_mb": PeakRSS(),
+    }
+
+
+def RunCases(cases, jobs=1):
+    """
+    Run every case in its own spawned process, so that peak RSS is measured per
+    case. jobs > 1 runs cases concurrently, which will skew the timings.
+    """
+    ctx = mp.get_context("spawn")
+    results = []
+    with ctx.Pool(jobs, maxtasksperchild=1) as pool:
+        for res in pool.imap(RunCase, cases):
+            PrintResult(res)
+            results.append(res)
+    return results
+
+
+def PrintResult(res):
+    usHit = f"{res['us_per_hit']:10.1f}" if res["us_per_hit"] is not None else f"{'-':>10}"
+    print(f"{CaseKey(res):<36} {res['events_per_s']:10.3f} ev/s {usHit} us/hit "
+          f"{res['delivered_hits']:8d} hits {res['peak_rss_mb']:8.1f} MB")
+
+
+def SaveBaseline(fileName, results):
+    """
+    write results as a baseline json, keyed by CaseKey
+    """
+    baseline = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "cases": {CaseKey(res): res for res in results},
+    }
+    dirName = os.path.dirname(fileName)
+    if dirName:
+        os.makedirs(dirName, exist_ok=True)
+    with open(fileName, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"saved baseline of {len(results)} cases to {fileName}")
+
+
+def CompareBaseline(fileName, results, tolerance=0.1):
+    """
+    Compare results against a saved baseline. A case regresses if its wall time
+    grew by more than tolerance, or if it now delivers a different number of hits.
+
+    Returns the list of regressed case keys.
+    """
+    with open(fileName, "r") as f:
+        baseline = json.load(f)["cases"]
+
+    regressed = []
+    print(f"\n{'case':<36} {'base ev/s':>10} {'new ev/s':>10} {'speedup':>8} {'rss MB':>14}")
+    for res in results:
+        key = CaseKey(res)
+        if key not in baseline:
+            print(f"{key:<36} {'not in baseline':>30}")
+            continue
+        base = baseline[key]
+        speedup = base["wall_s"] / res["wall_s"] if res["wall_s"] > 0 else float("inf")
+        flag = ""
+        if res["delivered_hits"] != base["delivered_hits"]:
+            flag = f"  DELIVERED {base['delivered_hits']} -> {res['delivered_hits']}"
+        elif speedup < 1 / (1 + tolerance):
+            flag = "  SLOWER"
+        if flag:
+            regressed.append(key)
+        print(f"{key:<36} {base['events_per_s']:10.3f} {res['events_per_s']:10.3f} {speedup:8.2f}"
+              f" {base['peak_rss_mb']:6.1f}->{res['peak_rss_mb']:6.1f}{flag}")
+    return regressed
+
+
+def ParseDims(dims):
+    return [tuple(int(v) for v in d.lower().split("x")) for d in dims.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark QpixAsicArray processing")
+    parser.add_argument("--suite", choices=list(SUITES), default="quick")
+    parser.add_argument("--inputs", help="comma separated inputs, from: synthetic," + ",".join(INPUTS))
+    parser.add_argument("--dims", help="comma separated tile sizes, ie 4x4,10x14")
+    parser.add_argument("--routes", help="comma separated routes, from: left,snake,trunk")
+    parser.add_argument("--archs", help="comma separated architectures, from: pull,push")
+    parser.add_argument("--int-time", type=float, help="simulated seconds per event")
+    parser.add_argument("--repeat", type=int, default=1, help="events per case, median time is reported")
+    parser.add_argument("--jobs", type=int, default=1, help="concurrent cases, >1 skews timings")
+    parser.add_argument("--save", help="write results to this baseline json")
+    parser.add_argument("--compare", help="compare results against this baseline json")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed fractional slow down")
+    args = parser.parse_args(argv)
+
+    suite = SUITES[args.suite]
+    inputs = args.inputs.split(",") if args.inputs else suite["inputs"]
+    for i in inputs:
+        if i != "synthetic" and i not in INPUTS:
+            parser.error(f"unknown input {i}")
+    dims = ParseDims(args.dims) if args.dims else suite["dims"]
+    routes = args.routes.split(",") if args.routes else suite["routes"]
+    archs = args.archs.split(",") if args.archs else suite["archs"]
+    int_time = args.int_time if args.int_time is not None else suite["int_time"]
+
+    cases = MakeCases(inputs, dims, routes, archs, int_time, args.repeat)
+    print(f"running {len(cases)} benchmark cases @ {datetime.now()}..")
+    results = RunCases(cases, jobs=args.jobs)
+
+    if args.save:
+        SaveBaseline(args.save, results)
+    if args.compare:
+        regressed = CompareBaseline(args.compare, results, args.tolerance)
+        if regressed:
+            print(f"{len(regressed)} cases regressed")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+import os
+import numpy as np
+from QpixAsic import QPException
+
+## Bit layout of the 64 bit Endeavor word, matching the QpixDataFormatType
+## fields stored in a QPByte:
+##   [63:60] word type
+##   [59:56] origin row
+##   [55:52] origin col
+##   [51:48] reserved
+##   [47:16] 32 bit timestamp
+##   [15: 0] 16 bit channel mask
+WORD_TYPE_SHIFT = 60
+ROW_SHIFT = 56
+COL_SHIFT = 52
+TIMESTAMP_SHIFT = 16
+CHANNEL_SHIFT = 0
+
+WORD_TYPE_MASK = 0xF
+POS_MASK = 0xF
+TIMESTAMP_MASK = 0xFFFFFFFF
+CHANNEL_MASK = 0xFFFF
+
+# sim-only values which are not part of the 64 bit word are stored alongside
+# the packed stream, one entry per word
+DAQ_EXTRA_DTYPE = np.dtype([
+    ("DaqTime", np.int64),    # DaqNode tick when the word was received
+    ("SimTime", np.float64),  # 'true' time stored in QPByte.data, -1 if None
+    ("ReqID", np.int32),      # request ID of REGREQ/EVTEND words, -1 otherwise
+])
+
+# one record per ReceiveByte processed by a QpixAsicArray, see EnableTrace
+TRACE_DTYPE = np.dtype([
+    ("Time", np.float64),     # ProcItem inTime
+    ("Row", np.int8),         # receiving ASIC, -1 for the DaqNode
+    ("Col", np.int8),
+    ("Dir", np.int8),         # AsicDirMask value the word came in from
+    ("WordType", np.int8),
+    ("OriginRow", np.int8),   # sending ASIC, -1 if sourced from the DaqNode
+    ("OriginCol", np.int8),
+    ("Tag", np.int64),        # ReqID of REGREQ/EVTEND words, timestamp of data words
+])
+
+
+def PackWords(wordType, row, col, timeStamp, channelMask) -> np.ndarray:
+    """
+    Pack arrays of word fields into a uint64 stream based on the layout above.
+
+    Timestamps are truncated to 32 bits, as the ASIC counter would wrap.
+    Row and col values must fit within their 4 bit fields.
+    """
+    wordType = np.asarray(wordType, dtype=np.uint64)
+    row = np.asarray(row, dtype=np.int64)
+    col = np.asarray(col, dtype=np.int64)
+    if np.any((row < 0) | (row > POS_MASK)) or np.any((col < 0) | (col > POS_MASK)):
+        raise QPException("ASIC positions must fit within 4 bits to pack a DAQ word!")
+    if np.any(wordType > WORD_TYPE_MASK):
+        raise QPException("word types must fit within 4 bits to pack a DAQ word!")
+
+    timeStamp = np.asarray(timeStamp, dtype=np.int64) & TIMESTAMP_MASK
+    channelMask = np.asarray(channelMask, dtype=np.int64) & CHANNEL_MASK
+
+    words = wordType << np.uint64(WORD_TYPE_SHIFT)
+    words |= row.astype(np.uint64) << np.uint64(ROW_SHIFT)
+    words |= col.astype(np.uint64) << np.uint64(COL_SHIFT)
+    words |= timeStamp.astype(np.uint64) << np.uint64(TIMESTAMP_SHIFT)
+    words |= channelMask.astype(np.uint64) << np.uint64(CHANNEL_SHIFT)
+    return words
+
+
+def UnpackWords(words) -> dict:
+    """
+    Vectorized decode of a uint64 word stream back into its field columns.
+    """
+    words = np.asarray(words, dtype=np.uint64)
+    return {
+        "WordType": ((words >> np.uint64(WORD_TYPE_SHIFT)) & np.uint64(WORD_TYPE_MASK)).astype(np.short),
+        "Row": ((words >> np.uint64(ROW_SHIFT)) & np.uint64(POS_MASK)).astype(np.short),
+        "Col": ((words >> np.uint64(COL_SHIFT)) & np.uint64(POS_MASK)).astype(np.short),
+        "Timestamp": ((words >> np.uint64(TIMESTAMP_SHIFT)) & np.uint64(TIMESTAMP_MASK)).astype(np.int64),
+        "Channels": ((words >> np.uint64(CHANNEL_SHIFT)) & np.uint64(CHANNEL_MASK)).astype(np.intc),
+    }
+
+
+def EncodeDaqData(daqData):
+    """
+    Pack a list of DaqData, usually the DaqNode's local FIFO data, into a uint64
+    word stream and its side array of sim-only extras.
+
+    Missing timestamps and channel masks (REGRESP / EVTEND words) are packed as 0.
+
+    Returns tuple of (words, extras)
+    """
+    n = len(daqData)
+    wordType = np.fromiter((d.wordType.value for d in daqData), dtype=np.uint64, count=n)
+    row = np.fromiter((d.row for d in daqData), dtype=np.int64, count=n)
+    col = np.fromiter((d.col for d in daqData), dtype=np.int64, count=n)
+    timeStamp = np.fromiter((d.qbyte.timeStamp if d.qbyte.timeStamp is not None else 0
+                             for d in daqData), dtype=np.int64, count=n)
+    channelMask = np.fromiter((int(d.qbyte.channelMask) if d.qbyte.channelMask is not None else 0
+                               for d in daqData), dtype=np.int64, count=n)
+    words = PackWords(wordType, row, col, timeStamp, channelMask)
+
+    extras = np.empty(n, dtype=DAQ_EXTRA_DTYPE)
+    extras["DaqTime"] = np.fromiter((d.daqT for d in daqData), dtype=np.int64, count=n)
+    extras["SimTime"] = np.fromiter((d.qbyte.data if d.qbyte.data is not None else -1
+                                     for d in daqData), dtype=np.float64, count=n)
+    extras["ReqID"] = np.fromiter((getattr(d.qbyte, "ReqID", -1) for d in daqData), dtype=np.int32, count=n)
+
+    return words, extras
+
+
+def DecodeDaqStream(words, extras=None) -> dict:
+    """
+    Decode a packed DAQ stream into the Daq* columns produced by
+    QpixMPAnalysis.makeData. Sim-only columns are included if extras are given.
+    """
+    fields = UnpackWords(words)
+    data = {
+        "DaqAsicX": fields["Row"],
+        "DaqAsicY": fields["Col"],
+        "DaqWordType": fields["WordType"],
+        "DaqTimestamp": fields["Timestamp"],
+        "Daqchannels": fields["Channels"],
+    }
+    if extras is not None:
+        data["DaqTime"] = np.asarray(extras["DaqTime"])
+        data["DaqSimTime"] = np.asarray(extras["SimTime"])
+        data["DaqReqID"] = np.asarray(extras["ReqID"])
+    return data
+
+
+def SaveDaqStream(fileName, words, extras=None):
+    """
+    Write the packed stream to <fileName>_words.npy (8 bytes per word), and the
+    sim-only extras, if any, to <fileName>_extra.npy.
+    """
+    np.save(f"{fileName}_words.npy", np.asarray(words, dtype=np.uint64))
+    if extras is not None:
+        np.save(f"{fileName}_extra.npy", np.asarray(extras, dtype=DAQ_EXTRA_DTYPE))
+
+
+def LoadDaqStream(fileName, mmap=True):
+    """
+    Read a stream written by SaveDaqStream. With mmap the arrays are memory mapped
+    read-only, so full-run streams do not need to fit in memory.
+
+    Returns tuple of (words, extras), where extras is None if it was not saved.
+    """
+    mode = "r" if mmap else None
+    words = np.load(f"{fileName}_words.npy", mmap_mode=mode)
+    extras = None
+    if os.path.isfile(f"{fileName}_extra.npy"):
+        extras = np.load(f"{fileName}_extra.npy", mmap_mode=mode)
+    return words, extras
+
+
+
+## Injected hits in CSR form: one HIT_ASIC_DTYPE entry per ASIC of a tiledf
+## "hits" list, in its original order, pointing at the [Start, Stop) slice of
+## the flat, per-ASIC time sorted, times and channels arrays.
+HIT_ASIC_DTYPE = np.dtype([
+    ("Row", np.int32),
+    ("Col", np.int32),
+    ("Start", np.int64),
+    ("Stop", np.int64),
+])
+
+
+def HitsToArrays(hits):
+    """
+    Convert tiledf hits, a list of (asicX, asicY, [(time, channel), ...]), into
+    CSR arrays which can be injected with QpixAsicArray.InjectHitArrays.
+
+    Channels are truncated to int as _InjectHits does.
+
+    Returns tuple of (asics, times, channels)
+    """
+    counts = np.asarray([len(resets) for _, _, resets in hits], dtype=np.int64)
+    asics = np.empty(len(hits), dtype=HIT_ASIC_DTYPE)
+    asics["Row"] = [asicX for asicX, _, _ in hits]
+    asics["Col"] = [asicY for _, asicY, _ in hits]
+    asics["Stop"] = np.cumsum(counts)
+    asics["Start"] = asics["Stop"] - counts
+
+    times = np.empty(int(counts.sum()), dtype=np.float64)
+    channels = np.empty(int(counts.sum()), dtype=np.int64)
+    for (_, _, resets), start, stop in zip(hits, asics["Start"], asics["Stop"]):
+        if stop == start:
+            continue
+        resets = np.asarray(resets, dtype=np.float64).reshape(-1, 2)
+        order = np.argsort(resets[:, 0], kind="stable")
+        times[start:stop] = resets[order, 0]
+        channels[start:stop] = resets[order, 1].astype(np.int64)
+
+    return asics, times, channels
@@ -1,14 +1,25 @@
+import json
 import multiprocessing as mp
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import numpy as np
 import QpixAsicArray as qparray
-import pandas as pd
+from QpixAsic import QPException
+from QpixSweepWriter import SweepWriter, CompletedKeys
+from QpixSummary import SweepSummary, ReadSummaryFrame
+from QpixReduce import Reduction, DEFAULT_REDUCERS
+from QpixTile import LoadTile, ConvertJson, IsTileFile, TILE_EXT
+from QpixTileCache import TileCache, PrintReport
 from datetime import datetime
 
 # make sure we can find the script path
 import sys
 sys.path.append("../")
 from scripts.neutMakeJson import main as MakeNeutJson
+from scripts.neutMakeJson import makeTiles, makeAPATiles
+from scripts.neutMakeJson import channelXdim, channelYdim, EXTRACT_VERSION
 
 ## This Script reads in the output of radiogenicNB.ipynb (which reads in output
 ## from radiogenic ROOT data) and then executes a parameter space search
@@ -16,80 +27,141 @@ from scripts.neutMakeJson import main as MakeNeutJson
 
 MAXTIME = 10 # time to integrate for, or time radiogenic data is based on
 INPUT_FILE = "../jsons/1k_rtd_data_200-210.json"
+BACKGROUND_FILE = "../jsons/1k_rtd_data_200-210.qtile" # QpixTile of INPUT_FILE
 INPUT_DATA_FILE = "../data_rtd/single_electron_nu_fhc_files.root"
+OUTPUT_DATASET = "neutMP"
+OUTPUT_SUMMARY = "neutMP_summary.json" # merged SweepSummary of OUTPUT_DATASET
+TILE_CACHE_DIR = "../jsons/tiles"
+TILE_CACHE_BYTES = int(20e9) # evict least recently used tiles beyond this size
+APA_TILE_DIR = "../jsons/apa_tiles" # every tile of the APA, see MakeAPAFiles
+DAQ_DIR = "../jsons/daq" # full DAQ streams of each tile, only written on request
 SEED = 420
 
 INT_PRD = 0.5
 NHARDINT = 10
 
-def makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos):
+# benchmark baseline the relative cost of push jobs is taken from, see PushCost
+PUSH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "sweep.json")
+
+def PushCost(baselineFile=PUSH_BASELINE, default=10):
+    """
+    Relative cost of a push job to a pull job of the same tile, the median
+    ratio of their wall times over the cases of a QpixBenchmark baseline which
+    were run with both architectures. default if there is no such baseline.
+    """
+    if not os.path.isfile(baselineFile):
+        return default
+    with open(baselineFile, "r") as f:
+        cases = json.load(f)["cases"]
+    ratios = [case["wall_s"] / cases[key[:-len("push")] + "pull"]["wall_s"]
+              for key, case in cases.items()
+              if key.endswith(":push") and key[:-len("push")] + "pull" in cases]
+    return float(np.median(ratios)) if ratios else default
+
+# relative cost of a push job to a pull job of the same tile
+PUSH_COST = PushCost()
+
+# per worker copy of the radiogenic background and the tile Reduction, see InitWorker
+_background = None
+_reduction = None
+
+def ArchLabel(push):
+    """
+    Architecture label stored for a tile. NOTE: the labels are swapped, push
+    tiles are stored as "Pull", and neutGraphs selects them that way.
+    """
+    return "Pull" if push else "Push"
+
+def makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile=None, reduction=None):
     """
     Helper function which will extrct relevant data from a processed tile to a
     serialized, useful format to put onto the mp.queue
 
     This function must be useful to extract for comparative analysis based 
     on either a push or a pull architecture.
-    """
 
-    # memoize lists to input serialized data
-    daqBytes = list([daqbyte for daqbyte in tile._daqNode._localFifo._data])
-    asics = list([asic for asic in tile])
+    Only the tile's meta data and the summaries of the worker's Reduction are
+    returned, see QpixReduce. Reduction(["full"]) returns everything as before.
+    """
+    if reduction is None:
+        reduction = GetReduction()
 
-    data = {
-        "Architecture":"Pull" if tile.push_state else "Push",
+    meta = {
+        "Architecture":ArchLabel(tile.push_state),
         "Route":r,
+        "File":neutFile,
         "frq":frq,
-        "Injected Hits":np.asarray(tile.InjectedHits, dtype=np.double),
         "Injected Size":int(tile.totalInjectedHits),
+        "size":len(list(tile)), # number of ASICs in the tile, so readers can filter without AsicX
         "energy_deposit":energy_dep,
         "lep_recon":lep_recon,
         "axis_x":axis_x,
         "axis_z":axis_z,
         "zpos":zpos,
-
-        # asic data
-        "AsicX":np.asarray([asic.col for asic in asics], dtype=np.short),
-        "AsicY":np.asarray([asic.row for asic in asics], dtype=np.short),
-        "Frq":np.asarray([asic.fOsc for asic in asics], dtype=np.single),
-        "Start Time":np.asarray([asic._startTime for asic in asics], dtype=np.single),
-        "Rel Time":np.asarray([asic.relTimeNow for asic in asics], dtype=np.single),
-        "Rel Tick":np.asarray([asic.relTicksNow for asic in asics], dtype=np.intc),
-
-        # local data
-        "Local Hits":np.asarray([asic._localFifo._totalWrites for asic in asics], dtype=np.intc),
-        "Local Max":np.asarray([asic._localFifo._maxSize for asic in asics], dtype=np.intc),
-        "Local Remain":np.asarray([asic._localFifo._curSize for asic in asics], dtype=np.intc),
-        "Max Local": np.max(np.asarray([asic._localFifo._maxSize for asic in asics], dtype=np.intc)),
-
-        # remote data
-        "Remote Transactions":np.asarray([asic._remoteFifo._totalWrites for asic in asics], dtype=np.intc),
-        "Remote Max":np.asarray([asic._remoteFifo._maxSize for asic in asics], dtype=np.intc),
-        "Remote Remain":np.asarray([asic._remoteFifo._curSize for asic in asics], dtype=np.intc),
-        "Max Remote": np.max(np.asarray([asic._remoteFifo._maxSize for asic in asics], dtype=np.intc)),
-
-        # daq data to be stored its own 
-        "DaqAsicX":np.asarray([daqbyte.row for daqbyte in daqBytes], dtype=np.short),
-        "DaqAsicY":np.asarray([daqbyte.col for daqbyte in daqBytes], dtype=np.short),
-        "DaqWordType":np.asarray([daqbyte.wordType.value for daqbyte in daqBytes], dtype=np.short),
-        "DaqTime":np.asarray([daqbyte.daqT for daqbyte in daqBytes], dtype=np.intc),
-        "DaqTimestamp":np.asarray([daqbyte.qbyte.timeStamp for daqbyte in daqBytes], dtype=np.intc),
-        "DaqSimTime":np.asarray([daqbyte.qbyte.data if daqbyte.qbyte.data is not None else -1 for daqbyte in daqBytes], dtype=np.double),
-        "Daqchannels":np.asarray([int(daqbyte.qbyte.channelMask) if daqbyte.qbyte.channelMask is not None else -1 for daqbyte in daqBytes], dtype=np.intc)
     }
 
-    return data
+    return reduction(tile, meta)
 
 def GetOutputJsonFile(event_number, arrayXdim, arrayYdim):
     return f"../jsons/evt-{event_number}_x-{arrayXdim}_y-{arrayYdim}.json"
 
+def GetOutputTileFile(event_number, arrayXdim, arrayYdim):
+    return f"../jsons/evt-{event_number}_x-{arrayXdim}_y-{arrayYdim}{TILE_EXT}"
+
 def getDF(input_file):
+    """
+    load a tile input, binary tile files are returned as a memory mapped QpixTile
+    """
     import codecs, json
     if isinstance(input_file, tuple):
-        input_file = GetOutputJsonFile(input_file[0], input_file[1], input_file[2])
+        input_file = GetOutputTileFile(input_file[0], input_file[1], input_file[2])
+    if IsTileFile(input_file):
+        return LoadTile(input_file)
     obj_text = codecs.open(input_file, 'r').read()
     return json.loads(obj_text)
 
-def MakeNeutFile(event_number, arrayXdim, arrayYdim):
+def MakeBackground(input_file=None, output=None):
+    """
+    Convert the radiogenic background json (INPUT_FILE) once into a binary tile
+    (BACKGROUND_FILE), unless it is already newer than the json.
+    """
+    input_file = INPUT_FILE if input_file is None else input_file
+    output = BACKGROUND_FILE if output is None else output
+    if os.path.isfile(output) and os.path.getmtime(output) >= os.path.getmtime(input_file):
+        return
+    ConvertJson(input_file, output)
+
+def InitWorker(reduction=None):
+    """
+    Pool initializer, attaches the radiogenic background once per worker process
+    so that every tile the worker runs can reuse it, and sets the Reduction the
+    worker's tiles are returned with.
+    """
+    global _reduction
+    _reduction = reduction
+    GetBackground()
+
+def GetReduction():
+    """
+    the worker's Reduction, the DEFAULT_REDUCERS if none was given
+    """
+    global _reduction
+    if _reduction is None:
+        _reduction = Reduction()
+    return _reduction
+
+def GetBackground():
+    """
+    return the radiogenic background QpixTile. Its arrays are read-only memory
+    maps, shared by all of the workers.
+    """
+    global _background
+    if _background is None:
+        MakeBackground()
+        _background = LoadTile(BACKGROUND_FILE)
+    return _background
+
+def MakeNeutFile(event_number, arrayXdim, arrayYdim, output_file=None):
     """
     Running the scripted import file
     ARGS: input_file, event_number, output_file, arrayXdim, arrayYdim
@@ -97,15 +169,99 @@ def MakeNeutFile(event_number, arrayXdim, arrayYdim):
     """
     input_file = INPUT_DATA_FILE
 
-    output_file = GetOutputJsonFile(event_number, arrayXdim, arrayYdim)
+    if output_file is None:
+        output_file = GetOutputTileFile(event_number, arrayXdim, arrayYdim)
 
     hits = MakeNeutJson(input_file, event_number, output_file, arrayXdim, arrayYdim)
 
     return output_file
 
-def pushTile(queue, r, neutFile, frq, int_time=MAXTIME):
+def MakeNeutBatch(requests):
+    """
+    Create a batch of neutrino tiles from one pass over INPUT_DATA_FILE
+    ARGS: requests, list of (event_number, arrayXdim, arrayYdim, output_file)
+    """
+    return makeTiles(INPUT_DATA_FILE, requests)
+
+def BatchEvents(requests, nBatch):
+    """
+    split tile requests into at most nBatch batches of contiguous events, every
+    dims of an event stay within the same batch
+    """
+    events = sorted({req[0] for req in requests})
+    perBatch = max(1, -(-len(events) // max(1, nBatch)))
+    batchOf = {evt: i // perBatch for i, evt in enumerate(events)}
+    batches = [[] for _ in range(-(-len(events) // perBatch))]
+    for req in requests:
+        batches[batchOf[req[0]]].append(req)
+    return batches
+
+def MakeNeutFiles(neutArgs, nproc=50):
+    """
+    Create the neutrino tiles for each (event_number, arrayXdim, arrayYdim) on a
+    pool, skipping any tile which is already in the TileCache for the current
+    INPUT_DATA_FILE and extraction parameters. Each worker reads a contiguous
+    range of events in one pass, building every requested dims of an event.
+
+    returns the list of tile files, in order of neutArgs
+    """
+    params = {"channelXdim":channelXdim, "channelYdim":channelYdim, "extract_version":EXTRACT_VERSION}
+    cache = TileCache(TILE_CACHE_DIR, params=params, maxBytes=TILE_CACHE_BYTES)
+
+    # report, and drop, entries which are no longer valid
+    print(f"tile cache {TILE_CACHE_DIR}: {len(cache.entries)} entries, {cache.TotalBytes()/1e6:.1f} MB")
+    PrintReport(cache.Report(prune=True))
+
+    lookups = [(arg, *cache.Lookup(INPUT_DATA_FILE, *arg)) for arg in neutArgs]
+    missing = [(*arg, path) for arg, _, path, valid in lookups if not valid]
+    print(f"found {len(neutArgs)-len(missing)} cached tiles, creating {len(missing)} neutrino tile files.")
+    if len(missing) > 0:
+        batches = BatchEvents(missing, nproc)
+        with mp.Pool(min(nproc, len(batches))) as pool:
+            pool.map(MakeNeutBatch, batches)
+
+    for arg, key, path, valid in lookups:
+        if not valid and os.path.isfile(path):
+            cache.Record(key, path, INPUT_DATA_FILE, *arg)
+
+    # never evict the tiles this sweep is about to use
+    removed = cache.Evict(keep=[key for _, key, _, _ in lookups])
+    if removed > 0:
+        print(f"evicted {removed/1e6:.1f} MB of least recently used tiles")
+    cache.Save()
+
+    return [path for _, _, path, _ in lookups]
+
+def MakeAPABatch(events, dims):
+    """
+    Write every tile of the APA for a batch of events from one pass over INPUT_DATA_FILE
+    """
+    return makeAPATiles(INPUT_DATA_FILE, events, dims, APA_TILE_DIR)
+
+def MakeAPAFiles(events, dims, nproc=50):
+    """
+    Partition each event into all of the tiles of the APA, for each dims, with
+    one read per event. Workers take contiguous ranges of events.
+
+    returns the list of non-empty tile files
+    """
+    batches = [[req[0] for req in batch] for batch in BatchEvents([(evt,) for evt in events], nproc)]
+    print(f"creating APA tiles of {len(events)} events over {len(batches)} batches.")
+    with mp.Pool(min(nproc, len(batches))) as pool:
+        results = pool.starmap(MakeAPABatch, [(batch, dims) for batch in batches])
+
+    files = []
+    for result in results:
+        for tiles in result.values():
+            files.extend(tiles)
+    print(f"created {len(files)} non-empty APA tiles.")
+    return files
+
+def pushTile(r, neutFile, frq, int_time=MAXTIME):
     """
     Push script to run. should be based on QpixTest format
+
+    returns the makeData dictionary of the processed tile
     """
 
     import numpy as np
@@ -119,22 +275,20 @@ def pushTile(queue, r, neutFile, frq, int_time=MAXTIME):
     zpos = neutDF["zpos"]
     tile = qparray.QpixAsicArray(0, 0, tiledf=neutDF, deltaT=10e-6, debug=0, offset=5.1, pctSpread=frq)
     if neutDF["size"] == 0:
-        queue.put(makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos))
-        return
+        return makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile)
 
     tile.SetSendRemote(enabled=True, transact=False)
     tile.Route(r, transact=False)
     tile.SetPushState(enabled=True, transact=False)
 
     # inject the radiogenic reference data
-    readDF = getDF(INPUT_FILE)
-    tile._InjectHits(readDF["hits"])
+    background = GetBackground()
+    tile.InjectHitArrays(background.asics, background.times, background.channels)
 
     # don't try to simulate egregiously large events
     if tile.totalInjectedHits > 800 * int(tile._ncols * tile._nrows):
         print(f"skipping large sim event size: {tile.totalInjectedHits}")
-        queue.put(tile, r, energy_dep, lep_recon, axis_x, axis_z, zpos)
-        return
+        return makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile)
 
     dT, nInt = 0, 0
     while dT < int_time + INT_PRD:
@@ -145,13 +299,13 @@ def pushTile(queue, r, neutFile, frq, int_time=MAXTIME):
             tile.Interrogate(INT_PRD, hard=False)
         nInt += 1
 
-    queue.put(makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos))
+    return makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile)
 
-def pullTile(queue, r, neutFile, frq, int_time=MAXTIME):
+def pullTile(r, neutFile, frq, int_time=MAXTIME):
     """
     basic function to run a tile with an integration period, over a specified time
 
-    store processed tile on output queue to send back to main thread.
+    returns the makeData dictionary of the processed tile to send back to main thread.
     """
 
     import numpy as np
@@ -165,18 +319,16 @@ def pullTile(queue, r, neutFile, frq, int_time=MAXTIME):
     zpos = neutDF["zpos"]
     tile = qparray.QpixAsicArray(0, 0, tiledf=neutDF, deltaT=10e-6, debug=0, offset=5.1, pctSpread=frq)
     if neutDF["size"] == 0:
-        queue.put(makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos))
-        return
+        return makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile)
 
     # inject the radiogenic reference data
-    readDF = getDF(INPUT_FILE)
-    tile._InjectHits(readDF["hits"])
+    background = GetBackground()
+    tile.InjectHitArrays(background.asics, background.times, background.channels)
 
     # don't try to simulate egregiously large events
     if tile.totalInjectedHits > 800 * int(tile._ncols * tile._nrows):
         print(f"skipping large sim event size: {tile.totalInjectedHits}")
-        queue.put(makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos))
-        return
+        return makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile)
 
     # configure other meta cases of the tile
     tile.SetSendRemote(enabled=True, transact=False)
@@ -194,94 +346,84 @@ def pullTile(queue, r, neutFile, frq, int_time=MAXTIME):
             tile.Interrogate(INT_PRD, hard=False)
         nInt += 1
 
-    queue.put(makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos))
-
-def makeBranches():
-    """
-    Return the dictionary of ROOT object types which are used to store
-    the TTree values in the output ttree
-    Keys should match those of the type in makeData.
-    """
-    branches = {}
-
-    branches["Architecture"] = []
-    branches["Route"] = []
-    branches["Injected Hits"] = []
-    branches["Injected Size"] = []
-    # asic data
-    branches["AsicX"] = []
-    branches["AsicY"] = []
-    branches["Frq"] = []
-    branches["Start Time"] = []
-    branches["Rel Time"] = []
-    branches["Rel Tick"] = []
-    # local data
-    branches["Local Hits"] = []
-    branches["Local Max"] = []
-    branches["Local Remain"] = []
-    branches["Max Local"] = []
-
-    # remote data
-    branches["Remote Transactions"] = []
-    branches["Remote Max"] = []
-    branches["Remote Remain"] = []
-    branches["Max Remote"] = []
-
-    # daq data to be stored its own
-    branches["DaqAsicX"] = []
-    branches["DaqAsicY"] = []
-    branches["DaqWordType"] = []
-    branches["DaqTime"] = []
-    branches["DaqTimestamp"] = []
-    branches["DaqSimTime"] = []
-    branches["Daqchannels"] = []
-
-    return branches
-
-def fillData(data, branches):
-    """
-    read data from makeData, copy onto branches, and fill tt
-    """
-    branches["Architecture"].append(data["Architecture"])
-    branches["Route"].append(data["Route"])
-    branches["Injected Hits"].append(data["Injected Hits"])
-    branches["Injected Size"].append(data["Injected Size"])
-
-    # asic data
-    branches["AsicX"].append(data["AsicX"])
-    branches["AsicY"].append(data["AsicY"])
-    branches["Frq"].append(data["Frq"])
-    branches["Start Time"].append(data["Start Time"])
-    branches["Rel Time"].append(data["Rel Time"])
-    branches["Rel Tick"].append(data["Rel Tick"])
-
-    # local data
-    branches["Local Hits"].append(data["Local Hits"])
-    branches["Local Max"].append(data["Local Max"])
-    branches["Local Remain"].append(data["Local Remain"])
-    branches["Max Local"].append(data["Max Local"])
-
-    # remote data
-    branches["Remote Transactions"].append(data["Remote Transactions"])
-    branches["Remote Max"].append(data["Remote Max"])
-    branches["Remote Remain"].append(data["Remote Remain"])
-    branches["Max Remote"].append(data["Max Remote"])
-
-    # daq data to be stored its own
-    branches["DaqAsicX"].append(data["DaqAsicX"])
-    branches["DaqAsicY"].append(data["DaqAsicY"])
-    branches["DaqWordType"].append(data["DaqWordType"])
-    branches["DaqTime"].append(data["DaqTime"])
-    branches["DaqTimestamp"].append(data["DaqTimestamp"])
-    branches["DaqSimTime"].append(data["DaqSimTime"])
-    branches["Daqchannels"].append(data["Daqchannels"])
-
-def main(seed=SEED):
+    return makeData(tile, r, frq, energy_dep, lep_recon, axis_x, axis_z, zpos, neutFile)
+
+def TileDims(neutFile):
+    """
+    (arrayXdim, arrayYdim) parsed from a tile file name, None if it has no dims
+    """
+    dims = re.search(r"x-(\d+)_y-(\d+)", os.path.basename(neutFile))
+    return (int(dims.group(1)), int(dims.group(2))) if dims else None
+
+def JobCost(neutFile, push=False):
+    """
+    estimate the relative run time of a tile job from the size of its neutrino
+    file and the tile area, which is parsed from the GetOutputTileFile name
+    """
+    size = os.path.getsize(neutFile) if os.path.isfile(neutFile) else 0
+    dims = TileDims(neutFile)
+    area = dims[0] * dims[1] if dims else 1
+    return (size + 1) * area * (PUSH_COST if push else 1)
+
+def LoadSummary(done):
+    """
+    the summary of the tiles already in OUTPUT_DATASET. It is remade from the
+    dataset when the saved summary does not hold every completed tile, ie
+    after a crashed sweep, or is of an older SUMMARY_VERSION.
+    """
+    if len(done) == 0:
+        return SweepSummary()
+    if os.path.isfile(OUTPUT_SUMMARY):
+        try:
+            summary = SweepSummary.Load(OUTPUT_SUMMARY)
+        except QPException as ex:
+            print(ex)
+            summary = None
+        if summary is not None and summary.tiles == len(done):
+            return summary
+    print(f"remaking {OUTPUT_SUMMARY} from {OUTPUT_DATASET}")
+    return SweepSummary.FromFrame(ReadSummaryFrame(OUTPUT_DATASET))
+
+def RunSweep(jobs, ncpu, maxInFlight=None, reduction=None):
+    """
+    Run tile jobs on a fixed pool of ncpu worker processes, each of which is
+    reused for many tiles. Jobs are submitted longest first, and at most
+    maxInFlight (default 2*ncpu) jobs are submitted at any time.
+
+    ARGS:
+        jobs      - list of (cost, function, args) tuples, cost from JobCost
+        reduction - Reduction of the tiles within the workers, None for the default
+    yields the makeData dictionary of each job as it completes, failed jobs are
+    reported and skipped
+    """
+    if maxInFlight is None:
+        maxInFlight = 2 * ncpu
+    pending = sorted(jobs, key=lambda job: job[0])
+    with ProcessPoolExecutor(max_workers=ncpu, initializer=InitWorker, initargs=(reduction,)) as pool:
+        running = {}
+        while pending or running:
+            while pending and len(running) < maxInFlight:
+                _, func, args = pending.pop()
+                running[pool.submit(func, *args)] = (func.__name__, args)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, args = running.pop(future)
+                try:
+                    yield future.result()
+                except Exception as ex:
+                    print(f"tile job {name}{args} failed:", ex)
+
+def main(seed=SEED, apa=False, reducers=DEFAULT_REDUCERS, saveDaq=False):
     """
     This script should be called and run as an executable.
+
+    With apa every tile of the APA is simulated for each event, rather than only
+    the densest tile of each event. reducers are the QpixReduce summaries kept
+    for each tile, and with saveDaq the full DAQ stream of each tile is written
+    into DAQ_DIR.
     """
     ncpu = 60
-    branches = makeBranches()
 
     # define the ranges of pull parameters to test
     frqs = [0.05, 0.005]
@@ -289,66 +431,49 @@ def main(seed=SEED):
     dims = [(4,4), (8,8), (10,14), (16,16)]
     event_number = [i for i in range(1, 1000)]
     neutArgs = [(evt, xd, yd) for evt in event_number for xd, yd in dims]
-    neutFiles = [ GetOutputJsonFile(f, x, y) for f, x, y in neutArgs ]
 
-    # make the files on the pool
-    msg = f"creating {len(neutArgs)} neutrino json files. continue?"
-    print(msg)
-    pool = mp.Pool(50)
-    pool.starmap(MakeNeutFile, neutArgs)
+    # make the files on the pool, or find them in the tile cache
+    if apa:
+        neutFiles = MakeAPAFiles(event_number, dims)
+    else:
+        neutFiles = MakeNeutFiles(neutArgs)
 
-    # place holder for the completed tiles
-    tile_queue = mp.Queue()
+    # convert the background before the workers start, so they only attach to it
+    MakeBackground()
 
-    # create a list of all of the processes that need to run.
+    # create a list of all of the jobs that need to run.
     pull_args = [(r, f, frq) for r in routes for f in neutFiles for frq in frqs]
 
     # only test snake for push routing on 4x4 tiles
-    push_args = [("snake", f, frq) for f in neutFiles if "x-4" in f or "x-8" in f for frq in frqs] 
+    push_args = [("snake", f, frq) for f in neutFiles if TileDims(f) in [(4,4), (8,8)] for frq in frqs]
 
-    # pull architecture procs
-    procs = [mp.Process(target=pullTile, args=(tile_queue, *arg)) for arg in pull_args]
+    # skip any (Route, File, frq, Architecture) that a previous run already wrote
+    done = CompletedKeys(OUTPUT_DATASET)
+    pull_args = [arg for arg in pull_args if (*arg, ArchLabel(False)) not in done]
+    push_args = [arg for arg in push_args if (*arg, ArchLabel(True)) not in done]
+    if len(done) > 0:
+        print(f"resuming sweep, skipping {len(done)} completed tiles in {OUTPUT_DATASET}")
 
-    # push archiecture procs
-    procs.extend([mp.Process(target=pushTile, args=(tile_queue, *arg)) for arg in push_args])
-    msg = f"making nprocs: {len(procs)}"
-    print(msg)
+    # pull and push architecture jobs, with their estimated costs
+    jobs = [(JobCost(arg[1]), pullTile, arg) for arg in pull_args]
+    jobs.extend([(JobCost(arg[1], push=True), pushTile, arg) for arg in push_args])
 
-    nProcs = len(procs)
-    msg = f"begginning processing of {nProcs} tiles."
+    nJobs = len(jobs)
+    msg = f"begginning processing of {nJobs} tiles."
     print(msg)
 
-    try:
-        completeProcs = 0
-        runningProcs, pTiles = [], []
-        while completeProcs < nProcs:
-
-            # fill running procs until we use all cpu cores
-            while len(runningProcs) <= ncpu and len(procs) > 0:
-                runningProcs.append(procs.pop())
-
-            # ensure the running procs have started
-            for ip, p in enumerate(runningProcs):
-                if p.pid is None:
-                    p.start()
-                elif p.exitcode is not None:
-                    runningProcs.pop(ip)
-
-            # wait to get anything on the queue
-            pTiles.append(tile_queue.get())
-            for data in pTiles:
-                completeProcs += 1
-                fillData(data, branches)
-            pTiles = []
-            print(f"Completed tile {completeProcs}/{nProcs}: {completeProcs/nProcs*100:0.2f}% @ {datetime.now()}..")
-    except Exception as ex:
-        print("encountered exception in creating output mp data:", ex)
-        print("attemping save..")
-
-    finally:
-        # save output file
-        df = pd.DataFrame(branches)
-        df.to_feather("neutMP.feather", compression="zstd")
+    # results are written in the background as they arrive, and summarized
+    # here, so the workers only send back the reduced tile
+    summary = LoadSummary(done)
+    reduction = Reduction(reducers, daqDir=DAQ_DIR if saveDaq else None)
+    with SweepWriter(OUTPUT_DATASET, schema=reduction.Schema()) as writer:
+        completeJobs = 0
+        for data in RunSweep(jobs, ncpu, reduction=reduction):
+            completeJobs += 1
+            writer.Write(data)
+            summary.Merge(SweepSummary.FromTile(data))
+            print(f"Completed tile {completeJobs}/{nJobs}: {completeJobs/nJobs*100:0.2f}% @ {datetime.now()}..")
+    summary.Save(OUTPUT_SUMMARY)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+import os
+
+import numpy as np
+import pyarrow as pa
+from QpixAsic import QPException, AsicWord
+from QpixDataFormat import EncodeDaqData, SaveDaqStream
+
+## Worker side reduction of a processed QpixAsicArray into the values a sweep
+## keeps. Rather than every DAQ word and injected hit of a tile, the worker
+## returns the tile's meta data and the output of the requested reducers:
+##   maxima  - Max Local, Max Remote and the average Remote Transactions
+##   asic    - the per ASIC arrays AsicX ... Remote Remain, read by neutGraphs
+##   daq     - counts of the DAQ words received, by word type
+##   latency - LATENCY_PERCENTILES of the readout latency of the data words
+##   hits    - histogram of the injected hit times, over hitBins
+##   full    - the Injected Hits and Daq* arrays of the old makeData
+## With daqDir the DAQ stream and extras of every tile are written there by
+## SaveDaqStream instead, and only the file name is returned.
+
+DEFAULT_REDUCERS = ["maxima", "asic", "daq", "latency"]
+LATENCY_PERCENTILES = [50, 90, 99, 100]
+HIT_BINS = (0, 10, 100) # (lo, hi, nbins) in seconds, the sweep's MAXTIME
+
+
+def Maxima(tile, reduction):
+    asics = list(tile)
+    remote = np.asarray([asic._remoteFifo._totalWrites for asic in asics], dtype=np.double)
+    return {
+        "Max Local":np.max(np.asarray([asic._localFifo._maxSize for asic in asics], dtype=np.intc)),
+        "Max Remote":np.max(np.asarray([asic._remoteFifo._maxSize for asic in asics], dtype=np.intc)),
+        "Remote Transaction Average":remote.mean(),
+    }
+
+
+def Asic(tile, reduction):
+    asics = list(tile)
+    return {
+        "AsicX":np.asarray([asic.col for asic in asics], dtype=np.short),
+        "AsicY":np.asarray([asic.row for asic in asics], dtype=np.short),
+        "Frq":np.asarray([asic.fOsc for asic in asics], dtype=np.single),
+        "Start Time":np.asarray([asic._startTime for asic in asics], dtype=np.single),
+        "Rel Time":np.asarray([asic.relTimeNow for asic in asics], dtype=np.single),
+        "Rel Tick":np.asarray([asic.relTicksNow for asic in asics], dtype=np.intc),
+
+        # local data
+        "Local Hits":np.asarray([asic._localFifo._totalWrites for asic in asics], dtype=np.intc),
+        "Local Max":np.asarray([asic._localFifo._maxSize for asic in asics], dtype=np.intc),
+        "Local Remain":np.asarray([asic._localFifo._curSize for asic in asics], dtype=np.intc),
+
+        # remote data
+        "Remote Transactions":np.asarray([asic._remoteFifo._totalWrites for asic in asics], dtype=np.intc),
+        "Remote Max":np.asarray([asic._remoteFifo._maxSize for asic in asics], dtype=np.intc),
+        "Remote Remain":np.asarray([asic._remoteFifo._curSize for asic in asics], dtype=np.intc),
+    }
+
+
+def DaqCounts(tile, reduction):
+    fifo = tile._daqNode._localFifo
+    return {
+        "Daq Words":fifo._totalWrites,
+        "Daq Data Words":fifo._dataWords,
+        "Daq End Words":fifo._endWords,
+        "Daq Req Words":fifo._reqWords,
+        "Daq Resp Words":fifo._respWords,
+    }
+
+
+def Latency(tile, reduction):
+    """
+    percentiles of the time from a hit to the DaqNode receiving its data word,
+    in seconds, and -1 if no data words were received
+    """
+    daqNode = tile._daqNode
+    data = [d for d in daqNode._localFifo._data if d.wordType == AsicWord.DATA and d.qbyte.data is not None]
+    pct = np.full(len(reduction.percentiles), -1, dtype=np.double)
+    if len(data) > 0:
+        daqT = np.fromiter((d.daqT for d in data), dtype=np.double, count=len(data))
+        hitT = np.fromiter((d.qbyte.data for d in data), dtype=np.double, count=len(data))
+        pct = np.percentile(daqT * daqNode.tOsc + daqNode._startTime - hitT, reduction.percentiles)
+    return {"Latency Percentiles":pct}
+
+
+def HitHist(tile, reduction):
+    lo, hi, nbins = reduction.hitBins
+    counts, _ = np.histogram(np.asarray(tile.InjectedHits, dtype=np.double), bins=nbins, range=(lo, hi))
+    return {"Injected Hist":counts.astype(np.intc)}
+
+
+def Full(tile, reduction):
+    daqBytes = list(tile._daqNode._localFifo._data)
+    return {
+        "Injected Hits":np.asarray(tile.InjectedHits, dtype=np.double),
+        "DaqAsicX":np.asarray([daqbyte.row for daqbyte in daqBytes], dtype=np.short),
+        "DaqAsicY":np.asarray([daqbyte.col for daqbyte in daqBytes], dtype=np.short),
+        "DaqWordType":np.asarray([daqbyte.wordType.value for daqbyte in daqBytes], dtype=np.short),
+        "DaqTime":np.asarray([daqbyte.daqT for daqbyte in daqBytes], dtype=np.intc),
+        "DaqTimestamp":np.asarray([daqbyte.qbyte.timeStamp for daqbyte in daqBytes], dtype=np.intc),
+        "DaqSimTime":np.asarray([daqbyte.qbyte.data if daqbyte.qbyte.data is not None else -1 for daqbyte in daqBytes], dtype=np.double),
+        "Daqchannels":np.asarray([int(daqbyte.qbyte.channelMask) if daqbyte.qbyte.channelMask is not None else -1 for daqbyte in daqBytes], dtype=np.intc)
+    }
+
+
+REDUCERS = {
+    "maxima":Maxima,
+    "asic":Asic,
+    "daq":DaqCounts,
+    "latency":Latency,
+    "hits":HitHist,
+    "full":Full,
+}
+
+## arrow types of the columns of a reduced tile, so that the sweep dataset has
+## the same schema whichever tiles happen to be in its first row group
+META_TYPES = {
+    "Architecture":pa.string(),
+    "Route":pa.string(),
+    "File":pa.string(),
+    "frq":pa.float64(),
+    "Injected Size":pa.int64(),
+    "size":pa.int64(),
+    "energy_deposit":pa.float64(),
+    "lep_recon":pa.float64(),
+    "axis_x":pa.float64(),
+    "axis_z":pa.float64(),
+    "zpos":pa.float64(),
+}
+
+REDUCER_TYPES = {
+    "maxima":{
+        "Max Local":pa.int32(),
+        "Max Remote":pa.int32(),
+        "Remote Transaction Average":pa.float64(),
+    },
+    "asic":{
+        "AsicX":pa.list_(pa.int16()),
+        "AsicY":pa.list_(pa.int16()),
+        "Frq":pa.list_(pa.float32()),
+        "Start Time":pa.list_(pa.float32()),
+        "Rel Time":pa.list_(pa.float32()),
+        "Rel Tick":pa.list_(pa.int32()),
+        "Local Hits":pa.list_(pa.int32()),
+        "Local Max":pa.list_(pa.int32()),
+        "Local Remain":pa.list_(pa.int32()),
+        "Remote Transactions":pa.list_(pa.int32()),
+        "Remote Max":pa.list_(pa.int32()),
+        "Remote Remain":pa.list_(pa.int32()),
+    },
+    "daq":{
+        "Daq Words":pa.int64(),
+        "Daq Data Words":pa.int64(),
+        "Daq End Words":pa.int64(),
+        "Daq Req Words":pa.int64(),
+        "Daq Resp Words":pa.int64(),
+    },
+    "latency":{
+        "Latency Percentiles":pa.list_(pa.float64()),
+    },
+    "hits":{
+        "Injected Hist":pa.list_(pa.int32()),
+    },
+    "full":{
+        "Injected Hits":pa.list_(pa.float64()),
+        "DaqAsicX":pa.list_(pa.int16()),
+        "DaqAsicY":pa.list_(pa.int16()),
+        "DaqWordType":pa.list_(pa.int16()),
+        "DaqTime":pa.list_(pa.int32()),
+        "DaqTimestamp":pa.list_(pa.int32()),
+        "DaqSimTime":pa.list_(pa.float64()),
+        "Daqchannels":pa.list_(pa.int32()),
+    },
+}
+
+
+class Reduction():
+    """
+    Reduces a processed tile into its meta data and the output of the requested
+    reducers, see module notes. maxima is always included, as the sweep
+    summaries are made from it.
+
+    ARGS:
+        reducers    - names of the REDUCERS to run
+        daqDir      - directory to write the full DAQ stream of every tile to, None to not write it
+        percentiles - percentiles of the latency reducer
+        hitBins     - (lo, hi, nbins) of the hits reducer
+    """
+    def __init__(self, reducers=DEFAULT_REDUCERS, daqDir=None, percentiles=LATENCY_PERCENTILES, hitBins=HIT_BINS):
+        unknown = [name for name in reducers if name not in REDUCERS]
+        if len(unknown) > 0:
+            raise QPException(f"unknown reducers {unknown}, choose from {list(REDUCERS)}")
+        self.reducers = list(dict.fromkeys(["maxima", *reducers]))
+        self.daqDir = daqDir
+        self.percentiles = list(percentiles)
+        self.hitBins = tuple(hitBins)
+
+    def __call__(self, tile, meta):
+        data = dict(meta)
+        for name in self.reducers:
+            data.update(REDUCERS[name](tile, self))
+        if self.daqDir is not None:
+            data["Daq File"] = self.SaveDaq(tile, meta)
+        return data
+
+    def Schema(self):
+        """
+        arrow schema of the dictionaries this reduction returns
+        """
+        fields = list(META_TYPES.items())
+        for name in self.reducers:
+            fields.extend(REDUCER_TYPES[name].items())
+        if self.daqDir is not None:
+            fields.append(("Daq File", pa.string()))
+        return pa.schema(fields)
+
+    def DaqFileName(self, meta):
+        """
+        stream file name of a tile, unique to the key of the tile in the sweep
+        """
+        neutFile = os.path.splitext(os.path.basename(str(meta.get("File"))))[0]
+        return os.path.join(self.daqDir, f"{meta['Architecture']}_{meta['Route']}_frq-{meta['frq']}_{neutFile}")
+
+    def SaveDaq(self, tile, meta):
+        os.makedirs(self.daqDir, exist_ok=True)
+        fileName = self.DaqFileName(meta)
+        words, extras = EncodeDaqData(tile._daqNode._localFifo._data)
+        SaveDaqStream(fileName, words, extras)
+        np.save(f"{fileName}_hits.npy", np.asarray(tile.InjectedHits, dtype=np.double))
+        return fileName
@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+from QpixAsic import QPException
+
+## Mergeable summaries of the sweep results of QpixMPAnalysis. Each worker
+## summarizes the tile it ran, the collector merges the summaries, and the
+## neutGraphs tables are made from the merged summary without loading the sweep.
+##
+## Tiles are grouped by GROUP_KEYS, and each group holds
+##   hists - FixedHist of Max Local, Max Remote and the tile's average Remote
+##           Transactions
+##   sums  - SUM_KEYS, for the means and the Max Local / Max Remote line fit
+## Buffer depths are integers, so the unit bins of DEPTH_BINS give their exact
+## quantiles. The size of a summary is bounded however many tiles it holds:
+## values below the bins share one underflow bin, and values above them fall
+## in OVER_BINS coarse bins, each twice the span of the last. A quantile within
+## the bins is exact, one beyond them is the lower edge of its overflow bin, so
+## within a factor of 2, while the smallest and largest values are kept exactly.
+##
+## Summarize an existing sweep and check it against the exact values with:
+##   python QpixSummary.py neutMP neutMP_summary.json --check
+
+SUMMARY_VERSION = 2
+GROUP_KEYS = ["Architecture", "Route", "size", "frq"]
+
+# (lo, hi, nbins) of the histograms
+DEPTH_BINS = (0, 16384, 16384)
+TRANS_BINS = (1, 3001, 200)
+OVER_BINS = 32
+HIST_BINS = {"Max Local": DEPTH_BINS, "Max Remote": DEPTH_BINS, "Remote Transaction Average": TRANS_BINS}
+
+# per tile sums, x is Max Local and y is Max Remote
+SUM_KEYS = ["n", "Injected Size", "Remote Transaction Average", "x", "y", "xx", "xy"]
+
+# columns of the sweep results a summary is made from, with the average Remote
+# Transactions of the maxima reducer, or the per ASIC ones of the asic reducer
+SUMMARY_COLUMNS = ["Architecture", "Route", "frq", "Max Local", "Max Remote", "Injected Size"]
+TRANS_COLUMNS = ["Remote Transaction Average", "Remote Transactions"]
+
+
+def QuantileRank(n, q):
+    """
+    1-based rank of the q quantile of n entries, the smallest entry with at
+    least q of the entries at or below it
+    """
+    return max(1, math.ceil(round(q * n, 9)))
+
+
+def ExactQuantile(values, q):
+    """
+    q quantile of values, as FixedHist.Quantile defines it
+    """
+    values = np.sort(np.asarray(values))
+    if len(values) == 0:
+        return None
+    return values[QuantileRank(len(values), q) - 1]
+
+
+def TransactionAverage(df):
+    """
+    average Remote Transactions of each tile of a DataFrame of sweep results,
+    from the maxima reducer's column if it has it, nan for a tile without ASICs
+    """
+    if "Remote Transaction Average" in df:
+        return df["Remote Transaction Average"]
+    return df["Remote Transactions"].map(lambda t: np.mean(t) if len(t) else np.nan)
+
+
+class FixedHist():
+    """
+    Histogram of nbins equal bins over [lo, hi), with one underflow bin and
+    OVER_BINS overflow bins, see module notes.
+    """
+    def __init__(self, lo, hi, nbins):
+        self.lo, self.hi, self.nbins = lo, hi, nbins
+        self.counts = np.zeros(nbins, dtype=np.int64)
+        self.under = 0
+        self.over = np.zeros(OVER_BINS, dtype=np.int64)
+        self.min, self.max = math.inf, -math.inf
+
+    @property
+    def n(self):
+        return int(self.counts.sum()) + self.under + int(self.over.sum())
+
+    @property
+    def width(self):
+        return (self.hi - self.lo) / self.nbins
+
+    def OverEdge(self, i):
+        """
+        lower edge of overflow bin i, the first is at hi
+        """
+        return self.lo + (self.hi - self.lo) * 2.0**i
+
+    def Fill(self, values):
+        values = np.asarray(values, dtype=np.double).ravel()
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        under, over = values < self.lo, values >= self.hi
+        self.under += int(under.sum())
+        overBins = np.floor(np.log2((values[over] - self.lo) / (self.hi - self.lo))).astype(np.int64)
+        self.over += np.bincount(np.clip(overBins, 0, OVER_BINS - 1), minlength=OVER_BINS)
+        bins = ((values[~under & ~over] - self.lo) / self.width).astype(np.int64)
+        self.counts += np.bincount(np.minimum(bins, self.nbins - 1), minlength=self.nbins)
+
+    def Merge(self, other):
+        if (self.lo, self.hi, self.nbins) != (other.lo, other.hi, other.nbins):
+            raise QPException(f"can not merge histograms of different bins: {(self.lo, self.hi, self.nbins)}, {(other.lo, other.hi, other.nbins)}")
+        self.counts += other.counts
+        self.under += other.under
+        self.over += other.over
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def Quantile(self, q):
+        """
+        lower edge of the bin holding the q quantile, see QuantileRank, where
+        the underflow bin's edge is the smallest value, and the largest value
+        is returned for the last rank. None if empty.
+        """
+        n = self.n
+        if n == 0:
+            return None
+        rank = QuantileRank(n, q)
+        if rank == n:
+            return self.max
+        if rank <= self.under:
+            return self.min
+        rank -= self.under
+        cum = np.cumsum(self.counts)
+        if rank > cum[-1]:
+            i = np.searchsorted(np.cumsum(self.over), rank - cum[-1])
+            return max(self.OverEdge(i), self.min)
+        i = np.searchsorted(cum, rank)
+        return max(self.lo + i * self.width, self.min)
+
+    def ToDict(self):
+        nz = np.flatnonzero(self.counts)
+        return {"bins": [self.lo, self.hi, self.nbins], "under": self.under, "over": self.over.tolist(),
+                "min": self.min if self.n else None, "max": self.max if self.n else None,
+                "index": nz.tolist(), "counts": self.counts[nz].tolist()}
+
+    def __getstate__(self):
+        # pickle only the occupied bins, as the summary json does
+        return self.ToDict()
+
+    def __setstate__(self, d):
+        self.__dict__.update(FixedHist.FromDict(d).__dict__)
+
+    @classmethod
+    def FromDict(cls, d):
+        hist = cls(*d["bins"])
+        hist.counts[d["index"]] = d["counts"]
+        hist.under = int(d["under"])
+        hist.over = np.asarray(d["over"], dtype=np.int64)
+        if d["min"] is not None:
+            hist.min, hist.max = d["min"], d["max"]
+        return hist
+
+
+class GroupSummary():
+    """
+    Summary of the tiles of one group, see module notes.
+    """
+    def __init__(self):
+        self.hists = {name: FixedHist(*bins) for name, bins in HIST_BINS.items()}
+        self.sums = dict.fromkeys(SUM_KEYS, 0.0)
+
+    def Fill(self, maxLocal, maxRemote, transAvg, injected):
+        """
+        add tiles from arrays of their per tile values
+        """
+        x = np.asarray(maxLocal, dtype=np.double)
+        y = np.asarray(maxRemote, dtype=np.double)
+        self.hists["Max Local"].Fill(x)
+        self.hists["Max Remote"].Fill(y)
+        self.hists["Remote Transaction Average"].Fill(transAvg)
+        self.sums["n"] += len(x)
+        self.sums["Injected Size"] += float(np.sum(injected))
+        self.sums["Remote Transaction Average"] += float(np.nansum(transAvg))
+        self.sums["x"] += float(x.sum())
+        self.sums["y"] += float(y.sum())
+        self.sums["xx"] += float((x * x).sum())
+        self.sums["xy"] += float((x * y).sum())
+
+    def Merge(self, other):
+        for name, hist in self.hists.items():
+            hist.Merge(other.hists[name])
+        for key in SUM_KEYS:
+            self.sums[key] += other.sums[key]
+        return self
+
+    @property
+    def n(self):
+        return int(self.sums["n"])
+
+    def Quantile(self, name, q):
+        return self.hists[name].Quantile(q)
+
+    def Mean(self, name):
+        return self.sums[name] / self.sums["n"] if self.sums["n"] else None
+
+    def FitSlope(self):
+        """
+        slope of the least squares line of Max Remote against Max Local, as np.polyfit
+        """
+        n, sx, sy = self.sums["n"], self.sums["x"], self.sums["y"]
+        denom = n * self.sums["xx"] - sx * sx
+        if n < 2 or denom == 0:
+            return None
+        return (n * self.sums["xy"] - sx * sy) / denom
+
+    def ToDict(self):
+        return {"hists": {name: hist.ToDict() for name, hist in self.hists.items()}, "sums": self.sums}
+
+    @classmethod
+    def FromDict(cls, d):
+        group = cls()
+        group.hists = {name: FixedHist.FromDict(hist) for name, hist in d["hists"].items()}
+        group.sums = dict(d["sums"])
+        return group
+
+
+class SweepSummary():
+    """
+    Mergeable summary of a sweep, a GroupSummary for each GROUP_KEYS tuple.
+    """
+    def __init__(self):
+        self.groups = {}
+
+    @property
+    def tiles(self):
+        return sum(group.n for group in self.groups.values())
+
+    def Group(self, key):
+        key = GroupKey(*key)
+        if key not in self.groups:
+            self.groups[key] = GroupSummary()
+        return self.groups[key]
+
+    def Get(self, Architecture, Route, size, frq):
+        """
+        the GroupSummary of a group, None if it has no tiles
+        """
+        return self.groups.get(GroupKey(Architecture, Route, size, frq))
+
+    def Merge(self, other):
+        for key, group in other.groups.items():
+            self.Group(key).Merge(group)
+        return self
+
+    @classmethod
+    def FromTile(cls, data):
+        """
+        summary of the single tile of a makeData dictionary, the average Remote
+        Transactions are those of the maxima reducer if it has them
+        """
+        summary = cls()
+        transAvg = data.get("Remote Transaction Average")
+        if transAvg is None:
+            trans = np.asarray(data["Remote Transactions"])
+            transAvg = trans.mean() if len(trans) else np.nan
+        summary.Group([data[key] for key in GROUP_KEYS]).Fill(
+            [data["Max Local"]], [data["Max Remote"]], [transAvg], [data["Injected Size"]])
+        return summary
+
+    @classmethod
+    def FromFrame(cls, df):
+        """
+        summary of the tiles of a DataFrame of sweep results, a size column is
+        made from AsicX if it has none
+        """
+        summary = cls()
+        if "size" not in df:
+            df = df.assign(size=df["AsicX"].map(len))
+        transAvg = TransactionAverage(df)
+        for key, group in df.groupby(GROUP_KEYS, sort=False):
+            summary.Group(key).Fill(group["Max Local"], group["Max Remote"],
+                                    transAvg[group.index], group["Injected Size"])
+        return summary
+
+    def Save(self, fileName):
+        """
+        write the summary as json, replaced atomically
+        """
+        d = {"version": SUMMARY_VERSION,
+             "groups": [{"key": list(key), **group.ToDict()} for key, group in self.groups.items()]}
+        with open(fileName + ".tmp", "w") as f:
+            json.dump(d, f)
+        os.replace(fileName + ".tmp", fileName)
+
+    @classmethod
+    def Load(cls, fileName):
+        with open(fileName, "r") as f:
+            d = json.load(f)
+        if d.get("version") != SUMMARY_VERSION:
+            raise QPException(f"unsupported summary version {d.get('version')} in {fileName}")
+        summary = cls()
+        for group in d["groups"]:
+            summary.groups[GroupKey(*group["key"])] = GroupSummary.FromDict(group)
+        return summary
+
+
+def GroupKey(Architecture, Route, size, frq):
+    return (str(Architecture), str(Route), int(size), float(frq))
+
+
+def ReadSummaryFrame(path):
+    """
+    the SUMMARY_COLUMNS of a sweep dataset, with size or the AsicX it is made
+    from, and the first of TRANS_COLUMNS it has
+    """
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    names = dataset.schema.names
+    sizeCol = "size" if "size" in names else "AsicX"
+    transCol = next((col for col in TRANS_COLUMNS if col in names), None)
+    if transCol is None:
+        raise QPException(f"sweep dataset {path} has none of {TRANS_COLUMNS}")
+    return dataset.to_table(columns=SUMMARY_COLUMNS + [transCol, sizeCol]).to_pandas()
+
+
+def ValidateSummary(df, summary, qs=(0.95, 0.99), rtol=1e-6):
+    """
+    Compare a summary of the tiles in df, ie merged from their workers, to the
+    exact values computed from df.
+
+    Returns a list of the mismatches, empty if the summary is exact.
+    """
+    if "size" not in df:
+        df = df.assign(size=df["AsicX"].map(len))
+    errors = []
+    for key, group in df.groupby(GROUP_KEYS, sort=False):
+        gs = summary.Get(*key)
+        if gs is None or gs.n != len(group):
+            errors.append((key, "tiles", len(group), None if gs is None else gs.n))
+            continue
+        for name in ["Max Local", "Max Remote"]:
+            for q in qs:
+                exact, approx = ExactQuantile(group[name], q), gs.Quantile(name, q)
+                if exact != approx:
+                    errors.append((key, f"{name} q{q}", exact, approx))
+        exact = TransactionAverage(group).mean()
+        if not np.isclose(exact, gs.Mean("Remote Transaction Average"), rtol=rtol):
+            errors.append((key, "Remote Transaction Average", exact, gs.Mean("Remote Transaction Average")))
+        if len(group) > 1 and group["Max Local"].nunique() > 1:
+            exact = np.polyfit(group["Max Local"], group["Max Remote"], deg=1)[0]
+            if not np.isclose(exact, gs.FitSlope(), rtol=rtol):
+                errors.append((key, "fit", exact, gs.FitSlope()))
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="summarize the results of a sweep")
+    parser.add_argument("dataset", help="parquet dataset written by QpixMPAnalysis")
+    parser.add_argument("output", help="json summary file")
+    parser.add_argument("--check", action="store_true", help="validate the summary against the exact values")
+    parser.add_argument("--sample", type=int, default=2000, help="tiles validated by --check")
+    args = parser.parse_args(argv)
+
+    df = ReadSummaryFrame(args.dataset)
+    summary = SweepSummary.FromFrame(df)
+    summary.Save(args.output)
+    print(f"summarized {summary.tiles} tiles in {len(summary.groups)} groups to {args.output}")
+    if not args.check:
+        return 0
+
+    # the sample is summarized on its own, so its quantiles are exact for it
+    sample = df.sample(min(args.sample, len(df)), random_state=0)
+    errors = ValidateSummary(sample, SweepSummary.FromFrame(sample))
+    for error in errors:
+        print("mismatch:", error)
+    print(f"checked {len(sample)} tiles, {len(errors)} mismatches")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
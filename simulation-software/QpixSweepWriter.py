@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+import os
+import queue
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+## Incremental writer for the sweep results of QpixMPAnalysis. Each makeData
+## dictionary is handed to a background thread, which buffers them and writes
+## row groups into a hive partitioned parquet dataset, ie:
+##   neutMP/Architecture=Pull/Route=snake/part-<run>-<n>-0.parquet
+##
+## Every flush writes complete parquet files, so a crashed sweep only loses the
+## tiles which were still buffered, and a restarted sweep can find the tiles
+## it has already finished with CompletedKeys. On Close the files a run wrote
+## to each partition are compacted into a single part-<run>-c.parquet, so a
+## long sweep doesn't leave a small file per partition per flush behind.
+##
+## The schema should be given, ie Reduction.Schema(), as a first row group
+## with only None in a column would otherwise infer it as a null column.
+
+PARTITIONS = ["Architecture", "Route"]
+KEY_COLUMNS = ["Route", "File", "frq", "Architecture"]
+
+
+def CompletedKeys(path):
+    """
+    Return the set of (Route, File, frq, Architecture) keys already written to
+    the dataset at path, empty if there is no dataset yet.
+    """
+    if not os.path.isdir(path):
+        return set()
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    if len(dataset.files) == 0:
+        return set()
+    table = dataset.to_table(columns=KEY_COLUMNS)
+    return set(zip(*[table[col].to_pylist() for col in KEY_COLUMNS]))
+
+
+def ReadSweep(path, columns=None, filter=None):
+    """
+    load a sweep dataset back into a DataFrame, with the partition columns restored
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+class SweepWriter():
+    """
+    Background thread writer of makeData results into a partitioned parquet dataset.
+
+    ARGS:
+        path          - directory of the dataset, created if needed
+        schema        - arrow schema of the data, inferred from the written data if None
+        rowGroupSize  - number of tiles buffered before a flush
+        flushInterval - seconds after which a non-empty buffer is flushed anyway
+        maxPending    - tiles waiting for the writer thread before Write blocks
+        compact       - merge the files of this run in each partition on Close
+    """
+    def __init__(self, path, schema=None, rowGroupSize=64, flushInterval=60, maxPending=256, compact=True):
+        self.path = path
+        self.rowGroupSize = rowGroupSize
+        self.flushInterval = flushInterval
+        self.compact = compact
+        self.written = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._runID = uuid.uuid4().hex[:8]
+        self._nFlush = 0
+        self._pinned = schema is not None
+        self._schema = schema
+        self._error = None
+        self._queue = queue.Queue(maxsize=maxPending)
+        self._thread = threading.Thread(target=self._run, name="SweepWriter", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def Write(self, data):
+        """
+        queue a makeData dictionary to be written, returns without touching disk
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def Close(self):
+        """
+        flush everything still buffered, and stop the writer thread
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if self.compact:
+            self._compact()
+
+    def _run(self):
+        buffer = []
+        lastFlush = time.monotonic()
+        try:
+            while True:
+                timeout = max(0, lastFlush + self.flushInterval - time.monotonic())
+                try:
+                    data = self._queue.get(timeout=timeout if buffer else None)
+                except queue.Empty:
+                    data = False # flush interval reached
+
+                if data is None:
+                    break
+                if data is not False:
+                    buffer.append(data)
+                if len(buffer) >= self.rowGroupSize or (data is False and buffer):
+                    self._flush(buffer)
+                    buffer, lastFlush = [], time.monotonic()
+            if buffer:
+                self._flush(buffer)
+        except Exception as ex:
+            print("SweepWriter failed to write sweep data:", ex)
+            self._error = ex
+            # keep draining so that the collector never blocks on a dead writer
+            while self._queue.get() is not None:
+                pass
+
+    def _flush(self, buffer):
+        if self._pinned:
+            table = pa.Table.from_pylist(buffer, schema=self._schema)
+        else:
+            table = pa.Table.from_pandas(pd.DataFrame(buffer), preserve_index=False)
+            if self._schema is not None:
+                # null columns of earlier flushes take the type of later ones
+                self._schema = pa.unify_schemas([self._schema, table.schema], promote_options="permissive")
+                table = table.cast(self._schema)
+            else:
+                self._schema = table.schema
+        ds.write_dataset(table, self.path, format="parquet",
+                         partitioning=PARTITIONS, partitioning_flavor="hive",
+                         basename_template=f"part-{self._runID}-{self._nFlush}-{{i}}.parquet",
+                         existing_data_behavior="overwrite_or_ignore")
+        self._nFlush += 1
+        self.written += len(buffer)
+
+    def _compact(self):
+        """
+        rewrite the files of this run in each partition as one file, the
+        compacted file is in place before the small ones are removed
+        """
+        prefix = f"part-{self._runID}-"
+        for root, _, files in os.walk(self.path):
+            parts = sorted(f for f in files if f.startswith(prefix) and f.endswith(".parquet"))
+            if len(parts) < 2:
+                continue
+            paths = [os.path.join(root, f) for f in parts]
+            table = pa.concat_tables([pq.read_table(p) for p in paths],
+                                     promote_options="permissive")
+            tmp = os.path.join(root, f".{prefix}c.parquet.tmp")
+            pq.write_table(table, tmp)
+            os.replace(tmp, os.path.join(root, f"{prefix}c.parquet"))
+            for p in paths:
+                os.remove(p)
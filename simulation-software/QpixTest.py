@@ -1,10 +1,18 @@
 import pytest
 import QpixAsic
 import QpixAsicArray
+import QpixTrace
+import QpixDataFormat
+import QpixTile
 import numpy as np
+import os
+import sys
 import warnings
 import random
 
+# the tile extraction scripts are imported as scripts.<name>, as QpixMPAnalysis does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
 random.seed(3)
 np.random.seed(2)
 
@@ -650,6 +658,789 @@ def test_daq_read_data_left(qpix_array, qpix_hits, int_prd=0.5):
     if good_hits:
         pass
 
+def test_daq_asic_index(qpix_array, qpix_hits, int_prd=0.5):
+    """
+    Ensure that the DaqNode's per-ASIC index matches a full filter of the
+    DaqNode FIFO, and that AnalyzeArray agrees with a per-ASIC comparison.
+    """
+    qpix_array.Route("Left", transact=False)
+
+    maxTime = 0
+    for hit, asic in zip(qpix_hits, qpix_array):
+        if len(hit) > 0:
+            maxTime = np.max(hit) if maxTime < np.max(hit) else maxTime
+            asic.InjectHits(hit)
+    qpix_array.totalInjectedHits = sum(asic.totalInjected for asic in qpix_array)
+
+    qpix_array = run_array_interrogate(qpix_array, maxTime, int_prd)
+
+    daqFifo = qpix_array._daqNode._localFifo
+    allGood = True
+    for asic in qpix_array:
+        data, end = QpixAsicArray.AnalyzeASIC(qpix_array, asic.row, asic.col, silent=True)
+        fData = [d for d in daqFifo._data if d.row == asic.row and d.col == asic.col and d.wordType == AsicWord.DATA]
+        fEnd = [d for d in daqFifo._data if d.row == asic.row and d.col == asic.col and d.wordType == AsicWord.EVTEND]
+        assert data == tuple(fData), f"indexed data words mismatch at ({asic.row},{asic.col})"
+        assert end == tuple(fEnd), f"indexed end words mismatch at ({asic.row},{asic.col})"
+        assert isinstance(data, tuple) and isinstance(end, tuple), "the FIFO's own index should not be returned"
+        allGood &= len(fData) == asic.totalInjected
+
+    allGood &= daqFifo._curSize > 0 and daqFifo._dataWords == qpix_array.totalInjectedHits
+    assert QpixAsicArray.AnalyzeArray(qpix_array, silent=True) == allGood, "AnalyzeArray disagrees with per-ASIC data"
+
+def test_daq_packed_stream(qpix_array, qpix_hits, tmp_path, int_prd=0.5):
+    """
+    Ensure that the DaqNode data survives a round trip through the packed
+    64 bit word stream, including the memory mapped on-disk format.
+    """
+
+    qpix_array.Route("Snake", transact=False)
+    maxTime = 0
+    for hit, asic in zip(qpix_hits, qpix_array):
+        if len(hit) > 0:
+            maxTime = np.max(hit) if maxTime < np.max(hit) else maxTime
+            asic.InjectHits(hit)
+    qpix_array = run_array_interrogate(qpix_array, maxTime, int_prd)
+
+    daqData = qpix_array._daqNode._localFifo._data
+    words, extras = QpixDataFormat.EncodeDaqData(daqData)
+    assert words.dtype == np.uint64 and words.nbytes == 8 * len(daqData), "words should be packed into 64 bits"
+
+    fileName = str(tmp_path / "daq")
+    QpixDataFormat.SaveDaqStream(fileName, words, extras)
+    words, extras = QpixDataFormat.LoadDaqStream(fileName)
+    cols = QpixDataFormat.DecodeDaqStream(words, extras)
+
+    for i, d in enumerate(daqData):
+        assert cols["DaqAsicX"][i] == d.row and cols["DaqAsicY"][i] == d.col, "bad position decode"
+        assert cols["DaqWordType"][i] == d.wordType.value, "bad word type decode"
+        assert cols["DaqTime"][i] == d.daqT, "bad daq time"
+        if d.wordType == AsicWord.DATA:
+            assert cols["DaqTimestamp"][i] == d.qbyte.timeStamp, "bad timestamp decode"
+            assert cols["Daqchannels"][i] == d.qbyte.channelMask, "bad channel decode"
+            assert cols["DaqSimTime"][i] == d.qbyte.data, "bad sim time"
+
+def test_array_stats(qpix_array, qpix_hits, int_prd=0.5):
+    """
+    Ensure that the simulation counters reported by stats() are self consistent.
+    """
+    qpix_array.Route("Left", transact=False)
+    qpix_array.EnableProfiling()
+    maxTime = 0
+    for hit, asic in zip(qpix_hits, qpix_array):
+        if len(hit) > 0:
+            maxTime = np.max(hit) if maxTime < np.max(hit) else maxTime
+            asic.InjectHits(hit)
+    qpix_array = run_array_interrogate(qpix_array, maxTime, int_prd)
+
+    stats = qpix_array.stats()
+    queue = stats["queue"]
+    assert queue["pushed"] == queue["popped"] + queue["pending"], "queue pushes and pops don't match"
+    assert sum(stats["receiveByte"].values()) == queue["popped"], "every popped item should be received"
+    assert stats["receiveByte"]["DATA"] >= qpix_array._daqNode._localFifo._dataWords, "DAQ data words must be received"
+    assert stats["arrayPasses"] > 0, "array should have been processed"
+    assert stats["fifoHighWater"]["daq"] == qpix_array._daqNode._localFifo._maxSize, "daq high water mismatch"
+    assert sum(stats["process"].values()) > 0, "no process calls counted"
+    assert "handlerTime" in stats and len(stats["handlerTime"]) > 0, "profiling did not record handler times"
+
+def test_inject_hit_arrays(qpix_array, tmp_path):
+    """
+    Ensure that injecting the memory mapped CSR hit arrays of a tile file
+    matches _InjectHits
+    """
+    rows, cols = qpix_array._nrows, qpix_array._ncols
+    hits = []
+    for asic in qpix_array:
+        nHits = np.random.randint(13)
+        resets = [[t, float(np.random.randint(16))] for t in np.random.uniform(1e-8, MAX_TIME, nHits)]
+        hits.append([asic.row, asic.col, resets])
+    # out of range ASICs are skipped
+    hits.append([rows, 0, [[1.0, 2.0]]])
+
+    tileFile = str(tmp_path / ("bkg" + QpixTile.TILE_EXT))
+    QpixTile.SaveTile(tileFile, {"nrows":rows, "ncols":cols, "hits":hits})
+    tile = QpixTile.LoadTile(tileFile)
+    asics, times, channels = tile.asics, tile.times, tile.channels
+    assert isinstance(times, np.memmap), "hit arrays should be memory mapped"
+
+    ref = QpixAsicArray.QpixAsicArray(rows, cols)
+    ref._InjectHits(hits, offset=0.5)
+    qpix_array.InjectHitArrays(asics, times, channels, offset=0.5)
+
+    assert qpix_array.InjectedHits == ref.InjectedHits, "injected hits differ"
+    assert qpix_array.totalTimes == ref.totalTimes, "total times differ"
+    assert qpix_array.totalInjectedHits == ref.totalInjectedHits, "injected size differs"
+    for asic, refAsic in zip(qpix_array, ref):
+        assert list(asic._times) == list(refAsic._times), f"times differ at ({asic.row},{asic.col})"
+        assert list(asic._channels) == list(refAsic._channels), f"channels differ at ({asic.row},{asic.col})"
+
+def test_tile_reduction(qpix_array, tmp_path, int_prd=0.5):
+    """
+    Ensure that the reduced tile results agree with the full DAQ arrays, and
+    that the full stream is only written to disk on request.
+    """
+    from QpixReduce import Reduction
+    from QpixSummary import SweepSummary
+    hits = []
+    for asic in qpix_array:
+        resets = [[t, float(np.random.randint(16))] for t in np.random.uniform(1e-8, MAX_TIME, np.random.randint(1, 13))]
+        hits.append([asic.row, asic.col, resets])
+    qpix_array.InjectHitArrays(*QpixDataFormat.HitsToArrays(hits), offset=0.5)
+    qpix_array.Route("Snake", transact=False)
+    qpix_array = run_array_interrogate(qpix_array, MAX_TIME, int_prd)
+
+    meta = {"Architecture":"Push", "Route":"snake", "File":"evt-1_x-2_y-2.qtile", "frq":0.05,
+            "size":qpix_array._nrows * qpix_array._ncols, "Injected Size":qpix_array.totalInjectedHits}
+    full = Reduction(["asic", "full"])(qpix_array, meta)
+    daqData = qpix_array._daqNode._localFifo._data
+    assert len(full["Injected Hits"]) == qpix_array.totalInjectedHits, "full injected hits missing"
+    assert list(full["DaqTime"]) == [d.daqT for d in daqData], "full daq times differ"
+
+    data = Reduction(daqDir=str(tmp_path / "daq"))(qpix_array, meta)
+    assert "Injected Hits" not in data and "DaqTime" not in data, "full arrays should not be returned"
+    assert data["Max Local"] == full["Max Local"] and data["Max Remote"] == full["Max Remote"], "maxima differ"
+    assert data["Daq Words"] == len(daqData) and data["Daq Data Words"] == qpix_array.totalInjectedHits, "bad daq counts"
+    latency = data["Latency Percentiles"]
+    assert latency[0] > 0 and np.all(np.diff(latency) >= 0), "bad latency percentiles"
+
+    words, extras = QpixDataFormat.LoadDaqStream(data["Daq File"])
+    assert list(extras["DaqTime"]) == [d.daqT for d in daqData], "saved daq stream differs"
+    assert SweepSummary.FromTile(data).Get("Push", "snake", meta["size"], 0.05).sums == \
+           SweepSummary.FromTile(full).Get("Push", "snake", meta["size"], 0.05).sums, "tile summaries differ"
+
+    with pytest.raises(QpixAsic.QPException):
+        Reduction(["everything"])
+
+def bruteBestWindow(pixel_x, pixel_y, xPixRange, yPixRange):
+    """
+    the sliding window search findBestWindow replaced, the first largest
+    window in x-major order wins
+    """
+    xBest, yBest, maxCount = 0, 0, 0
+    for x in range(np.min(pixel_x), np.max(pixel_x)-xPixRange+1):
+        for y in range(np.min(pixel_y), np.max(pixel_y)-yPixRange+1):
+            counts = np.sum((pixel_x >= x) & (pixel_x < x + xPixRange) & (pixel_y >= y) & (pixel_y < y + yPixRange))
+            if counts > maxCount:
+                xBest, yBest, maxCount = x, y, counts
+    return xBest, yBest
+
+def test_asic_groups():
+    """
+    Ensure that asicGroups splits the hits of a makeDF frame as a per ASIC
+    loop does, in order of first appearance and keeping the hit order.
+    """
+    import pandas as pd
+    from scripts.neutMakeJson import asicGroups, makeDF
+    rng = np.random.default_rng(5)
+    n = 200
+    window = (rng.integers(1, 17, n), rng.integers(1, 13, n), rng.uniform(0, 10, n))
+    fdf = makeDF(*window, 4, 3, window=window)
+
+    expected = []
+    for x in pd.unique(fdf["AsicX"]):
+        for y in pd.unique(fdf["AsicY"]):
+            sel = fdf[(fdf["AsicX"] == x) & (fdf["AsicY"] == y)]
+            if len(sel) > 0:
+                expected.append((int(x), int(y), sel[["Reset", "nPix"]].values.tolist()))
+    assert asicGroups(fdf) == expected, "asic groups differ"
+    assert all(len(resets) > 0 for _, _, resets in asicGroups(fdf)), "empty asics should be dropped"
+    assert asicGroups(fdf.iloc[:0]) == [], "empty frame should have no groups"
+
+def test_find_best_window():
+    """
+    Ensure that the summed-area table window search finds the same windows as
+    a brute force window sum, including when windows tie.
+    """
+    from scripts.neutMakeJson import pixelSAT, findBestWindow, findMaxes, channelXdim, channelYdim
+    rng = np.random.default_rng(7)
+    dims = [(1,1), (2,2), (1,3), (4,4)]
+    events = [(rng.integers(1, 60, n), rng.integers(1, 40, n)) for n in [1, 5, 40, 300]]
+    # two identical clusters, so the best windows tie between them
+    cluster_x, cluster_y = np.array([3, 4, 4, 5, 6]), np.array([2, 2, 3, 5, 4])
+    events.append((np.r_[cluster_x, cluster_x + 30, 70], np.r_[cluster_y, cluster_y, 50]))
+    events.append((np.r_[cluster_x, cluster_x, 70], np.r_[cluster_y, cluster_y + 20, 50]))
+
+    for pixel_x, pixel_y in events:
+        sat = pixelSAT(pixel_x, pixel_y)
+        for xdim, ydim in dims:
+            xPixRange, yPixRange = channelXdim * xdim, channelYdim * ydim
+            best = bruteBestWindow(pixel_x, pixel_y, xPixRange, yPixRange)
+            assert findBestWindow(*sat, xPixRange, yPixRange) == best, f"windows differ for {xdim}x{ydim}"
+
+        pixel_reset = rng.uniform(0, 10, len(pixel_x))
+        windows = findMaxes(pixel_x, pixel_y, pixel_reset, dims)
+        for xdim, ydim in dims:
+            x, y = bruteBestWindow(pixel_x, pixel_y, channelXdim * xdim, channelYdim * ydim)
+            sel = (pixel_x >= x) & (pixel_x < x + channelXdim * xdim) & (pixel_y >= y) & (pixel_y < y + channelYdim * ydim)
+            wx, wy, wreset = windows[(xdim, ydim)]
+            assert list(wreset) == list(pixel_reset[sel]), f"window resets differ for {xdim}x{ydim}"
+            if sel.any():
+                assert list(wx) == list(pixel_x[sel] - pixel_x[sel].min() + 1), "window x not re-ordered to 1"
+                assert list(wy) == list(pixel_y[sel] - pixel_y[sel].min() + 1), "window y not re-ordered to 1"
+
+def test_npz_tiles(tmp_path, monkeypatch):
+    """
+    Ensure that tiles extracted from an npz stand-in of the neutrino file, by
+    makeTiles and MakeNeutBatch, hold the hits of the densest window.
+    """
+    import QpixMPAnalysis
+    from scripts.neutMakeJson import saveNpzEvents, makeTiles, makeDF, asicGroups
+    rng = np.random.default_rng(11)
+    nEvents = 3
+    pixel_x = [rng.integers(1, 80, n) for n in [30, 200, 5]]
+    pixel_y = [rng.integers(1, 120, n) for n in [30, 200, 5]]
+    pixel_reset = [np.sort(rng.uniform(0, 10, len(px))) for px in pixel_x]
+    values = {key: rng.uniform(0, 5, nEvents) for key in
+              ["energy_deposit", "lepKE", "hadTot", "hadOther", "zpos", "axis_x", "axis_z"]}
+    npzFile = str(tmp_path / "events.npz")
+    saveNpzEvents(npzFile, pixel_x, pixel_y, pixel_reset, **values)
+
+    def tileFile(evt, x, y):
+        return str(tmp_path / f"evt-{evt}_x-{x}_y-{y}{QpixTile.TILE_EXT}")
+
+    requests = [(evt, x, y, tileFile(evt, x, y)) for evt in range(nEvents) for x, y in [(2,2), (4,4)]]
+    hits = makeTiles(npzFile, requests[:4])
+    monkeypatch.setattr(QpixMPAnalysis, "INPUT_DATA_FILE", npzFile)
+    hits.update(QpixMPAnalysis.MakeNeutBatch(requests[4:] + [(nEvents, 2, 2, tileFile(nEvents, 2, 2))]))
+    assert set(hits) == {req[:3] for req in requests}, "events past the end of the file should be skipped"
+
+    for evt, x, y, outf in requests:
+        tile = QpixTile.LoadTile(outf)
+        fdf = makeDF(pixel_x[evt], pixel_y[evt], pixel_reset[evt], x, y)
+        expected = [[ax, ay, resets] for ax, ay, resets in asicGroups(fdf)]
+        assert (tile["nrows"], tile["ncols"]) == (x, y), "bad tile dims"
+        assert tile["size"] == hits[(evt, x, y)] == len(fdf), "bad tile size"
+        assert tile["hits"] == expected, f"tile hits differ for event {evt}, {x}x{y}"
+        lep_recon = values["lepKE"][evt] + values["hadTot"][evt] + values["hadOther"][evt]
+        assert np.isclose(tile["energy_deposit"], values["energy_deposit"][evt]), "bad energy deposit"
+        assert np.isclose(tile["lep_recon"], lep_recon) and np.isclose(tile["zpos"], values["zpos"][evt]), "bad tile meta data"
+
+def test_apa_tiles():
+    """
+    Ensure that apaTiles partitions the pixels of an event into the tiles a
+    per hit calculation gives, and handles events without on-APA pixels.
+    """
+    from scripts.neutMakeJson import apaTiles, channelXdim, channelYdim, xMAX, yMAX
+    assert apaTiles([], [], [], 4, 4) == {}, "empty event should have no tiles"
+    assert apaTiles([0, xMAX+1], [5, yMAX+1], [1.0, 2.0], 4, 4) == {}, "off APA pixels should be dropped"
+
+    rng = np.random.default_rng(13)
+    n = 500
+    pixel_x = np.r_[rng.integers(1, xMAX+1, n), 0, xMAX+1]
+    pixel_y = np.r_[rng.integers(1, yMAX+1, n), 1, 1]
+    pixel_reset = rng.uniform(0, 10, n+2)
+    for xdim, ydim in [(2,2), (4,4), (8,16)]:
+        xDIM, yDIM = xdim * channelXdim, ydim * channelYdim
+        expected = {}
+        for x, y, t in zip(pixel_x[:n] - 1, pixel_y[:n] - 1, pixel_reset[:n]):
+            tile = expected.setdefault((x // xDIM, y // yDIM), {})
+            asic = tile.setdefault(((x % xDIM) // channelXdim, (y % yDIM) // channelYdim), [])
+            asic.append((t, x % channelXdim + channelYdim * (y % channelYdim)))
+
+        tiles = apaTiles(pixel_x, pixel_y, pixel_reset, xdim, ydim)
+        assert len(tiles) > 1 and set(tiles) == set(expected), f"bad tiles for {xdim}x{ydim}"
+        for key, (asics, times, channels) in tiles.items():
+            found = {(int(row), int(col)): list(zip(times[start:stop], channels[start:stop]))
+                     for row, col, start, stop in asics.tolist()}
+            assert found == {asic: sorted(hits) for asic, hits in expected[key].items()}, f"tile {key} hits differ"
+            assert asics["Stop"][-1] == len(times) == len(channels), f"tile {key} is not a full CSR array"
+
+def catalogMatch(fileCatalog, sort_file, q):
+    """
+    rtd lookup of a sort file in a child process, as neutrinoAna.GetRDFData does
+    """
+    q.put(fileCatalog.Match("rtd", sort_file))
+
+def test_catalog_child_lookup(tmp_path):
+    """
+    Ensure that a catalog handed to a spawned child process still finds the
+    rtd file of a sort file, where the child's own module catalog is empty.
+    """
+    import multiprocessing as mp
+    from scripts.neutCatalog import FileCatalog, openCatalog
+    sortDir, rtdDir = tmp_path / "sorted", tmp_path / "rtd"
+    sortDir.mkdir()
+    rtdDir.mkdir()
+    name = "FHC_3_x-100_y-200_z-300_seed-1_zaxis-1_sorted"
+    (sortDir / f"{name}.root").write_bytes(b"")
+    (rtdDir / f"{name}_rtd.root").write_bytes(b"")
+    (sortDir / "RHC_4_x-1_y-2_z-3_seed-1_zaxis-0_sorted.root").write_bytes(b"")
+
+    catalog = openCatalog(str(tmp_path / "catalog.json"), [str(sortDir), str(rtdDir)])
+    sort_file, rtd_file = str(sortDir / f"{name}.root"), str(rtdDir / f"{name}_rtd.root")
+    assert catalog.Match("rtd", sort_file) == rtd_file, "rtd file not matched"
+    assert FileCatalog().Match("rtd", sort_file) is None, "an empty catalog should not match"
+
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    for f in [sort_file, catalog.Files("sort")[-1]]:
+        p = ctx.Process(target=catalogMatch, args=(catalog, f, q))
+        p.start()
+        p.join(60)
+        assert p.exitcode == 0, "child lookup failed"
+        assert q.get(timeout=10) == catalog.Match("rtd", f), "child lookup differs"
+
+def test_ana_neutrino_jobs(tmp_path):
+    """
+    Ensure that the anaNeutrino runner sizes its workers to the cores, skips
+    up to date outputs, forwards the job threads and writes its summary csv.
+    """
+    import csv, stat
+    from scripts.neutrinoAnaMp import nWorkers, isUpToDate, runAll, writeSummary
+    assert nWorkers(1, ncpu=8) == 8 and nWorkers(3, ncpu=8) == 2, "bad worker count"
+    assert nWorkers(16, ncpu=8) == 1 and nWorkers(0, ncpu=8) == 8, "workers should be at least 1"
+
+    # stand-in for anaNeutrino which records its arguments, and fails on bad inputs
+    prog = tmp_path / "anaNeutrino"
+    prog.write_text(f"#!{sys.executable}\nimport sys\n"
+                    "open(sys.argv[2], 'w').write(' '.join(sys.argv[1:]))\n"
+                    "sys.exit(3 if 'bad' in sys.argv[1] else 0)\n")
+    prog.chmod(prog.stat().st_mode | stat.S_IEXEC)
+
+    jobs = []
+    for name in ["a", "b", "bad"]:
+        (tmp_path / f"{name}_rtd.root").write_text(name)
+        jobs.append((str(tmp_path / f"{name}_rtd.root"), str(tmp_path / f"{name}_graphs.root")))
+    assert not isUpToDate(*jobs[0]), "missing output should not be up to date"
+
+    summary = runAll(str(prog), jobs, workers=2, threads=4)
+    assert [s["status"] for s in summary] == ["ran"] * 3, "jobs should run"
+    assert [s["returncode"] for s in summary] == [0, 0, 3], "bad return codes"
+    assert open(jobs[0][1]).read() == f"{jobs[0][0]} {jobs[0][1]} 4", "threads not forwarded"
+    assert isUpToDate(*jobs[0]), "made output should be up to date"
+
+    os.utime(jobs[1][0], (os.path.getmtime(jobs[1][1]) + 10,) * 2)
+    summary = runAll(str(prog), jobs, workers=2)
+    assert [s["status"] for s in summary] == ["skipped", "ran", "skipped"], "only stale outputs should rerun"
+    assert [s["status"] for s in runAll(str(prog), jobs[:1], workers=1, force=True)] == ["ran"], "force should rerun"
+
+    summaryFile = str(tmp_path / "summary.csv")
+    writeSummary(summary, summaryFile)
+    with open(summaryFile, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["input"] for row in rows] == [job[0] for job in jobs], "bad summary order"
+    assert rows[1]["status"] == "ran" and float(rows[1]["wall_s"]) > 0, "bad summary row"
+    assert rows[0]["returncode"] == "0" and rows[0]["wall_s"] == "0.0", "bad skipped row"
+    assert rows[0]["peak_rss_mb"] == "", "skipped jobs should have no peak RSS"
+    if hasattr(os, "wait4"):
+        assert float(rows[1]["peak_rss_mb"]) > 0, "ran jobs should have their peak RSS"
+
+def test_pipeline_steps(tmp_path):
+    """
+    Ensure that pipeline steps are skipped while up to date, and rerun when an
+    input or their program changes, and that the chains reserve the cores
+    their programs use.
+    """
+    import stat
+    from scripts.neutPipeline import Pipeline, Step, addChain
+
+    def makeProg(name, ret=0, comment=""):
+        # stand-in program which copies its input to out.root in its working directory
+        prog = tmp_path / name
+        prog.write_text(f"#!{sys.executable}\nimport shutil, sys\n# {comment}\n"
+                        f"shutil.copy(sys.argv[1], 'out.root')\nsys.exit({ret})\n")
+        prog.chmod(prog.stat().st_mode | stat.S_IEXEC)
+        return str(prog)
+
+    prog, bad = makeProg("copy"), makeProg("fail", ret=2)
+    src, mid, out = str(tmp_path / "in.root"), str(tmp_path / "mid.root"), str(tmp_path / "out.root")
+    with open(src, "w") as f:
+        f.write("data")
+
+    def pipeline():
+        pipe = Pipeline(str(tmp_path / "work"), cores=2)
+        pipe.Add(Step("first", [prog, src], inputs=[src], outputs=[mid], moves={"out.root": mid}))
+        pipe.Add(Step("second", [prog, mid], inputs=[mid], outputs=[out], moves={"out.root": out}, deps=["first"]))
+        never = str(tmp_path / "never.root")
+        pipe.Add(Step("broken", [bad, src], inputs=[src], outputs=[never], moves={"out.root": never}))
+        pipe.Add(Step("after", [prog, src], inputs=[src], deps=["broken"]))
+        return pipe
+
+    assert pipeline().Run() == {"first":"ran", "second":"ran", "broken":"failed", "after":"blocked"}, "bad first run"
+    assert open(out).read() == "data", "outputs not moved"
+    status = pipeline().Run()
+    assert status["first"] == status["second"] == "skipped" and status["broken"] == "failed", "up to date steps should be skipped"
+
+    # a changed input reruns its step, and the steps downstream of it
+    with open(src, "w") as f:
+        f.write("new data")
+    status = pipeline().Run()
+    assert status["first"] == status["second"] == "ran" and open(out).read() == "new data", "changed input should rerun"
+
+    # a rebuilt program reruns every step which uses it
+    makeProg("copy", comment="rebuilt")
+    status = pipeline().Run()
+    assert status["first"] == status["second"] == "ran", "changed program should rerun"
+    assert pipeline().Run(force=True)["first"] == "ran", "force should rerun"
+
+    pipe = Pipeline(str(tmp_path / "chain"), cores=8)
+    addChain(pipe, "eng_muon_nu_fhc_files.root", 14, "1", buildDir=str(tmp_path), anaThreads=6)
+    cores = {name.split("_")[0]: step.cores for name, step in pipe.steps.items()}
+    assert cores == {"filt":1, "comb":1, "ana":6}, "bad step cores"
+    assert pipe.steps["ana_pdg14_fhc-1"].cmd[-1] == "6", "ana threads not forwarded"
+
+def rootKeys(tdir, path=""):
+    """
+    (path, name, cycle, class, title) of every key below tdir, in key order
+    """
+    keys = []
+    for key in tdir.GetListOfKeys():
+        if key.GetClassName().startswith("TDirectory"):
+            keys.extend(rootKeys(tdir.GetDirectory(key.GetName()), f"{path}/{key.GetName()}"))
+        else:
+            keys.append((path, key.GetName(), key.GetCycle(), key.GetClassName(), key.GetTitle()))
+    return keys
+
+def test_root_graphs_parity(tmp_path, monkeypatch):
+    """
+    Ensure that rendering the neutAna graphs on worker processes writes the same
+    keys, cycles and table rows as rendering them in order.
+    """
+    ROOT = pytest.importorskip("ROOT")
+    pytest.importorskip("texttable")
+    pytest.importorskip("latextable")
+    from scripts import neutGraphs
+
+    # merged cycles of a name keep their order
+    src = ROOT.TFile(str(tmp_path / "src.root"), "RECREATE")
+    for title in ["first", "second", "third"]:
+        ROOT.TNamed("obj", title).Write("obj")
+    src.mkdir("sub").cd()
+    ROOT.TNamed("inner", "inner").Write()
+    dst = ROOT.TFile(str(tmp_path / "dst.root"), "RECREATE")
+    neutGraphs.mergePart(src, dst)
+    assert rootKeys(dst) == rootKeys(src), "merged keys differ"
+    assert [k[4] for k in rootKeys(dst) if k[1] == "obj"] == ["third", "second", "first"], "cycles out of order"
+    src.Close()
+    dst.Close()
+
+    # a small stand-in for the output of neutAna.cpp
+    infile = str(tmp_path / "ana.root")
+    tf = ROOT.TFile(infile, "RECREATE")
+    rng = np.random.default_rng(17)
+    for tdir in neutGraphs.theta_dirs:
+        for zdir in neutGraphs.zpos_dirs:
+            tf.mkdir(f"{tdir}/{zdir}").cd()
+            for name in ["hTile", "hAsic", "hAsicWeight"]:
+                hist = ROOT.TH1F(name, name, 50, 0, 50)
+                for value in rng.normal(20, 5, 200):
+                    hist.Fill(value)
+                hist.Write()
+            for name in ["tgLepKEAsic", "tgLepKETile", "tgEnergyDepAsic", "tgEnergyDepTile"]:
+                x = np.sort(rng.uniform(250, 5000, 40))
+                graph = ROOT.TGraph(len(x), x, rng.uniform(1, 30, len(x)))
+                graph.SetName(name)
+                graph.Write()
+    tf.Close()
+
+    # the same file_dir twice, so the output canvases have several cycles
+    runs = [dict(infile=infile, file_dir="fhc_pdg14", lepPdg=14, isFHC=True),
+            dict(infile=infile, file_dir="fhc_pdg14", lepPdg=14, isFHC=True),
+            dict(infile=infile, file_dir="rhc_pdg14", lepPdg=14, isFHC=False)]
+    results = []
+    for nproc in [1, 2]:
+        tables = [neutGraphs.table_neut_buf_data, neutGraphs.table_neut_buf_w_data]
+        nRows = [len(table) for table in tables]
+        output = str(tmp_path / f"graphs_{nproc}.root")
+        monkeypatch.setattr(neutGraphs, "root_canvas", neutGraphs.canvas_counter(output))
+        neutGraphs.readRootDataFiles(runs, nproc=nproc)
+        neutGraphs.root_canvas.Close()
+        rows = [table[n:] for table, n in zip(tables, nRows)]
+        for table, n in zip(tables, nRows):
+            del table[n:]
+        tf = ROOT.TFile(output, "READ")
+        results.append((rootKeys(tf), rows))
+        tf.Close()
+        assert not os.path.exists(output + ".parts"), "part files not removed"
+
+    (keys, rows), (mpKeys, mpRows) = results
+    assert len(keys) > 0 and any(key[2] > 1 for key in keys), "expected several cycles of the canvases"
+    assert mpKeys == keys, "parallel keys and cycles differ"
+    assert mpRows == rows, "parallel table rows differ"
+
+def test_tile_format(tmp_path):
+    """
+    Ensure that binary tile files round trip the tiledf json, and build the
+    same array as the json does.
+    """
+    import os, json
+    jsonFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jsons", "tiledf05_10x14.json")
+    with open(jsonFile, "r") as f:
+        tiledf = json.load(f)
+    tiledf["energy_deposit"] = 1.5
+
+    tileFile = str(tmp_path / ("tile" + QpixTile.TILE_EXT))
+    QpixTile.SaveTile(tileFile, tiledf)
+    assert QpixTile.IsTileFile(tileFile) and not QpixTile.IsTileFile(jsonFile), "tile magic not found"
+    tile = QpixTile.LoadTile(tileFile)
+    assert isinstance(tile.times, np.memmap), "tile should be memory mapped"
+
+    nHits = sum(len(resets) for _, _, resets in tiledf["hits"])
+    assert tile["nrows"] == tiledf["nrows"] and tile["ncols"] == tiledf["ncols"], "bad tile dims"
+    assert tile["size"] == nHits, "bad tile size"
+    assert tile["energy_deposit"] == 1.5 and "zpos" not in tile, "bad tile meta data"
+    for (row, col, resets), (tRow, tCol, tResets) in zip(tiledf["hits"], tile["hits"]):
+        assert (row, col) == (tRow, tCol), "asic order changed"
+        assert sorted(map(tuple, resets)) == sorted(map(tuple, tResets)), f"resets differ at ({row},{col})"
+
+    ref = QpixAsicArray.QpixAsicArray(0, 0, tiledf=tiledf, offset=5.1)
+    for tileArg in [tile, tileFile]:
+        qpa = QpixAsicArray.QpixAsicArray(0, 0, tiledf=tileArg, offset=5.1)
+        assert (qpa._nrows, qpa._ncols) == (ref._nrows, ref._ncols), "tile array size differs"
+        assert qpa.InjectedHits == ref.InjectedHits, "tile injected hits differ"
+        for asic, refAsic in zip(qpa, ref):
+            assert list(asic._channels) == list(refAsic._channels), f"channels differ at ({asic.row},{asic.col})"
+
+def test_tile_cache(tmp_path):
+    """
+    Ensure that the tile cache finds valid tiles, reports changed inputs and
+    parameters, and evicts least recently used tiles.
+    """
+    import time
+    from QpixTileCache import TileCache
+    inFile = tmp_path / "input.root"
+    inFile.write_bytes(b"event data")
+    tiledf = {"nrows":2, "ncols":2, "hits":[[0, 1, [[1.0, 3.0], [0.5, 2.0]]]]}
+
+    cache = TileCache(str(tmp_path / "cache"), params={"channelXdim":4}, maxBytes=None)
+    keys = []
+    for evt in range(3):
+        key, path, valid = cache.Lookup(str(inFile), evt, 2, 2)
+        assert not valid, "empty cache should miss"
+        QpixTile.SaveTile(path, tiledf)
+        cache.Record(key, path, str(inFile), evt, 2, 2)
+        cache.entries[key]["lastUsed"] = evt
+        keys.append(key)
+    cache.Save()
+
+    # a new cache on the same directory finds the tiles
+    cache = TileCache(str(tmp_path / "cache"), params={"channelXdim":4})
+    key, path, valid = cache.Lookup(str(inFile), 1, 2, 2)
+    assert valid and key == keys[1], "cached tile not found"
+    assert len(cache.Report()["valid"]) == 3, "all entries should be valid"
+
+    # evict down to one tile, keeping the one in use
+    tileBytes = cache.entries[keys[0]]["bytes"]
+    cache.Evict(maxBytes=tileBytes, keep=[keys[0]])
+    assert set(cache.entries) == {keys[0]}, "least recently used tiles not evicted"
+
+    # changed parameters and inputs invalidate entries
+    report = TileCache(str(tmp_path / "cache"), params={"channelXdim":8}).Report()
+    assert len(report["valid"]) == 0, "changed params should be invalid"
+    time.sleep(0.01)
+    inFile.write_bytes(b"new event data")
+    report = cache.Report(prune=True)
+    assert report["input changed"] == [keys[0]] and len(cache.entries) == 0, "changed input not pruned"
+
+@pytest.mark.parametrize("step", [None, 2.5])
+def test_window_tiles(step):
+    """
+    Ensure that windowed tiles hold the same hits as filtering the run for each
+    window, for consecutive and sliding windows.
+    """
+    rng = np.random.default_rng(2)
+    n = 2000
+    rows, cols = rng.integers(0, 4, n), rng.integers(0, 3, n)
+    times, channels = np.round(rng.uniform(0, 100, n), 2), rng.integers(0, 16, n)
+
+    tiles = QpixTile.WindowTiles(rows, cols, times, channels, 4, 3, 20, 100, 10, step)
+    assert len(tiles) == (8 if step is None else 29), "wrong number of windows"
+    for t0, tile in tiles:
+        assert (tile.nrows, tile.ncols) == (4, 3), "bad tile dims"
+        inWindow = (times > t0) & (times <= t0 + 10)
+        assert tile.size == inWindow.sum(), f"window at {t0} has the wrong hits"
+        for row, col, start, stop in tile.asics.tolist():
+            sel = inWindow & (rows == row) & (cols == col)
+            assert stop > start, "empty asic stored"
+            assert np.allclose(tile.times[start:stop], np.sort(times[sel]) - t0), f"times differ at ({row},{col})"
+            assert sorted(tile.channels[start:stop]) == sorted(channels[sel]), f"channels differ at ({row},{col})"
+
+def test_sweep_writer(tmp_path):
+    """
+    Ensure that the sweep dataset keeps its schema when the first row group
+    only has None in a column, compacts the files of a run, and that a
+    resumed sweep finds the tiles already written.
+    """
+    import os
+    from QpixReduce import Reduction
+    from QpixSweepWriter import SweepWriter, CompletedKeys, ReadSweep
+    path = str(tmp_path / "sweep")
+    reduction = Reduction(["maxima", "asic"])
+
+    def tile(arch, route, i, energy):
+        return {"Architecture":arch, "Route":route, "File":f"evt-{i}_x-2_y-2.qtile", "frq":0.05,
+                "Injected Size":i, "size":4, "energy_deposit":energy, "lep_recon":None,
+                "axis_x":None, "axis_z":None, "zpos":None, "Max Local":np.intc(i), "Max Remote":np.intc(2*i),
+                "Remote Transaction Average":float(i), "AsicX":np.arange(4, dtype=np.short),
+                "AsicY":np.zeros(4, dtype=np.short), "Remote Transactions":np.full(4, i, dtype=np.intc)}
+
+    assert CompletedKeys(path) == set(), "new dataset should be empty"
+    with SweepWriter(path, schema=reduction.Schema(), rowGroupSize=2) as writer:
+        for i in range(6):
+            writer.Write(tile("Pull", "snake", i, None if i < 2 else 0.5 * i))
+    keys = {("snake", f"evt-{i}_x-2_y-2.qtile", 0.05, "Pull") for i in range(6)}
+    assert CompletedKeys(path) == keys, "bad completed keys"
+    partition = os.path.join(path, "Architecture=Pull", "Route=snake")
+    assert len(os.listdir(partition)) == 1, "run files were not compacted"
+
+    # a resumed sweep appends to the dataset, and the null first row group keeps its types
+    with SweepWriter(path, schema=reduction.Schema(), rowGroupSize=2) as writer:
+        writer.Write(tile("Push", "snake", 6, 3.0))
+        writer.Write(tile("Pull", "left", 7, 3.5))
+    keys |= {("snake", "evt-6_x-2_y-2.qtile", 0.05, "Push"), ("left", "evt-7_x-2_y-2.qtile", 0.05, "Pull")}
+    assert CompletedKeys(path) == keys, "resumed keys missing"
+    assert len(os.listdir(partition)) == 1, "resumed run should not touch other partitions"
+
+    df = ReadSweep(path).sort_values("Injected Size")
+    assert len(df) == 8 and list(df["Max Remote"]) == [2*i for i in range(8)], "bad sweep data"
+    assert df["energy_deposit"].isna().sum() == 2 and df["energy_deposit"].iloc[-1] == 3.5, "bad energy deposits"
+    assert list(df["Remote Transactions"].iloc[3]) == [3]*4, "bad asic arrays"
+
+    # without a schema the null columns of the first flush are promoted
+    inferred = str(tmp_path / "inferred")
+    with SweepWriter(inferred, rowGroupSize=2, compact=False) as writer:
+        for i in range(4):
+            writer.Write(tile("Pull", "snake", i, None if i < 2 else 0.5 * i))
+    assert writer._schema.field("energy_deposit").type == reduction.Schema().field("energy_deposit").type, "null column not promoted"
+
+def test_sweep_summary(tmp_path):
+    """
+    Ensure that merging the summaries of single tiles matches the exact values
+    of the whole sweep, and that depths beyond the histogram bins are bounded
+    in size and within a factor of 2.
+    """
+    import pandas as pd
+    from QpixSummary import SweepSummary, ValidateSummary, ExactQuantile, FixedHist, OVER_BINS
+    rng = np.random.default_rng(4)
+    n = 500
+    df = pd.DataFrame({
+        "Architecture": rng.choice(["Push", "Pull"], n),
+        "Route": rng.choice(["left", "snake", "trunk"], n),
+        "frq": rng.choice([0.05, 0.005], n),
+        "size": rng.choice([16, 64], n),
+        "Max Local": rng.integers(1, 300, n),
+        "Max Remote": rng.integers(0, 6000, n),
+        "Injected Size": rng.integers(0, 5000, n),
+        "Remote Transactions": [rng.integers(0, 3000, 4) for _ in range(n)],
+    })
+
+    summary = SweepSummary()
+    for data in df.to_dict("records"):
+        summary.Merge(SweepSummary.FromTile(data))
+    assert summary.tiles == n, "tiles lost when merging"
+    assert ValidateSummary(df, summary) == [], "merged summary differs from the exact values"
+
+    summary.Save(str(tmp_path / "summary.json"))
+    loaded = SweepSummary.Load(str(tmp_path / "summary.json"))
+    assert ValidateSummary(df, loaded) == [], "summary changed when saved"
+
+    # a pickled summary only holds its occupied bins
+    import pickle
+    tile = SweepSummary.FromTile(df.to_dict("records")[0])
+    assert len(pickle.dumps(tile)) < 2048, "one tile summary pickles too large"
+    assert ValidateSummary(df, pickle.loads(pickle.dumps(summary))) == [], "summary changed when pickled"
+
+    # results of the maxima reducer alone only have the average Remote Transactions
+    from QpixReduce import Reduction
+    from QpixSweepWriter import SweepWriter
+    from QpixSummary import ReadSummaryFrame
+    maxima = df.assign(**{"Remote Transaction Average": df["Remote Transactions"].map(np.mean)})
+    maxima = maxima.drop(columns="Remote Transactions")
+    with SweepWriter(str(tmp_path / "maxima"), schema=Reduction(["maxima"]).Schema()) as writer:
+        for data in maxima.to_dict("records"):
+            writer.Write(data)
+    frame = ReadSummaryFrame(str(tmp_path / "maxima"))
+    assert "Remote Transactions" not in frame, "only the maxima columns should be read"
+    assert ValidateSummary(maxima, SweepSummary.FromFrame(frame)) == [], "maxima summary differs"
+    assert ValidateSummary(frame, summary) == [], "maxima frame differs from the tile summaries"
+
+    hist = FixedHist(0, 10, 10)
+    hist.Fill([-3, 2, 2, 5, 12, 40])
+    assert [hist.Quantile(q) for q in (0.1, 0.5, 0.8, 1.0)] == [-3, 2, 10, 40], "bad flow quantiles"
+
+    # overflow is kept in OVER_BINS bins, however many values are beyond the bins
+    values = rng.integers(0, 10**6, 10**5)
+    hist = FixedHist(0, 1000, 1000)
+    for chunk in np.array_split(values, 10):
+        part = FixedHist(0, 1000, 1000)
+        part.Fill(chunk)
+        hist.Merge(FixedHist.FromDict(part.ToDict()))
+    assert hist.n == len(values) and len(hist.ToDict()["over"]) == OVER_BINS, "overflow should be bounded"
+    for q in (0.5, 0.95, 0.99):
+        exact = ExactQuantile(values, q)
+        assert hist.Quantile(q) <= exact < 2 * hist.Quantile(q), f"overflow q{q} not within a factor of 2"
+    assert hist.Quantile(1.0) == values.max(), "largest value should be exact"
+    assert ExactQuantile([1, 2, 3, 4], 0.5) == 2 and ExactQuantile(range(100), 0.99) == 98, "bad nearest rank"
+
+def sweep_job(cost, fail=False):
+    """
+    trivial tile job of test_run_sweep, which returns a makeData like dictionary
+    """
+    if fail:
+        raise ValueError(f"tile {cost} failed")
+    return {"Architecture":"Push", "Route":"snake", "size":16, "frq":0.05, "Max Local":cost,
+            "Max Remote":cost, "Remote Transaction Average":1.0, "Injected Size":cost}
+
+def test_run_sweep(tmp_path, monkeypatch):
+    """
+    Ensure that the sweep runs jobs longest first and skips failed jobs.
+    """
+    import QpixMPAnalysis
+    monkeypatch.setattr(QpixMPAnalysis, "BACKGROUND_FILE", str(tmp_path / "background.qtile"))
+
+    jobs = [(cost, sweep_job, (cost,)) for cost in [2, 5, 1, 4]]
+    jobs.append((3, sweep_job, (3, True)))
+    results = list(QpixMPAnalysis.RunSweep(jobs, ncpu=1, maxInFlight=1))
+    assert [data["Max Local"] for data in results] == [5, 4, 2, 1], "jobs not run longest first, or failure not skipped"
+
+    # cost scales with the file size and the tile area parsed from its name
+    neutFile = tmp_path / "evt-1_x-4_y-2.qtile"
+    neutFile.write_bytes(b"0" * 99)
+    assert QpixMPAnalysis.JobCost(str(neutFile)) == 100 * 8, "bad pull cost"
+    assert QpixMPAnalysis.JobCost(str(neutFile), push=True) == 100 * 8 * QpixMPAnalysis.PUSH_COST, "bad push cost"
+    assert QpixMPAnalysis.JobCost(str(tmp_path / "missing.qtile")) == 1, "missing file without dims should cost 1"
+    assert QpixMPAnalysis.PushCost(str(tmp_path / "missing.json"), default=7) == 7, "missing baseline should use the default"
+    assert QpixMPAnalysis.PUSH_COST > 1, "push jobs should cost more than pull jobs"
+
+@pytest.mark.parametrize("scenario", QpixTrace.GOLDEN_SCENARIOS,
+                         ids=[QpixTrace.ScenarioName(*s) for s in QpixTrace.GOLDEN_SCENARIOS])
+def test_golden_trace(scenario):
+    """
+    Ensure that the order of every ReceiveByte transaction matches the golden
+    trace recorded from the reference engine.
+    """
+    golden = QpixTrace.LoadTrace(QpixTrace.ScenarioFile(*scenario))
+    trace = QpixTrace.RunScenario(*scenario)
+    div = QpixTrace.DiffTraces(golden, trace)
+    msg = "" if div is None else f"diverged at {div['index']} on {div['fields']}: {div['ref']} != {div['test']}"
+    assert div is None, msg
+
+def test_trace_diff(qpix_array, qpix_hits, int_prd=0.5):
+    """
+    Ensure that DiffTraces finds the first divergent record in a trace.
+    """
+    qpix_array.Route("Snake", transact=False)
+    qpix_array.EnableTrace()
+    maxTime = 0
+    for hit, asic in zip(qpix_hits, qpix_array):
+        if len(hit) > 0:
+            maxTime = np.max(hit) if maxTime < np.max(hit) else maxTime
+            asic.InjectHits(hit)
+    qpix_array = run_array_interrogate(qpix_array, maxTime, int_prd)
+
+    trace = qpix_array.Trace()
+    assert len(trace) == qpix_array.stats()["queue"]["popped"], "trace should record every received item"
+    assert QpixTrace.DiffTraces(trace, trace.copy()) is None, "identical traces should not diverge"
+
+    test = trace.copy()
+    i = len(trace) // 2
+    test["Tag"][i] += 1
+    div = QpixTrace.DiffTraces(trace, test)
+    assert div["index"] == i and div["fields"] == ["Tag"], "wrong divergence found"
+
+    div = QpixTrace.DiffTraces(trace, trace[:i])
+    assert div["index"] == i and div["test"] is None, "truncated trace should diverge at its end"
+
 def test_asic_update_time(qpix_array):
     """
     Ensure that there are no malicious changes to UpdateTime method
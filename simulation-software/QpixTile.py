@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from QpixAsic import QPException
+from QpixDataFormat import HIT_ASIC_DTYPE, HitsToArrays
+
+## Binary, memory mappable replacement of the tiledf json files. A tile file is
+##   header   : TILE_HEADER_DTYPE, 72 bytes
+##   asics    : nasics x HIT_ASIC_DTYPE, (Row, Col, Start, Stop) in file order
+##   times    : nhits x float64, sorted within each ASIC
+##   channels : nhits x int16
+## every section starts 8 byte aligned, so the whole file is mapped once and
+## each section is a zero-copy view into it.
+##
+## Convert the existing json tiles with:
+##   python QpixTile.py ../jsons/*.json
+
+TILE_MAGIC = b"QPIXTILE"
+TILE_VERSION = 1
+TILE_EXT = ".qtile"
+
+# optional event values stored with neutrino tiles, flagged present in the header
+META_KEYS = ["energy_deposit", "lep_recon", "axis_x", "axis_z", "zpos"]
+
+TILE_HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u2"),
+    ("flags", "<u2"),          # bit i set if META_KEYS[i] is stored
+    ("nrows", "<i4"),
+    ("ncols", "<i4"),
+    ("nasics", "<i4"),
+    ("nhits", "<i8"),
+    ("energy_deposit", "<f8"),
+    ("lep_recon", "<f8"),
+    ("axis_x", "<f8"),
+    ("axis_z", "<f8"),
+    ("zpos", "<f8"),
+])
+TILE_CHANNEL_DTYPE = np.dtype("<i2")
+
+
+class QpixTile():
+    """
+    Tile of injected hits, in the CSR form of QpixDataFormat.HitsToArrays.
+
+    Supports the dictionary access of the old tiledf json, ie tile["nrows"],
+    tile["size"] or tile["energy_deposit"], so it can be passed anywhere a tiledf
+    is used. tile["hits"] rebuilds the nested json lists, and should be avoided
+    where the arrays can be used instead.
+    """
+    def __init__(self, nrows, ncols, asics, times, channels, **meta):
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.asics = asics
+        self.times = times
+        self.channels = channels
+        self.meta = {key: float(meta[key]) for key in META_KEYS if meta.get(key) is not None}
+
+    @classmethod
+    def FromDict(cls, tiledf):
+        """
+        build a tile from a tiledf dictionary, ie a loaded json tile
+        """
+        asics, times, channels = HitsToArrays(tiledf["hits"])
+        return cls(tiledf["nrows"], tiledf["ncols"], asics, times, channels,
+                   **{key: tiledf.get(key) for key in META_KEYS})
+
+    @property
+    def size(self):
+        return len(self.times)
+
+    def keys(self):
+        return ["nrows", "ncols", "size", "hits"] + list(self.meta)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == "nrows":
+            return self.nrows
+        elif key == "ncols":
+            return self.ncols
+        elif key == "size":
+            return self.size
+        elif key == "hits":
+            return [[row, col, [[float(t), float(c)] for t, c in zip(self.times[start:stop], self.channels[start:stop])]]
+                    for row, col, start, stop in self.asics.tolist()]
+        elif key in self.meta:
+            return self.meta[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def Header(self):
+        header = np.zeros(1, dtype=TILE_HEADER_DTYPE)
+        header["magic"] = TILE_MAGIC
+        header["version"] = TILE_VERSION
+        header["nrows"] = self.nrows
+        header["ncols"] = self.ncols
+        header["nasics"] = len(self.asics)
+        header["nhits"] = len(self.times)
+        flags = 0
+        for i, key in enumerate(META_KEYS):
+            if key in self.meta:
+                flags |= 1 << i
+                header[key] = self.meta[key]
+        header["flags"] = flags
+        return header
+
+    def Save(self, fileName):
+        """
+        write the tile, the file is replaced atomically so readers never map a partial tile
+        """
+        channels = np.asarray(self.channels)
+        if len(channels) > 0 and (channels.min() < np.iinfo(TILE_CHANNEL_DTYPE).min or
+                                  channels.max() > np.iinfo(TILE_CHANNEL_DTYPE).max):
+            raise QPException("tile channels do not fit within int16!")
+
+        tmpName = f"{fileName}.tmp{os.getpid()}"
+        with open(tmpName, "wb") as f:
+            f.write(self.Header().tobytes())
+            f.write(np.asarray(self.asics, dtype=HIT_ASIC_DTYPE).tobytes())
+            f.write(np.asarray(self.times, dtype="<f8").tobytes())
+            f.write(channels.astype(TILE_CHANNEL_DTYPE).tobytes())
+        os.replace(tmpName, fileName)
+
+
+def WindowTiles(rows, cols, times, channels, nrows, ncols, time_start, time_end, window, step=None):
+    """
+    Slice a long run of hits into a tile per time window. The hits are sorted by
+    ASIC and time once, and each window is a set of index ranges found with
+    searchsorted, so every window costs only the hits within it.
+
+    ARGS:
+        rows, cols, times, channels - per hit ASIC row / col, reset time and channel
+        nrows, ncols                - dims of the tiles
+        time_start, time_end        - range of the run to slice
+        window                      - length (s) of each window
+        step                        - start to start spacing of the windows, window
+                                      for consecutive windows, less for sliding
+
+    Windows cover (t0, t0+window], as forceMake.makeNumpy selects hits, and
+    their times are shifted to start at 0. Windows are generated from time_start
+    for as long as they fit before time_end.
+
+    returns list of (t0, QpixTile), empty windows included
+    """
+    step = window if step is None else step
+    if window <= 0 or step <= 0:
+        raise QPException("window and step must be positive")
+
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    times = np.asarray(times, dtype=np.float64)
+    channels = np.asarray(channels, dtype=np.int64)
+
+    order = np.lexsort((times, cols, rows))
+    rows, cols, times, channels = rows[order], cols[order], times[order], channels[order]
+    asicStarts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])]) if len(rows) else np.zeros(0, np.int64)
+    asicEnds = np.r_[asicStarts[1:], len(rows)]
+
+    nWindows = int(np.floor((time_end - time_start - window) / step + 1e-9)) + 1
+    starts = time_start + step * np.arange(max(nWindows, 0))
+
+    # lo / hi index of every window within every ASIC, one searchsorted per ASIC
+    lo = np.empty((len(asicStarts), len(starts)), dtype=np.int64)
+    hi = np.empty((len(asicStarts), len(starts)), dtype=np.int64)
+    for i, (a, b) in enumerate(zip(asicStarts, asicEnds)):
+        lo[i] = a + np.searchsorted(times[a:b], starts, side="right")
+        hi[i] = a + np.searchsorted(times[a:b], starts + window, side="right")
+
+    tiles = []
+    for w, t0 in enumerate(starts):
+        occupied = np.flatnonzero(hi[:, w] > lo[:, w])
+        counts = hi[occupied, w] - lo[occupied, w]
+        asics = np.empty(len(occupied), dtype=HIT_ASIC_DTYPE)
+        asics["Row"] = rows[asicStarts[occupied]]
+        asics["Col"] = cols[asicStarts[occupied]]
+        asics["Stop"] = np.cumsum(counts)
+        asics["Start"] = asics["Stop"] - counts
+        idx = np.concatenate([np.arange(l, h) for l, h in zip(lo[occupied, w], hi[occupied, w])]) if len(occupied) else np.zeros(0, np.int64)
+        tiles.append((float(t0), QpixTile(nrows, ncols, asics, times[idx] - t0, channels[idx])))
+    return tiles
+
+
+def IsTileFile(fileName):
+    """
+    true if fileName starts with the tile magic
+    """
+    try:
+        with open(fileName, "rb") as f:
+            return f.read(len(TILE_MAGIC)) == TILE_MAGIC
+    except OSError:
+        return False
+
+
+def LoadTile(fileName, mmap=True):
+    """
+    Read a tile written by SaveTile. With mmap the file is memory mapped
+    read-only and the arrays are views into it, else it is read into memory.
+    """
+    if mmap:
+        buf = np.memmap(fileName, dtype=np.uint8, mode="r")
+    else:
+        buf = np.fromfile(fileName, dtype=np.uint8)
+    if len(buf) < TILE_HEADER_DTYPE.itemsize:
+        raise QPException(f"{fileName} is too short to be a tile file")
+
+    header = buf[:TILE_HEADER_DTYPE.itemsize].view(TILE_HEADER_DTYPE)[0]
+    if header["magic"] != TILE_MAGIC:
+        raise QPException(f"{fileName} is not a tile file")
+    if header["version"] != TILE_VERSION:
+        raise QPException(f"{fileName} has unsupported tile version {header['version']}")
+
+    nasics, nhits = int(header["nasics"]), int(header["nhits"])
+    asicStart = TILE_HEADER_DTYPE.itemsize
+    timeStart = asicStart + nasics * HIT_ASIC_DTYPE.itemsize
+    chanStart = timeStart + nhits * 8
+    chanEnd = chanStart + nhits * TILE_CHANNEL_DTYPE.itemsize
+    if len(buf) < chanEnd:
+        raise QPException(f"{fileName} is truncated, {len(buf)} < {chanEnd} bytes")
+
+    meta = {key: header[key] for i, key in enumerate(META_KEYS) if header["flags"] & (1 << i)}
+    return QpixTile(header["nrows"], header["ncols"],
+                    buf[asicStart:timeStart].view(HIT_ASIC_DTYPE),
+                    buf[timeStart:chanStart].view("<f8"),
+                    buf[chanStart:chanEnd].view(TILE_CHANNEL_DTYPE),
+                    **meta)
+
+
+def SaveTile(fileName, tiledf):
+    """
+    write a tiledf dictionary or QpixTile to fileName
+    """
+    if not isinstance(tiledf, QpixTile):
+        tiledf = QpixTile.FromDict(tiledf)
+    tiledf.Save(fileName)
+
+
+def ConvertJson(jsonFile, outFile=None):
+    """
+    convert a tiledf json file into a tile file, by default next to the json
+    """
+    if outFile is None:
+        outFile = os.path.splitext(jsonFile)[0] + TILE_EXT
+    with open(jsonFile, "r") as f:
+        tiledf = json.load(f)
+    SaveTile(outFile, tiledf)
+    return outFile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="convert tiledf json files into binary tile files")
+    parser.add_argument("json", nargs="+", help="tiledf json files to convert")
+    parser.add_argument("--out-dir", help="directory to write tiles, default next to each json")
+    args = parser.parse_args(argv)
+
+    for jsonFile in args.json:
+        outFile = None
+        if args.out_dir is not None:
+            os.makedirs(args.out_dir, exist_ok=True)
+            outFile = os.path.join(args.out_dir, os.path.splitext(os.path.basename(jsonFile))[0] + TILE_EXT)
+        outFile = ConvertJson(jsonFile, outFile)
+        print(f"converted {jsonFile} ({os.path.getsize(jsonFile)} B) to {outFile} ({os.path.getsize(outFile)} B)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
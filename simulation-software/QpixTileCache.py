@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+from QpixTile import IsTileFile, TILE_EXT, TILE_VERSION
+
+## Content addressed cache of the neutrino tiles generated for a sweep. A tile
+## is keyed by the sha256 of the input ROOT file, the event number, the tile
+## dims and the extraction parameters, so a tile is only regenerated when one
+## of those changes. Entries are tracked in <cacheDir>/manifest.json:
+##   "inputs"  - memoized input hashes, keyed by path and checked by size/mtime
+##   "entries" - key -> input, hash, event, dims, params, bytes, lastUsed
+##
+## Inspect or trim a cache with:
+##   python QpixTileCache.py ../jsons/tiles --report
+##   python QpixTileCache.py ../jsons/tiles --max-gb 2
+
+MANIFEST = "manifest.json"
+HASH_CHUNK = 1 << 20
+
+
+def FileHash(fileName):
+    """
+    sha256 of a file's contents
+    """
+    h = hashlib.sha256()
+    with open(fileName, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TileCache():
+    """
+    Cache of generated tile files, see module notes.
+
+    ARGS:
+        cacheDir - directory holding the tiles and manifest
+        params   - dictionary of extraction parameters which are part of every key
+        maxBytes - size bound of the cache used by Evict, None for no bound
+    """
+    def __init__(self, cacheDir, params=None, maxBytes=None):
+        self.cacheDir = cacheDir
+        self.params = dict(params or {})
+        self.params["tile_version"] = TILE_VERSION
+        self.maxBytes = maxBytes
+        os.makedirs(cacheDir, exist_ok=True)
+
+        self._manifest = {"inputs": {}, "entries": {}}
+        manifest = os.path.join(cacheDir, MANIFEST)
+        if os.path.isfile(manifest):
+            with open(manifest, "r") as f:
+                self._manifest = json.load(f)
+
+    @property
+    def entries(self):
+        return self._manifest["entries"]
+
+    def InputHash(self, fileName):
+        """
+        sha256 of an input file, only re-hashed when its size or mtime changes
+        """
+        path = os.path.abspath(fileName)
+        st = os.stat(path)
+        memo = self._manifest["inputs"].get(path)
+        if memo is None or memo["size"] != st.st_size or memo["mtime"] != st.st_mtime:
+            memo = {"size": st.st_size, "mtime": st.st_mtime, "sha256": FileHash(path)}
+            self._manifest["inputs"][path] = memo
+        return memo["sha256"]
+
+    def Key(self, inputHash, event, arrayXdim, arrayYdim):
+        desc = json.dumps([inputHash, int(event), int(arrayXdim), int(arrayYdim), self.params], sort_keys=True)
+        return hashlib.sha256(desc.encode()).hexdigest()[:24]
+
+    def Path(self, key, event, arrayXdim, arrayYdim):
+        """
+        tile file of a key, the event and dims are kept in the name for readability
+        """
+        return os.path.join(self.cacheDir, f"evt-{event}_x-{arrayXdim}_y-{arrayYdim}-{key[:12]}{TILE_EXT}")
+
+    def Lookup(self, input_file, event, arrayXdim, arrayYdim):
+        """
+        Returns tuple of (key, path, valid), where valid is true if the cached
+        tile exists and is intact. The entry's last use is updated when valid.
+        """
+        key = self.Key(self.InputHash(input_file), event, arrayXdim, arrayYdim)
+        path = self.Path(key, event, arrayXdim, arrayYdim)
+        entry = self.entries.get(key)
+        valid = (entry is not None and os.path.isfile(path) and
+                 os.path.getsize(path) == entry["bytes"] and IsTileFile(path))
+        if valid:
+            entry["lastUsed"] = time.time()
+        return key, path, valid
+
+    def Record(self, key, path, input_file, event, arrayXdim, arrayYdim):
+        """
+        add a newly generated tile to the manifest
+        """
+        self.entries[key] = {
+            "file": os.path.basename(path),
+            "input": os.path.abspath(input_file),
+            "inputHash": self.InputHash(input_file),
+            "event": int(event),
+            "dims": [int(arrayXdim), int(arrayYdim)],
+            "params": self.params,
+            "bytes": os.path.getsize(path),
+            "created": time.time(),
+            "lastUsed": time.time(),
+        }
+
+    def Report(self, prune=False, checkParams=True):
+        """
+        Check every entry against the current inputs and parameters. Entries are
+        invalid if their tile is missing or corrupt, their input no longer exists
+        or has changed, or they were extracted with different parameters
+        (only if checkParams).
+
+        Returns a dictionary of reason -> list of keys, invalid entries and their
+        tiles are removed if prune.
+        """
+        report = {"valid": [], "missing tile": [], "input missing": [], "input changed": [], "params changed": []}
+        for key, entry in self.entries.items():
+            path = os.path.join(self.cacheDir, entry["file"])
+            if not os.path.isfile(path) or os.path.getsize(path) != entry["bytes"] or not IsTileFile(path):
+                reason = "missing tile"
+            elif not os.path.isfile(entry["input"]):
+                reason = "input missing"
+            elif self.InputHash(entry["input"]) != entry["inputHash"]:
+                reason = "input changed"
+            elif checkParams and entry["params"] != self.params:
+                reason = "params changed"
+            else:
+                reason = "valid"
+            report[reason].append(key)
+
+        if prune:
+            for reason, keys in report.items():
+                if reason == "valid":
+                    continue
+                for key in keys:
+                    self._Remove(key)
+        return report
+
+    def Evict(self, maxBytes=None, keep=()):
+        """
+        Remove least recently used tiles until the cache fits within maxBytes.
+        Keys in keep, ie the tiles of a running sweep, are never evicted.
+        Tiles on disk which are not in the manifest are removed first.
+
+        Returns the number of bytes removed.
+        """
+        maxBytes = self.maxBytes if maxBytes is None else maxBytes
+        removed = 0
+        known = {entry["file"] for entry in self.entries.values()}
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(TILE_EXT) and name not in known:
+                path = os.path.join(self.cacheDir, name)
+                removed += os.path.getsize(path)
+                os.remove(path)
+        if maxBytes is None:
+            return removed
+
+        keep = set(keep)
+        total = sum(entry["bytes"] for entry in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["lastUsed"]):
+            if total <= maxBytes:
+                break
+            if key in keep:
+                continue
+            total -= entry["bytes"]
+            removed += entry["bytes"]
+            self._Remove(key)
+        return removed
+
+    def _Remove(self, key):
+        entry = self.entries.pop(key)
+        path = os.path.join(self.cacheDir, entry["file"])
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def Save(self):
+        """
+        write the manifest, replaced atomically
+        """
+        manifest = os.path.join(self.cacheDir, MANIFEST)
+        with open(manifest + ".tmp", "w") as f:
+            json.dump(self._manifest, f, indent=1)
+        os.replace(manifest + ".tmp", manifest)
+
+    def TotalBytes(self):
+        return sum(entry["bytes"] for entry in self.entries.values())
+
+
+def PrintReport(report):
+    for reason, keys in report.items():
+        print(f"{reason:>16}: {len(keys)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="inspect and trim a neutrino tile cache")
+    parser.add_argument("cacheDir")
+    parser.add_argument("--report", action="store_true", help="print the invalidation report")
+    parser.add_argument("--prune", action="store_true", help="remove invalid entries")
+    parser.add_argument("--max-gb", type=float, help="evict least recently used tiles down to this size")
+    args = parser.parse_args(argv)
+
+    # the extraction parameters are only known to the sweep, so they are not checked here
+    cache = TileCache(args.cacheDir)
+    if args.report or args.prune:
+        PrintReport(cache.Report(prune=args.prune, checkParams=False))
+    if args.max_gb is not None:
+        removed = cache.Evict(int(args.max_gb * 1e9))
+        print(f"evicted {removed/1e6:.1f} MB, cache is now {cache.TotalBytes()/1e6:.1f} MB")
+    cache.Save()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sys
+
+import numpy as np
+from QpixAsic import AsicWord, AsicDirMask
+from QpixAsicArray import QpixAsicArray
+from QpixDataFormat import TRACE_DTYPE
+
+## Differential trace harness. A QpixAsicArray with EnableTrace() records every
+## ReceiveByte it processes; two runs of the same seed and input should produce
+## identical traces, no matter how the engine underneath is implemented.
+##
+## The golden traces within traces/ are recorded from the QpixTest scenarios
+## below with the reference engine. Regenerate them only when a change to the
+## transaction order is intended:
+##   python QpixTrace.py golden
+##   python QpixTrace.py check
+##   python QpixTrace.py diff ref.npy test.npy
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces")
+
+SEED = 2
+MAX_TIME = 10
+INT_PRD = 0.5
+PUSH_TIME = 1
+PUSH_HITS = 10
+
+# (route, nrows, ncols, push), mirroring the QpixTest daq read and push tests
+GOLDEN_SCENARIOS = [
+    ("snake", 2, 2, False),
+    ("snake", 2, 3, False),
+    ("snake", 4, 4, False),
+    ("left", 2, 2, False),
+    ("left", 2, 3, False),
+    ("left", 4, 4, False),
+    ("trunk", 4, 4, False),
+    ("left", 2, 2, True),
+    ("left", 2, 3, True),
+]
+
+
+def ScenarioName(route, nrows, ncols, push):
+    return f"{route}_{nrows}x{ncols}_{'push' if push else 'pull'}"
+
+
+def ScenarioFile(route, nrows, ncols, push, traceDir=TRACE_DIR):
+    return os.path.join(traceDir, ScenarioName(route, nrows, ncols, push) + ".npy")
+
+
+def RunScenario(route, nrows, ncols, push=False, seed=SEED):
+    """
+    Run a seeded QpixTest style scenario and return its trace.
+
+    Pull scenarios inject up to 12 random hits per ASIC over MAX_TIME and run the
+    interrogate procedure of run_array_interrogate. Push scenarios follow
+    test_asic_process_push, stepping Process over PUSH_TIME.
+    """
+    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+    array = QpixAsicArray(nrows, ncols, nPixs=16, fNominal=30e6, pctSpread=0.05, deltaT=1e-5,
+                          timeEpsilon=1e-6, timeout=15e4, debug=0, seed=seed)
+    array.EnableTrace()
+
+    if route == "trunk":
+        array.Route(route, transact=False, pos=int(ncols/2)-1)
+    else:
+        array.Route(route, transact=False)
+
+    if push:
+        array.SetPushState(enabled=True, transact=False)
+        for asic in array:
+            asic.InjectHits(sorted(rng.uniform(1e-10, PUSH_TIME, PUSH_HITS)))
+        curT = 0
+        while curT < PUSH_TIME + 1e-4 * nrows * ncols:
+            curT += array._deltaT
+            array.Process(curT)
+        return array.Trace()
+
+    maxTime = 0
+    for asic in array:
+        hits = sorted(rng.uniform(1e-8, MAX_TIME, rng.integers(13)))
+        if len(hits) > 0:
+            asic.InjectHits(hits)
+            maxTime = max(maxTime, hits[-1])
+
+    dT = 0
+    while dT <= maxTime + INT_PRD:
+        dT += INT_PRD
+        array.Interrogate(INT_PRD)
+
+    # drain the array, as run_array_interrogate does
+    if route == "snake":
+        procT = ncols * nrows * 1e-3
+    else:
+        procT = (ncols + nrows) * 1e-3
+    while dT <= 10*procT + maxTime + INT_PRD:
+        dT += array._deltaT
+        array.Process(dT)
+
+    return array.Trace()
+
+
+def SaveTrace(fileName, trace):
+    dirName = os.path.dirname(fileName)
+    if dirName:
+        os.makedirs(dirName, exist_ok=True)
+    np.save(fileName, np.asarray(trace, dtype=TRACE_DTYPE))
+
+
+def LoadTrace(fileName):
+    trace = np.load(fileName)
+    assert trace.dtype == TRACE_DTYPE, f"{fileName} is not a QpixAsicArray trace"
+    return trace
+
+
+def DiffTraces(ref, test, timeTol=0.0):
+    """
+    Find the first record at which two traces diverge.
+
+    ARGS:
+        ref, test - TRACE_DTYPE arrays
+        timeTol   - absolute tolerance (s) on the Time field
+
+    Returns None if the traces match, else a dict of:
+        index  - position of the first divergent record
+        fields - names of the fields which differ, or ["length"] if one trace ended
+        ref    - the ref record at index, None if the ref trace ended
+        test   - the test record at index, None if the test trace ended
+    """
+    n = min(len(ref), len(test))
+    diff = np.zeros(n, dtype=bool)
+    for name in TRACE_DTYPE.names:
+        if name == "Time":
+            diff |= np.abs(ref["Time"][:n] - test["Time"][:n]) > timeTol
+        else:
+            diff |= ref[name][:n] != test[name][:n]
+
+    if np.any(diff):
+        i = int(np.argmax(diff))
+        fields = [name for name in TRACE_DTYPE.names if
+                  (abs(ref[i][name] - test[i][name]) > timeTol if name == "Time" else ref[i][name] != test[i][name])]
+        return {"index": i, "fields": fields, "ref": ref[i], "test": test[i]}
+
+    if len(ref) != len(test):
+        return {"index": n, "fields": ["length"],
+                "ref": ref[n] if n < len(ref) else None,
+                "test": test[n] if n < len(test) else None}
+
+    return None
+
+
+def FormatRecord(rec):
+    """
+    readable single line of a trace record
+    """
+    if rec is None:
+        return "<end of trace>"
+    node = "DaqNode" if rec["Row"] < 0 else f"({rec['Row']},{rec['Col']})"
+    src = "DaqNode" if rec["OriginRow"] < 0 else f"({rec['OriginRow']},{rec['OriginCol']})"
+    return (f"t={rec['Time']:.9f} {node:>8} <- {AsicDirMask(int(rec['Dir'])).name:<5} "
+            f"{AsicWord(int(rec['WordType'])).name:<7} from {src:>8} tag={rec['Tag']}")
+
+
+def PrintDiff(ref, test, div, context=3):
+    """
+    print the records surrounding a divergence found by DiffTraces
+    """
+    i = div["index"]
+    print(f"traces diverge at record {i} on {', '.join(div['fields'])} ({len(ref)} ref, {len(test)} test records)")
+    for j in range(max(0, i-context), i):
+        print(f"  {j:8d}   {FormatRecord(ref[j])}")
+    print(f"- {i:8d}   {FormatRecord(div['ref'])}")
+    print(f"+ {i:8d}   {FormatRecord(div['test'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="record and compare QpixAsicArray ReceiveByte traces")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    d = sub.add_parser("diff", help="report the first divergence between two trace files")
+    d.add_argument("ref")
+    d.add_argument("test")
+    d.add_argument("--time-tol", type=float, default=0.0)
+    d.add_argument("--context", type=int, default=3)
+
+    g = sub.add_parser("golden", help="record the golden traces of the QpixTest scenarios")
+    g.add_argument("--dir", default=TRACE_DIR)
+
+    c = sub.add_parser("check", help="compare the current engine against the golden traces")
+    c.add_argument("--dir", default=TRACE_DIR)
+    c.add_argument("--time-tol", type=float, default=0.0)
+    c.add_argument("--context", type=int, default=3)
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "diff":
+        ref, test = LoadTrace(args.ref), LoadTrace(args.test)
+        div = DiffTraces(ref, test, args.time_tol)
+        if div is None:
+            print(f"traces match, {len(ref)} records")
+            return 0
+        PrintDiff(ref, test, div, args.context)
+        return 1
+
+    failed = 0
+    for scenario in GOLDEN_SCENARIOS:
+        fileName = ScenarioFile(*scenario, traceDir=args.dir)
+        trace = RunScenario(*scenario)
+        if args.cmd == "golden":
+            SaveTrace(fileName, trace)
+            print(f"wrote {len(trace)} records to {fileName}")
+            continue
+        ref = LoadTrace(fileName)
+        div = DiffTraces(ref, trace, args.time_tol)
+        if div is None:
+            print(f"{ScenarioName(*scenario)}: match, {len(ref)} records")
+        else:
+            failed += 1
+            print(f"{ScenarioName(*scenario)}: ", end="")
+            PrintDiff(ref, trace, div, args.context)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
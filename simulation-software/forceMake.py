@@ -1,4 +1,9 @@
 #!/usr/bin/env python3
+import os
+import sys
+from QpixTile import SaveTile, WindowTiles, TILE_EXT
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from scripts.neutMakeJson import asicGroups
 bestX = 281
 bestY = 561
 bestPos = 205640
@@ -28,12 +33,12 @@ def makeNumpy(filtered_df, time_start=0, time_end=None):
     df = pd.DataFrame(pd_data)
     # count these as done in Simulation "Top Left" Asic is (0,0) : (row, col)
     # create X
-    df['tileX'] = ((df['pX'] - 1) / xDIM).map(int)
-    df["AsicX"] = ((df["pX"] - 1) / channelXdim).map(int)
+    df['tileX'] = ((df['pX'] - 1) / xDIM).astype(int)
+    df["AsicX"] = ((df["pX"] - 1) / channelXdim).astype(int)
 
     # create Y
-    df['tileY'] = ((df['pY'] - 1) / yDIM).map(int)
-    df["AsicY"] = ((df["pY"] - 1) / channelYdim).map(int)
+    df['tileY'] = ((df['pY'] - 1) / yDIM).astype(int)
+    df["AsicY"] = ((df["pY"] - 1) / channelYdim).astype(int)
 
     # create N, unique ASIC / Tile numbers to easily histogram
     df['tileN'] = df['tileX'] + df['tileY'] * ceil(xMAX / xDIM)
@@ -42,8 +47,8 @@ def makeNumpy(filtered_df, time_start=0, time_end=None):
     # for each asic, it should only number a nPix within it's dimensions channelXdim *channelYdim
     # we chose X-dim as the "row" and Y-dim as the "column", to be consistent with the
     # coordinates for the tile / simulation dimensions
-    npx = ((df["pX"]) - channelXdim*df["AsicX"] - 1).map(int)
-    npy = ((df["pY"]) - channelYdim*df["AsicY"] - 1).map(int)
+    npx = ((df["pX"]) - channelXdim*df["AsicX"] - 1).astype(int)
+    npy = ((df["pY"]) - channelYdim*df["AsicY"] - 1).astype(int)
     df["nPix"] = npx + channelYdim*npy
     df["PixN"] = df['pX'] + (df['pY'] ) * xMAX # include -1 since pY is one counted
 
@@ -64,27 +69,52 @@ def makeJson(filtered_df, arrayXdim=16, arrayYdim=16, outf=out_file, time_start=
     tiledf["hits"] = []
 
     # normalize asic numbers: this is for the simulation input which "0 numbers" the asic's within it's rows / cols
-    hitX = fdf["AsicX"].unique()
-    hitY = fdf["AsicY"].unique()
-    minX = min(hitX)
-    minY = min(hitY)
-
-    # build the hits tuple for each asic within the tile
-    for x in hitX:
-        for y in hitY:
-            asicResets = fdf[ (fdf["AsicX"] == x) & (fdf["AsicY"] == y) ][["Reset","nPix"]].values.tolist()
-            arrayX = x if minX == 0 else int(x%minX)
-            arrayY = y if minY == 0 else int(y%minY)
-            if time_end is not None:
-                asicResets = np.array(asicResets) - time_start
-                asicResets = asicResets.tolist()
-            tiledf["hits"].append([arrayX, arrayY, list(asicResets)])
-
-    # store the values within a json file
+    minX = fdf["AsicX"].min()
+    minY = fdf["AsicY"].min()
+
+    # build the hits tuple for each occupied asic within the tile
+    for x, y, asicResets in asicGroups(fdf):
+        arrayX = x if minX == 0 else int(x%minX)
+        arrayY = y if minY == 0 else int(y%minY)
+        if time_end is not None:
+            # only the reset times are shifted, the nPix column is left alone
+            asicResets = [[reset - time_start, pix] for reset, pix in asicResets]
+        tiledf["hits"].append([int(arrayX), int(arrayY), asicResets])
+
+    # store the values within a binary tile, or a json file
+    if outf.endswith(TILE_EXT):
+        SaveTile(outf, tiledf)
+        print("saved file", outf)
+        return
     import json
     with open(outf, "w") as outputFile:
         json.dump(tiledf, outputFile, indent=4)
         print("saved file", outputFile)
         outputFile.close()
 
+def makeWindows(filtered_df, arrayXdim=16, arrayYdim=16, outf=out_file, time_start=0, time_end=1000, window=10, step=None):
+    """
+    write a binary tile for every window of the run, see QpixTile.WindowTiles
+    args: filtered_pd_df - filtered RDataFrame
+          outf - base name of the tiles, written as <outf>_<t0>-<t1>.qtile
+          step - spacing of the windows, window for consecutive windows, less for sliding
+    """
+    fdf = makeNumpy(filtered_df)
+
+    # normalize asic numbers over the whole run, so every window shares them
+    minX = fdf["AsicX"].min()
+    minY = fdf["AsicY"].min()
+    rows = fdf["AsicX"].values if minX == 0 else fdf["AsicX"].values % minX
+    cols = fdf["AsicY"].values if minY == 0 else fdf["AsicY"].values % minY
+
+    base = os.path.splitext(outf)[0]
+    files = []
+    for t0, tile in WindowTiles(rows, cols, fdf["Reset"].values, fdf["nPix"].values, arrayXdim, arrayYdim,
+                                time_start, time_end, window, step):
+        fileName = f"{base}_{t0:g}-{t0+window:g}{TILE_EXT}"
+        tile.Save(fileName)
+        files.append(fileName)
+    print(f"saved {len(files)} window tiles to {base}_*{TILE_EXT}")
+    return files
+
 makeJson(fdf, outf="./1k_rtd_data_200-210.json", time_start=200, time_end=210)
@@ -1,15 +1,16 @@
 #include "neutAna.hpp"
 #include <iostream>
+#include <cstdlib>
 
 int main(int argc, char** argv){
 
     std::string input_name;
     std::string output_name;
-    if(argc == 3){
+    if(argc == 3 || argc == 4){
         output_name = argv[2];
         std::cout << "saving arg name: " << output_name << std::endl;
-    } else if(argc != 3){
-        std::cout << "must provide input file and output file name.\n";
+    } else {
+        std::cout << "must provide input file and output file name, and optionally the number of threads.\n";
         std::cout << "nArgs: " << argc << std::endl;
         return -1;
     }
@@ -19,7 +20,9 @@ int main(int argc, char** argv){
     if(tf->IsZombie()){std::cout << "warning unable to open file!\n";return -1;};
     tf->Close();
 
-    ROOT::EnableImplicitMT();
+    // 0 threads uses every core
+    int nThreads = argc == 4 ? std::atoi(argv[3]) : 0;
+    ROOT::EnableImplicitMT(nThreads);
     ROOT::RDataFrame rdf = ROOT::RDataFrame("event_tree", input_name.c_str());
     std::cout << "found tree with entries: " << rdf.Count().GetValue() << std::endl;
 